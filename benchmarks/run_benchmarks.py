@@ -0,0 +1,280 @@
+import argparse
+import concurrent.futures
+import contextlib
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR)) # benchmark the working tree, not an installed copy
+sys.path.insert(0, BENCHMARK_DIR)
+
+from dataintegrator import DataIntegrator as di
+import synthetic
+
+
+# Benchmarks of the main functions of DataIntegrator on synthetic data (see synthetic.py).
+# Every run of a step is done in a new process, after the inputs of the step are loaded, so that the time and peak
+# memory of the step are measured alone. The results are appended to a JSON lines file, one record per run, and two
+# result files (e.g. of two versions) can be compared with --compare.
+#
+#   python benchmarks/run_benchmarks.py --sizes 100k 1M --output results.jsonl
+#   python benchmarks/run_benchmarks.py --compare old.jsonl new.jsonl
+
+STEPS = ["read_data", "filter_bi_allelic", "deduplicate", "sort_by_chr_bp", "lift_over", "query_data",
+         "add_rsid", "flip_strand", "align_effect_allele", "save_data"]
+
+
+
+
+"""Function to generate the synthetic inputs of one size, files already generated are reused
+
+    Args:
+        work_dir (str): the directory of the inputs, one sub directory per size.
+        rows (int): number of rows of the study.
+    Returns:
+        python dictionary: return the paths of the study ("gwas"), the reference ("reference"), the chain file ("chain")
+            and the dbSnp153 index ("dbsnp")
+"""
+def prepare_inputs(work_dir, rows):
+    size_dir = os.path.join(work_dir, str(rows))
+    os.makedirs(size_dir, exist_ok=True)
+    paths = {
+        "gwas": os.path.join(size_dir, "gwas.tsv.gz"),
+        "reference": os.path.join(size_dir, "reference.tsv.gz"),
+        "dbsnp_bed": os.path.join(size_dir, "dbSnp153.bed.gz"),
+        "dbsnp": os.path.join(size_dir, "dbSnp153_index"),
+        "chain": os.path.join(work_dir, "hg19ToSynthetic.over.chain.gz"),
+    }
+    done = os.path.join(size_dir, "done")
+    if not os.path.exists(done):
+        print("generating inputs of", rows, "rows in", size_dir)
+        gwas = synthetic.make_gwas(paths["gwas"], rows)
+        synthetic.make_reference(paths["reference"], gwas)
+        synthetic.make_dbsnp_bed(paths["dbsnp_bed"], gwas)
+        del gwas
+        with open(done, "w") as f:
+            f.write("")
+    if not os.path.exists(paths["chain"]):
+        synthetic.make_chain(paths["chain"])
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        di.build_dbsnp_index(paths["dbsnp_bed"], paths["dbsnp"]) # only built once, resumed otherwise
+    return paths
+
+
+
+
+"""Function to run one step once in the current process and measure it
+
+    Args:
+        step (str): the name of the step, one of STEPS.
+        paths (python dictionary): the paths returned by prepare_inputs.
+    Returns:
+        python dictionary: return the measurements of the run
+"""
+def run_step(step, paths):
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        func, rows_in = _setup_step(step, paths)
+        start_rss = _current_rss_mb()
+        _reset_peak_rss()
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        result = func()
+        wall = time.perf_counter() - start_wall
+        cpu = time.process_time() - start_cpu
+        peak_rss = _peak_rss_mb()
+    return {
+        "wall_s": wall,
+        "cpu_s": cpu,
+        "rows_in": rows_in,
+        "rows_out": len(result) if isinstance(result, pd.DataFrame) else None,
+        "rows_per_s": rows_in / wall if wall > 0 else None,
+        "start_rss_mb": start_rss,
+        "peak_rss_mb": peak_rss,
+    }
+
+
+
+
+"""Function to run the benchmarks and append the results to a JSON lines file
+
+    Args:
+        sizes (list): numbers of rows of the study.
+        steps (list): the steps to run, among STEPS.
+        output (str): path of the JSON lines file of the results.
+        work_dir (str): the directory of the synthetic inputs.
+        repeat (int): number of runs of each step. Default to 1.
+    Returns:
+        list: return the result records
+"""
+def run_benchmarks(sizes, steps, output, work_dir, repeat=1):
+    info = _environment()
+    records = []
+    for rows in sizes:
+        paths = prepare_inputs(work_dir, rows)
+        for step in steps:
+            for i in range(repeat):
+                # a new process for every run, so that the peak memory of one run does not hide the next one
+                with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                    measures = executor.submit(run_step, step, paths).result()
+                record = dict(info, size=rows, step=step, run=i, **measures)
+                records.append(record)
+                with open(output, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+                print("%-20s %10d rows  %8.3f s  %12.0f rows/s  peak %8.1f MB" % (step, rows, record["wall_s"], record["rows_per_s"] or 0, record["peak_rss_mb"]))
+    return records
+
+
+
+
+"""Function to compare two result files, using the median of the runs of each size and step
+
+    Args:
+        old_path (str): path of the JSON lines file of the baseline.
+        new_path (str): path of the JSON lines file to be compared with the baseline.
+        threshold (float): ratio of time or peak memory (new / old) above which a step is reported as a regression. Default to 1.1.
+    Returns:
+        pandas.DataFrame: return one row per size and step, with the medians and their ratios
+"""
+def compare_results(old_path, new_path, threshold=1.1):
+    old = _median_results(old_path)
+    new = _median_results(new_path)
+    table = old.join(new, how="inner", lsuffix="_old", rsuffix="_new")
+    table["time_ratio"] = table["wall_s_new"] / table["wall_s_old"]
+    table["memory_ratio"] = table["peak_rss_mb_new"] / table["peak_rss_mb_old"]
+    table["regression"] = (table["time_ratio"] > threshold) | (table["memory_ratio"] > threshold)
+    return table.reset_index()
+
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of DataIntegrator on synthetic data")
+    parser.add_argument("--sizes", nargs="+", default=["100k", "1M", "10M"], help="numbers of rows, e.g. 100k 1M 10M")
+    parser.add_argument("--steps", nargs="+", default=STEPS, choices=STEPS, help="the steps to run, default to all")
+    parser.add_argument("--repeat", type=int, default=1, help="number of runs of each step")
+    parser.add_argument("--output", default="benchmark_results.jsonl", help="JSON lines file the results are appended to")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "dataintegrator_benchmarks"), help="directory of the synthetic inputs, reused between runs")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files instead of running")
+    parser.add_argument("--threshold", type=float, default=1.1, help="ratio above which --compare reports a regression")
+    args = parser.parse_args()
+
+    if args.compare:
+        table = compare_results(args.compare[0], args.compare[1], args.threshold)
+        with pd.option_context("display.max_rows", None, "display.max_columns", None, "display.width", 200):
+            print(table[["size", "step", "wall_s_old", "wall_s_new", "time_ratio", "peak_rss_mb_old", "peak_rss_mb_new", "memory_ratio", "regression"]])
+        sys.exit(1 if table["regression"].any() else 0)
+    run_benchmarks([_parse_size(size) for size in args.sizes], args.steps, args.output, args.work_dir, args.repeat)
+
+
+
+
+# ---------------------------------------------------------------------------------------------
+# Helper Functions
+
+# helper function to load the inputs of a step (not measured), returns the call to measure and the number of input rows
+def _setup_step( step, paths):
+    if step == "read_data":
+        rows = sum(len(chunk) for chunk in pd.read_csv(paths["gwas"], sep="\t", usecols=[0], chunksize=1000000))
+        return (lambda: di.read_data(paths["gwas"], *synthetic.GWAS_COLUMNS)), rows
+    df = di.read_data(paths["gwas"], *synthetic.GWAS_COLUMNS)
+    if step == "filter_bi_allelic":
+        return (lambda: di.filter_bi_allelic(df)), len(df)
+    if step == "deduplicate":
+        return (lambda: di.deduplicate(df)), len(df)
+    if step == "sort_by_chr_bp":
+        return (lambda: di.sort_by_chr_bp(df)), len(df)
+    if step == "lift_over":
+        lo = di.create_lo("hg19", "synthetic", chain_file=paths["chain"])
+        return (lambda: di.lift_over(df, lo)), len(df)
+    if step == "query_data":
+        return (lambda: di.query_data(df, paths["dbsnp"])), len(df)
+    if step == "add_rsid":
+        data = di.query_data(df, paths["dbsnp"], fields=["name"])
+        return (lambda: di.add_rsid(df, data)), len(df)
+    if step == "flip_strand":
+        data = di.query_data(df, paths["dbsnp"], fields=["ref", "alts"])
+        return (lambda: di.flip_strand(df, data)), len(df)
+    if step == "align_effect_allele":
+        reference = di.read_data(paths["reference"], *synthetic.GWAS_COLUMNS)
+        return (lambda: di.align_effect_allele(reference, df)), len(df)
+    if step == "save_data":
+        output_dir = os.path.join(os.path.dirname(paths["gwas"]), "output") # overwritten by every run
+        os.makedirs(output_dir, exist_ok=True)
+        return (lambda: di.save_data(output_dir, df, "benchmark")), len(df)
+    raise ValueError("Illegal step " + str(step) + "! Choose among " + ", ".join(STEPS) + ".")
+
+# helper function to reset the peak memory of the process (linux only, elsewhere the peak since the start is used)
+def _reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+# helper function to get the memory used by the process now, in MB
+def _current_rss_mb():
+    return _proc_status_mb("VmRSS:")
+
+# helper function to get the peak memory used by the process since the last reset, in MB
+def _peak_rss_mb():
+    peak = _proc_status_mb("VmHWM:")
+    if peak is not None:
+        return peak
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB on linux
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+# helper function to read a memory field of /proc/self/status, in MB, None if it cannot be read
+def _proc_status_mb( field):
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(field):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+# helper function to describe the code and machine the benchmarks run on
+def _environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=BENCHMARK_DIR, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+# helper function to convert a size like "100k" or "10M" to a number of rows
+def _parse_size( size):
+    size = size.strip().lower()
+    scale = {"k": 1000, "m": 1000000}.get(size[-1], 1)
+    return int(float(size.rstrip("km")) * scale)
+
+# helper function to read a result file, with the median time and peak memory of the runs of each size and step
+def _median_results( path):
+    results = pd.read_json(path, lines=True)
+    return results.groupby(["size", "step"])[["wall_s", "peak_rss_mb"]].median()
+
+
+
+
+if __name__ == "__main__":
+    main()
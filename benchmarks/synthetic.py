@@ -0,0 +1,209 @@
+import gzip
+import numpy as np
+import pandas as pd
+
+
+# Generators of synthetic inputs for the benchmarks: GWAS summary statistics, a dbSnp153 bed dump (the format
+# of bigBedToBed output of dbSnp153.bb) and a chain file. All of them are random but reproducible from the seed.
+
+# chromosome sizes of hg19
+CHROM_SIZES = {
+    "1": 249250621, "2": 243199373, "3": 198022430, "4": 191154276, "5": 180915260, "6": 171115067,
+    "7": 159138663, "8": 146364022, "9": 141213431, "10": 135534747, "11": 135006516, "12": 133851895,
+    "13": 115169878, "14": 107349540, "15": 102531392, "16": 90354753, "17": 81195210, "18": 78077248,
+    "19": 59128983, "20": 63025520, "21": 48129895, "22": 51304566, "X": 155270560,
+}
+
+# column names of the GWAS files, in the order of the arguments of read_data
+GWAS_COLUMNS = ["chromosome", "base_pair_location", "variant_id", "effect_allele", "other_allele",
+                "effect_allele_frequency", "beta", "standard_error", "p_value"]
+
+_BASES = np.array(list("ACGT"))
+_COMPLEMENT = {"A": "T", "C": "G", "G": "C", "T": "A"}
+
+
+
+
+"""Function to generate the summary statistics of a synthetic GWAS study
+    rows are at random positions over the genome, in random order, with about 1% duplicated positions,
+    3% non bi-allelic rows and 5% rows without rs ID, so that every processing step has work to do.
+
+    Args:
+        path (str): path of the output file (tab separated, gzipped if it ends with ".gz"), columns as in GWAS_COLUMNS.
+        rows (int): number of rows.
+        seed (int): seed of the random generator. Default to 0.
+    Returns:
+        pandas.DataFrame: return the generated data
+"""
+def make_gwas(path, rows, seed=0):
+    rng = np.random.default_rng(seed)
+    chrom, bp = _random_positions(rng, rows)
+    duplicated = rng.random(rows) < 0.01
+    source = rng.integers(0, rows, rows)
+    chrom[duplicated] = chrom[source[duplicated]]
+    bp[duplicated] = bp[source[duplicated]]
+
+    a1, a2 = _random_allele_pairs(rng, rows)
+    multi = rng.random(rows) < 0.03
+    a1[multi] = a1[multi] + a2[multi] # e.g. "AG", not a single base
+    rsid = np.char.add("rs", rng.integers(1, 10**9, rows).astype(str))
+    rsid[rng.random(rows) < 0.05] = "."
+    eaf = rng.uniform(0.01, 0.99, rows)
+    beta = rng.normal(0, 0.05, rows)
+    se = rng.uniform(0.005, 0.05, rows)
+    p = rng.uniform(0, 1, rows)
+    df = pd.DataFrame(dict(zip(GWAS_COLUMNS, [chrom, bp, rsid, a1, a2, eaf, beta, se, p])))
+    df.to_csv(path, sep="\t", index=False, compression=_compression(path))
+    return df
+
+
+
+
+"""Function to generate a reference study for align_effect_allele from a synthetic GWAS study
+    about 90% of the rows of the study are kept, of which 30% have their alleles swapped and 5% other alleles.
+
+    Args:
+        path (str): path of the output file, in the same format as make_gwas.
+        gwas (pandas.DataFrame): the study returned by make_gwas.
+        seed (int): seed of the random generator. Default to 1.
+    Returns:
+        pandas.DataFrame: return the generated data
+"""
+def make_reference(path, gwas, seed=1):
+    rng = np.random.default_rng(seed)
+    df = gwas[rng.random(len(gwas)) < 0.9].sample(frac=1, random_state=seed).reset_index(drop=True)
+    a1 = df["effect_allele"].to_numpy(dtype=object)
+    a2 = df["other_allele"].to_numpy(dtype=object)
+    kind = rng.random(len(df))
+    swap = kind < 0.3
+    other = kind > 0.95
+    new_a1, new_a2 = _random_allele_pairs(rng, len(df))
+    df["effect_allele"] = np.where(swap, a2, np.where(other, new_a1, a1))
+    df["other_allele"] = np.where(swap, a1, np.where(other, new_a2, a2))
+    df["effect_allele_frequency"] = np.where(swap, 1 - df["effect_allele_frequency"], df["effect_allele_frequency"])
+    df["beta"] = np.where(swap, -df["beta"], df["beta"])
+    df.to_csv(path, sep="\t", index=False, compression=_compression(path))
+    return df
+
+
+
+
+"""Function to generate a synthetic dbSnp153 bed dump matching a synthetic GWAS study
+    about 80% of the positions of the study get a single base record, with the alleles of the study (60%),
+    swapped (20%) or on the other strand (20%), and 10% of them have a second alt allele. Records at random positions
+    (20% of the study size) are added, and the file is sorted by chromosome and position like bigBedToBed output.
+    Only the columns read by build_dbsnp_index are meaningful.
+
+    Args:
+        path (str): path of the output bed file (gzipped if it ends with ".gz"), to be used with build_dbsnp_index.
+        gwas (pandas.DataFrame): the study returned by make_gwas.
+        seed (int): seed of the random generator. Default to 2.
+    Returns:
+        int: return the number of records
+"""
+def make_dbsnp_bed(path, gwas, seed=2):
+    rng = np.random.default_rng(seed)
+    single = (gwas["effect_allele"].str.len() == 1).to_numpy()
+    study = gwas[single & (rng.random(len(gwas)) < 0.8)].drop_duplicates(subset=GWAS_COLUMNS[:2])
+    n = len(study)
+    a1 = study["effect_allele"].to_numpy(dtype=object)
+    a2 = study["other_allele"].to_numpy(dtype=object)
+    kind = rng.random(n)
+    flipped = kind > 0.8
+    swapped = (kind > 0.6) & ~flipped
+    ref = np.where(swapped, a1, a2)
+    alt = np.where(swapped, a2, a1)
+    ref[flipped] = [_COMPLEMENT[base] for base in ref[flipped]]
+    alt[flipped] = [_COMPLEMENT[base] for base in alt[flipped]]
+    alts = alt + ","
+    second = rng.random(n) < 0.1
+    alts[second] = alts[second] + _BASES[rng.integers(0, 4, int(second.sum()))].astype(object) + ","
+    names = study["variant_id"].to_numpy(dtype=object)
+    no_name = names == "."
+    names[no_name] = "rs" + rng.integers(1, 10**9, int(no_name.sum())).astype(str).astype(object)
+
+    extra = len(gwas) // 5
+    extra_chrom, extra_bp = _random_positions(rng, extra)
+    extra_ref, extra_alt = _random_allele_pairs(rng, extra)
+    records = pd.DataFrame({
+        "chrom": np.concatenate([study["chromosome"].to_numpy(dtype=object), extra_chrom]),
+        "chromEnd": np.concatenate([study["base_pair_location"].to_numpy(), extra_bp]),
+        "name": np.concatenate([names, np.char.add("rs", rng.integers(1, 10**9, extra).astype(str)).astype(object)]),
+        "ref": np.concatenate([ref, extra_ref]),
+        "alts": np.concatenate([alts, extra_alt + ","]),
+    })
+    records["chromStart"] = records["chromEnd"] - 1
+    records["altCount"] = records["alts"].str.count(",")
+    records["shiftBases"] = 0
+    records = records.sort_values(["chrom", "chromStart"], kind="stable")
+    records["chrom"] = "chr" + records["chrom"]
+    columns = ["chrom", "chromStart", "chromEnd", "name", "ref", "altCount", "alts", "shiftBases"]
+    records[columns].to_csv(path, sep="\t", index=False, header=False, compression=_compression(path))
+    return len(records)
+
+
+
+
+"""Function to generate a synthetic chain file from hg19 coordinates to a shifted build
+    every chromosome is one chain of aligned blocks of 100kb to 2Mb, with unaligned gaps of up to 5kb between
+    them, so that most positions move and a few cannot be converted.
+
+    Args:
+        path (str): path of the output chain file (gzipped if it ends with ".gz"), to be used as chain_file of create_lo.
+        seed (int): seed of the random generator. Default to 3.
+    Returns:
+        int: return the number of aligned blocks
+"""
+def make_chain(path, seed=3):
+    rng = np.random.default_rng(seed)
+    lines = []
+    count = 0
+    for i, (chrom, size) in enumerate(CHROM_SIZES.items()):
+        blocks = []
+        t_end = 0
+        q_end = 0
+        while True:
+            block = int(rng.integers(100000, 2000000))
+            if t_end + block >= size:
+                block = size - t_end
+                blocks.append(str(block))
+                t_end += block
+                q_end += block
+                break
+            dt = int(rng.integers(0, 5000))
+            dq = int(rng.integers(0, 5000))
+            blocks.append("%d\t%d\t%d" % (block, dt, dq))
+            t_end += block + dt
+            q_end += block + dq
+        lines.append("chain 1000 chr%s %d + 0 %d chr%s %d + 0 %d %d" % (chrom, size, t_end, chrom, q_end, q_end, i + 1))
+        lines.extend(blocks)
+        lines.append("")
+        count += len(blocks)
+    f = gzip.open(path, "wt", compresslevel=1) if path.endswith(".gz") else open(path, "w")
+    with f:
+        f.write("\n".join(lines) + "\n")
+    return count
+
+
+
+
+# ---------------------------------------------------------------------------------------------
+# Helper Functions
+
+# helper function to get the compression of an output file, a fast level keeps the generation of large inputs quick
+def _compression( path):
+    return {"method": "gzip", "compresslevel": 1} if path.endswith(".gz") else None
+
+# helper function to draw random positions, the number of positions of each chromosome follows its size
+def _random_positions( rng, rows):
+    names = np.array(list(CHROM_SIZES), dtype=object)
+    sizes = np.array(list(CHROM_SIZES.values()), dtype="int64")
+    chrom = rng.choice(len(names), rows, p=sizes / sizes.sum())
+    bp = rng.integers(1, sizes[chrom])
+    return names[chrom], bp
+
+# helper function to draw pairs of different single bases
+def _random_allele_pairs( rng, rows):
+    first = rng.integers(0, 4, rows)
+    second = (first + rng.integers(1, 4, rows)) % 4
+    return _BASES[first].astype(object), _BASES[second].astype(object)
@@ -2,11 +2,173 @@
 import numpy as np
 import pandas as pd
 from pyliftover import LiftOver
+from pyliftover.chainfile import open_liftover_chain_file
 import io
 import os
+import gzip
 import pyBigWig
 import pickle
 import time
+import json
+import tempfile
+import resource
+import sys
+import concurrent.futures
+import itertools
+import collections
+import hashlib
+import shutil
+import functools
+import inspect
+import threading
+import http.server
+import urllib.request
+import struct
+import zlib
+
+
+
+
+
+# ---------------------------------------------------------------------------------------------
+# Metrics and logging
+
+# settings of the package: silent turns the prints off, metrics_file_hook is the hook set by set_metrics_file
+_SETTINGS = {"silent": False, "metrics_file_hook": None}
+# functions called with the metrics record of every instrumented call
+_METRICS_HOOKS = []
+# records of the instrumented calls in progress, one stack per thread
+_METRICS_STACK = threading.local()
+
+
+
+
+"""Function to turn the prints of the package off (or on again)
+    the counts the functions print are still reported to the metrics hooks (see add_metrics_hook).
+
+    Args:
+        silent (boolean): if true, the functions of the package print nothing. Default to True.
+    Returns:
+        None
+"""
+def set_silent(silent=True):
+    _SETTINGS["silent"] = silent
+
+
+
+
+"""Function to add a hook called with the metrics of every call of the main functions
+    a metrics record is a python dictionary with:
+        "function": the name of the function.
+        "depth": 1 for a call made by the user, 2 for a call made by it (e.g. query_data in run_pipeline), ...
+        "wall_time", "cpu_time": wall clock and CPU time of the call, in seconds.
+        "rows_in", "rows_out": number of rows of the df argument and of the returned data frame (None if there is none).
+        "peak_memory_mb": peak memory of the process so far, in MB (since the start of the stage for calls made by
+            run_pipeline or run_batch, see run_pipeline).
+        "counts": the counts of the call, e.g. "not_found" and "cache_hits"/"cache_misses" for query_data,
+            "unchanged"/"aligned"/"align_errors" for align_effect_allele, "comment_<code>" for add_rsid and flip_strand.
+    The functions are only measured while at least one hook is set.
+
+    Args:
+        hook (function): function taking one metrics record, called after each call.
+    Returns:
+        function: return the hook, to be removed later with remove_metrics_hook
+"""
+def add_metrics_hook(hook):
+    _METRICS_HOOKS.append(hook)
+    return hook
+
+
+
+
+"""Function to remove a hook added by add_metrics_hook
+
+    Args:
+        hook (function): the hook to remove.
+    Returns:
+        None
+"""
+def remove_metrics_hook(hook):
+    if hook in _METRICS_HOOKS:
+        _METRICS_HOOKS.remove(hook)
+
+
+
+
+"""Function to write the metrics of every call of the main functions to a JSON lines file
+    one metrics record (see add_metrics_hook) per line is appended to the file.
+
+    Args:
+        path (str): path of the JSON lines file, None to stop writing metrics.
+    Returns:
+        None
+"""
+def set_metrics_file(path):
+    if _SETTINGS["metrics_file_hook"] is not None:
+        remove_metrics_hook(_SETTINGS["metrics_file_hook"])
+        _SETTINGS["metrics_file_hook"] = None
+    if path is not None:
+        _SETTINGS["metrics_file_hook"] = add_metrics_hook(functools.partial(_write_metrics_record, path))
+
+
+
+
+# helper function (decorator) to measure the calls of a function and report them to the metrics hooks
+def _instrumented( func):
+    parameters = list(inspect.signature(func).parameters)
+    df_position = parameters.index("df") if "df" in parameters else None
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _METRICS_HOOKS:
+            return func(*args, **kwargs)
+        df = kwargs.get("df", args[df_position] if df_position is not None and df_position < len(args) else None)
+        stack = _metrics_stack()
+        record = {"function": func.__name__, "depth": len(stack) + 1, "counts": {}}
+        stack.append(record)
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            stack.pop()
+        record["wall_time"] = time.perf_counter() - start_wall
+        record["cpu_time"] = time.process_time() - start_cpu
+        record["rows_in"] = len(df) if isinstance(df, pd.DataFrame) else None
+        record["rows_out"] = len(result) if isinstance(result, pd.DataFrame) else None
+        record["peak_memory_mb"] = _peak_memory_mb()
+        for hook in list(_METRICS_HOOKS):
+            hook(record)
+        return result
+    return wrapper
+
+# helper function to get the stack of the instrumented calls in progress in this thread
+def _metrics_stack():
+    if not hasattr(_METRICS_STACK, "records"):
+        _METRICS_STACK.records = []
+    return _METRICS_STACK.records
+
+# helper function to add to a count of the instrumented call in progress, if any
+def _count( name, value):
+    stack = _metrics_stack()
+    if stack:
+        counts = stack[-1]["counts"]
+        counts[name] = counts.get(name, 0) + int(value)
+
+# helper function to count the rows of each comment code of add_rsid / flip_strand
+def _count_comments( comment):
+    if _metrics_stack():
+        for code, count in zip(*np.unique(comment, return_counts=True)):
+            _count("comment_" + str(code), count)
+
+# helper function to print, unless the package is silent
+def _log(*args):
+    if not _SETTINGS["silent"]:
+        print(*args)
+
+# helper function to append a metrics record to a JSON lines file
+def _write_metrics_record( path, record):
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
 
 
 
@@ -15,7 +177,7 @@ import time
 """Function to read and format data for process
 
     Args:
-        input_path (str): The path of the input data.
+        input_path (str): The path of the input data (gzipped text, or a '.parquet'/ '.feather' file).
         Chr_col_name (str): The name of the column in the input data representing chromosome name.
         BP_col_name (str): The name of the column in the input data representing base pair position.
         SNP_col_name (str): The name of the column in the input data representing rs ID.
@@ -26,18 +188,19 @@ import time
         Se_col_name (str): The name of the column in the input data representing standard deviation.
         P_col_name (str): The name of the column in the input data representing p-value.
         separate_by (str): How the input data is separated. Default to "\t" (tab separated).
+        chunksize (int): if set, the data is read and formatted this many rows at a time. Default to None (read the whole data at once).
+        compact (boolean): if true, the data is returned in the compact schema (see to_compact). Default to False.
+        threads (int): the number of threads decompressing block-gzipped (BGZF, e.g. from bgzip) input. Other gzip files are
+            decompressed by pandas on one thread. Default to None (one per CPU), 1 to always use pandas.
 
     Returns:
-        pandas.DataFrame: return formatted data in the form of pandas DataFrame
+        pandas.DataFrame: return formatted data in the form of pandas DataFrame (an iterator of formatted chunks if chunksize is set)
 
 """
 
-def read_data( input_path, Chr_col_name, BP_col_name, SNP_col_name, A1_col_name, A2_col_name, EAF_col_name, Beta_col_name, Se_col_name, P_col_name, separate_by="\t"):
-    raw_df = pd.read_csv(input_path, compression='gzip', header=0, sep=separate_by,quotechar='"')
-    # print(raw_df)
-    result = raw_df.loc[:,[Chr_col_name, BP_col_name, SNP_col_name, A1_col_name, A2_col_name, EAF_col_name, Beta_col_name, Se_col_name, P_col_name]]
-    res = result.rename(
-        {
+@_instrumented
+def read_data( input_path, Chr_col_name, BP_col_name, SNP_col_name, A1_col_name, A2_col_name, EAF_col_name, Beta_col_name, Se_col_name, P_col_name, separate_by="\t", chunksize=None, compact=False, threads=None):
+    col_names = {
             Chr_col_name:"Chr",
             BP_col_name:"BP", 
             SNP_col_name:"SNP", 
@@ -47,26 +210,109 @@ def read_data( input_path, Chr_col_name, BP_col_name, SNP_col_name, A1_col_name,
             Beta_col_name:"Beta", 
             Se_col_name:"Se", 
             P_col_name:"P"
-        },axis="columns")
-    dtype = dict(Chr="string", BP='Int64', SNP="string", A1="string", A2="string", EAF=float, Beta=float, Se=float, P=float)
-    res = res.astype(dtype)
-    res["Chr"] = res["Chr"].str.upper()
-    res["Chr"] = res["Chr"].apply(lambda y: "X" if y=="23" else("Y" if y=="24" else y))
-    res["A1"] = res["A1"].str.upper()
-    res["A2"] = res["A2"].str.upper()
-    res["SNP"] = res["SNP"].str.lower()
-    dtype = dict(Chr="string", BP='Int64', SNP="string", A1="string", A2="string", EAF=float, Beta=float, Se=float, P=float)
-    res = res.astype(dtype)
-    return res
+        }
+    if _arrow_format(input_path) is not None: # parquet/ feather, only the needed columns are read
+        raw = _read_arrow(input_path, columns=list(col_names), chunksize=chunksize)
+        if chunksize is None:
+            return _format_data(raw, col_names, compact)
+        return (_format_data(raw_df, col_names, compact) for raw_df in raw)
+    if chunksize is not None:
+        reader = _read_gzip_text(input_path, threads, header=0, sep=separate_by,quotechar='"', usecols=list(col_names), chunksize=chunksize)
+        return (_format_data(raw_df, col_names, compact) for raw_df in reader)
+    raw_df = _read_gzip_text(input_path, threads, header=0, sep=separate_by,quotechar='"')
+    # print(raw_df)
+    return _format_data(raw_df, col_names, compact)
 
 
-def read_formatted_data(input_path):
-    raw_df = pd.read_csv(input_path, compression='gzip', header=0, quotechar='"')
-    dtype = dict(Chr="string", BP='Int64', SNP="string", A1="string", A2="string", EAF=float, Beta=float, Se=float, P=float)
-    res = raw_df.astype(dtype)
+"""Function to read data that has been formatted and saved by this package
+
+    Args:
+        input_path (str): The path of the formatted data ('.gz', '.parquet' or '.feather').
+        chunksize (int): if set, the data is read this many rows at a time. Default to None (read the whole data at once).
+        columns (list): if set, only these columns are read. Default to None (all columns).
+        filters (list): only for '.parquet'/ '.feather' data, conditions such as [("Chr", "==", "1"), ("BP", ">", 100000)].
+            Row groups whose statistics do not match the conditions are skipped without being read. Default to None.
+        compact (boolean): if true, the data is returned in the compact schema (see to_compact). Default to False.
+        threads (int): the number of threads decompressing block-gzipped data ('.tsv.gz' of save_data). Default to None
+            (one per CPU), 1 to always use pandas.
+
+    Returns:
+        pandas.DataFrame: return formatted data in the form of pandas DataFrame (an iterator of chunks if chunksize is set)
+
+"""
+
+@_instrumented
+def read_formatted_data(input_path, chunksize=None, columns=None, filters=None, compact=False, threads=None):
+    if compact:
+        data = read_formatted_data(input_path, chunksize, columns, filters, threads=threads)
+        return to_compact(data) if chunksize is None else (to_compact(chunk) for chunk in data)
+    dtype = _FORMATTED_DTYPES
+    if _arrow_format(input_path) is not None:
+        raw = _read_arrow(input_path, columns=columns, filters=filters, chunksize=chunksize)
+        if chunksize is None:
+            return _cast_columns(raw, dtype)
+        return (_cast_columns(raw_df, dtype) for raw_df in raw)
+    if filters is not None:
+        raise ValueError("filters can only be used on '.parquet' or '.feather' data.")
+    if chunksize is not None:
+        reader = _read_gzip_text(input_path, threads, sep=_text_separator(input_path), header=0, quotechar='"', usecols=columns, chunksize=chunksize)
+        return (_cast_columns(raw_df, dtype) for raw_df in reader)
+    raw_df = _read_gzip_text(input_path, threads, sep=_text_separator(input_path), header=0, quotechar='"', usecols=columns)
+    res = _cast_columns(raw_df, dtype)
     return res
 
 
+"""Function to convert formatted data to the compact schema
+    Chr, A1 and A2 are stored as categories (one byte codes, chromosomes ordered as 1-22, X, Y), BP as 32 bit integer,
+    SNP as the integer after "rs" and EAF, Beta and Se as 32 bit floats. If some IDs are not rs IDs (e.g. "." or
+    "1:123:A:G") they cannot be stored as integers, and SNP is kept as text so that no ID is lost.
+    For large data this takes several times less memory than the default schema, and the other functions keep the schema.
+
+    Args:
+        df (pandas.DataFrame): the formatted data.
+    Returns:
+        pandas.DataFrame: return the data in the compact schema.
+"""
+
+@_instrumented
+def to_compact(df):
+    cols = {}
+    if "Chr" in df.columns:
+        chroms = df["Chr"].dropna().astype(str).unique()
+        cols["Chr"] = pd.Categorical(df["Chr"], categories=_CHROMOSOMES + sorted(set(chroms) - set(_CHROMOSOMES)))
+    if "BP" in df.columns:
+        cols["BP"] = df["BP"].astype("UInt32")
+    if "SNP" in df.columns:
+        cols["SNP"] = _compact_rsid(df["SNP"])
+    alleles = [col for col in ["A1", "A2"] if col in df.columns]
+    if alleles:
+        allele_type = _allele_dtype(pd.concat([df[col] for col in alleles]))
+        for col in alleles:
+            cols[col] = df[col].astype(allele_type)
+    for col in ["EAF", "Beta", "Se"]:
+        if col in df.columns:
+            cols[col] = df[col].astype("float32")
+    return df.assign(**cols)
+
+
+
+
+"""Function to convert data in the compact schema back to the default schema
+
+    Args:
+        df (pandas.DataFrame): the data in the compact schema.
+    Returns:
+        pandas.DataFrame: return the data in the default schema.
+"""
+
+@_instrumented
+def from_compact(df):
+    dtype = dict(Chr="string", BP='Int64', A1="string", A2="string", EAF=float, Beta=float, Se=float, P=float)
+    return _cast_columns(_restore_rsid(df), dtype).astype({col: "string" for col in ["SNP", "added_rsid"] if col in df.columns})
+
+
+
+
 """Function to filter only bi-allelic cases in the data
 
     Args:
@@ -78,11 +324,9 @@ def read_formatted_data(input_path):
 
 """
 
+@_instrumented
 def filter_bi_allelic(df, rest=False):
-    len_mask = (df['A1'].str.len() == 1) & (df['A2'].str.len() == 1)
-    val_mask = (df['A1'] != "I") & (df['A1'] != "D") & (df['A1'] != "R") & (df['A2'] != "I") & (df['A2'] != "D") & (df['A2'] != "R")
-    chr_mask = df['Chr'].str.isdigit()
-    mask = len_mask & val_mask & chr_mask
+    mask = _bi_allelic_mask(df)
     if not rest:
         result = df[mask].reset_index(drop=True)
         return result
@@ -96,6 +340,8 @@ def filter_bi_allelic(df, rest=False):
 
 
 """Function to drop rows in data containing dduplicate keys (Chr + BP)
+    all the rows of a key that appears more than once are dropped. The keys are packed into 64 bit integers
+    (see sort_by_chr_bp), which are hashed, or compared with the next key when the data is sorted.
 
     Args:
         df (pandas.DataFrame): The data frame to be deduplicated.
@@ -105,79 +351,313 @@ def filter_bi_allelic(df, rest=False):
 
 """
 
+@_instrumented
 def deduplicate(df):
-    result = df.drop_duplicates(subset=['Chr', 'BP'], keep=False)
+    stats = {"rows": 0, "keys": 0}
+    result = _drop_duplicate_keys(df, _chr_bp_key(df), stats)
+    _print_dedup_log(stats)
     return result
 
 
+
+
+"""Function to drop rows containing duplicate keys (Chr + BP) from data larger than memory
+    as in deduplicate, all the rows of a key that appears more than once in the whole data are dropped.
+    Unsorted data is sorted on disk (see sort_in_chunks) and deduplicated while the sorted runs are merged,
+    so the result is sorted. Sorted data is deduplicated in a single pass without writing to disk.
+
+    Args:
+        chunks (iterator): the chunks of the data, e.g. returned by read_data or read_formatted_data with chunksize set.
+        sorted_input (boolean): if true, the chunks are already sorted by Chr and BP (see is_sorted_by_chr_bp). Default to False.
+        chunksize (int): the number of rows held in memory when merging the sorted runs. Default to 1000000.
+        temp_dir (str): the directory for the sorted runs. Default to None (the system temporary directory).
+    Returns:
+        iterator: return the deduplicated data as an iterator of pandas DataFrames
+"""
+def deduplicate_in_chunks(chunks, sorted_input=False, chunksize=1000000, temp_dir=None):
+    stats = {"rows": 0, "keys": 0}
+    if sorted_input:
+        pieces = _dedup_sorted_chunks(chunks, stats)
+    else:
+        pieces = _sort_chunks(chunks, [], True, chunksize, temp_dir, stats)
+    for piece in pieces:
+        yield piece
+    _print_dedup_log(stats)
+
+
 """Function to sort the data based on Chr and BP
+    chromosomes are ordered by number (1, 2, ..., 22), then X, Y, M, MT, then other names (e.g. unplaced contigs, or "01") in order of first appearance.
+    Chr + BP are packed into one 64 bit integer key per row, and data that is already sorted is not sorted again.
 
     Args:
         df (pandas.DataFrame): the data to be sorted
     Returns:
         pandas.DataFrame: return the sorted data
 """
+@_instrumented
 def sort_by_chr_bp(df):
-    def mixs(v):
-        try:
-            return int(v)
-        except ValueError:
-            return v
-    df = df.assign(chr_numeric = lambda x: x['Chr'].apply(lambda y: 23 if y=="X" else(24 if y=="Y" else int(y))))
-    result = df.sort_values(by=["chr_numeric", "BP"]).drop(['chr_numeric'], axis=1).reset_index(drop=True)
+    key = _chr_bp_key(df)
+    if _is_sorted(key):
+        return df.reset_index(drop=True)
+    result = df.take(np.argsort(key, kind="stable")).reset_index(drop=True)
     return result
 
 
 
 
+"""Function to check if the data is sorted based on Chr and BP (in the order of sort_by_chr_bp)
+
+    Args:
+        df (pandas.DataFrame): the data to be checked
+    Returns:
+        boolean: return True if the data is sorted
+"""
+def is_sorted_by_chr_bp(df):
+    return _is_sorted(_chr_bp_key(df))
+
+
+
+
+"""Function to sort data larger than memory based on Chr and BP (external merge sort)
+    every chunk is sorted and written to disk as a sorted run, chunks that continue the order of the previous chunk are
+    appended to the same run (so sorted data is written as one run and not sorted again), then the runs are merged
+    while only reading about chunksize rows at a time.
+
+    Args:
+        chunks (iterator): the chunks of the data, e.g. returned by read_data or read_formatted_data with chunksize set.
+        chunksize (int): the number of rows held in memory when merging the sorted runs. Default to 1000000.
+        temp_dir (str): the directory for the sorted runs. Default to None (the system temporary directory).
+    Returns:
+        iterator: return the sorted data as an iterator of pandas DataFrames
+"""
+def sort_in_chunks(chunks, chunksize=1000000, temp_dir=None):
+    return _sort_chunks(chunks, [], False, chunksize, temp_dir, None)
+
+
+
+
 """Function to query required data from dbSnp153
 
     Args:
         df (pandas.DataFrame): the data we want more info
-        link (str): path or link of the '.bb' file of dbSnp153 
+        link (str): path or link of the '.bb' file of dbSnp153, or the directory of a local index built by build_dbsnp_index
+        print_log (boolean): if true, the function will print the Chr + BP that cannot be matched with the genome build. Default to False.
+        window (int): if set, nearby positions within this many base pairs are fetched with one query and matched in memory.
+            This cuts the reads of the '.bb' file for dense (e.g. sorted GWAS) data. Default to None (one query per row).
+        workers (int): if set, the chromosomes are queried in this many worker processes, each opening its own '.bb' file. Default to None.
+        chunk_size (int): the maximum number of rows of one chromosome handled by one worker task. Default to 1000000.
+        cache_dir (str): if set, the results are cached in this directory, keyed by the '.bb' file (path, size and modified time,
+            or the link) and the Chr + BP. Only the Chr + BP not already cached are queried. Default to None (no cache).
+        fields (list): the dbSnp153 fields to return, among "name" (rs ID), "ref" and "alts". add_rsid only needs "name",
+            flip_strand only needs "ref" and "alts". Only these fields are parsed (with cache_dir, all the fields are parsed and
+            cached for later queries). Default to None (all fields).
+        block_cache_dir (str): if set and the link is remote, the '.bb' file is read through a local block cache in this
+            directory (see open_block_cache). Default to None (read the link directly).
     Returns:
-        pandas.DataFrame: return complete information from dbSnp153 as a python dictionary
+        pandas.DataFrame: return the dbSnp153 records found, one row per Chr + BP with the columns Chr, BP and the fields
+            (alts without the trailing comma, e.g. "A,T")
 """
 # link = "http://hgdownload.soe.ucsc.edu/gbdb/hg38/snp/dbSnp153.bb"
 
-def query_data(df, link="http://hgdownload.soe.ucsc.edu/gbdb/hg19/snp/dbSnp153.bb", print_log = False):
-    bb = pyBigWig.open(link)
-    result = {}
-    set_list = []
-    chrom = ""
-    log = []
-    not_found = 0
-    for row in df.itertuples():       
-        if str(row.Chr) == "23":
-            chrom = "chrX"
-        elif str(row.Chr) == "23":
-            chrom = "chrY"
-        else:
-            chrom = "chr" + str(row.Chr)
-        end_pos = row.BP
-        start_pos =end_pos - 1
-        # print(chrom, start_pos, end_pos)
-        try:
-            dat = bb.entries(chrom, start_pos, end_pos)
-        except RuntimeError:
-            log.append((chrom, start_pos, end_pos))
-        if dat != None:  
-            for i in dat:
-                reference_start = i[0]
-                reference_end = i[1]
-                raw_string = i[2]
-                if reference_start == start_pos and reference_end == end_pos:
-                    key = (str(row.Chr), reference_end)
-                    result[key] = raw_string
-        else:
-            not_found += 1
-    print(not_found, " cannot be found in dbSnp153")
-    if print_log:
-        print("The following Chr + BP cannot be matched with current genome build version")
-        print(log)
+@_instrumented
+def query_data(df, link="http://hgdownload.soe.ucsc.edu/gbdb/hg19/snp/dbSnp153.bb", print_log = False, window=None, workers=None, chunk_size=1000000, cache_dir=None, fields=None, block_cache_dir=None):
+    if fields is None:
+        fields = _DBSNP_FIELDS
+    for field in fields:
+        if field not in _DBSNP_FIELDS:
+            raise ValueError('Illegal field ' + str(field) + '! Choose among "name", "ref" and "alts".')
+    fields = [field for field in _DBSNP_FIELDS if field in fields]
+    if isinstance(link, dict) or os.path.isdir(link): # local index built by build_dbsnp_index
+        return _query_index(df, link, print_log, fields)
+    if block_cache_dir is not None and _is_remote(link):
+        open_block_cache(link, block_cache_dir)
+    block_stats = _block_cache_stats(link)
+    if cache_dir is not None:
+        # the cache is shared by the queries of any fields, so it keeps all of them
+        result, not_found, log = _query_cached(df, link, window, workers, chunk_size, cache_dir)
+        parsed_fields = _DBSNP_FIELDS
     else:
-        print(len(log), " does not be matched with current genome build")
-    return result
+        result, not_found, log = _query_bigbed(df, link, window, workers, chunk_size, fields)
+        parsed_fields = fields
+    for name, value in _block_cache_stats(link).items():
+        _count(name, value - block_stats[name])
+    _print_query_log(not_found, log, print_log)
+    return _dbsnp_frame(result, parsed_fields)[["Chr", "BP"] + fields]
+
+
+
+
+"""Function to open a local block cache for a remote '.bb' file (e.g. the UCSC link of dbSnp153)
+    a local HTTP server answers the range reads of pyBigWig from large aligned blocks of the file, each fetched once
+    and kept on disk in a size-bounded cache (the least recently used blocks are removed first). When the reads move
+    forward (sorted queries), the next blocks are fetched ahead in background threads. Once opened, query_data and
+    build_dbsnp_index read the link through the cache. pyBigWig must support remote files (pyBigWig.remote).
+
+    Args:
+        link (str): http(s) link of the '.bb' file.
+        cache_dir (str): the directory of the blocks, reused by later runs as long as the remote file does not change.
+        max_size_mb (int): the maximum size of the blocks kept on disk, in MB. Default to 2048.
+        block_size_mb (float): the size of the blocks fetched from the link, in MB. Default to 1.
+        prefetch (int): the number of blocks fetched ahead of forward reads, 0 to turn it off. Fewer are fetched ahead when
+            max_size_mb cannot hold them next to the blocks being read. Default to 4.
+    Returns:
+        str: return the local link of the cached file, which can be used wherever the link is accepted
+"""
+def open_block_cache(link, cache_dir, max_size_mb=2048, block_size_mb=1, prefetch=4):
+    if link in _BLOCK_CACHES:
+        return _BLOCK_CACHES[link]["local_link"]
+    size, version = _remote_file_info(link)
+    source = json.dumps({"link": link, "size": size, "version": version}, sort_keys=True)
+    block_dir = os.path.join(cache_dir, hashlib.sha1(source.encode()).hexdigest())
+    os.makedirs(block_dir, exist_ok=True)
+    cache = {
+        "link": link,
+        "size": size,
+        "block_dir": block_dir,
+        "block_size": int(block_size_mb * 1024 * 1024),
+        "max_size": int(max_size_mb * 1024 * 1024),
+        "used": sum(os.path.getsize(os.path.join(block_dir, name)) for name in os.listdir(block_dir) if name.endswith(".blk")),
+        "prefetch": prefetch,
+        "last_block": -1,
+        "window": range(0),
+        "lock": threading.Lock(),
+        "loading": {},
+        "stats": {"block_hits": 0, "block_fetches": 0, "block_prefetches": 0},
+        "executor": concurrent.futures.ThreadPoolExecutor(max_workers=max(1, prefetch)),
+    }
+    handler = type("_BlockCacheHandler", (_BlockCacheHandler,), {"cache": cache})
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    cache["server"] = server
+    cache["local_link"] = "http://127.0.0.1:" + str(server.server_address[1]) + "/" + link.rstrip("/").split("/")[-1]
+    _BLOCK_CACHES[link] = cache
+    return cache["local_link"]
+
+
+
+
+"""Function to close the block cache of a remote '.bb' file opened by open_block_cache, the blocks stay on disk
+
+    Args:
+        link (str): http(s) link of the '.bb' file.
+    Returns:
+        python dictionary: return the numbers of blocks read from disk ("block_hits"), fetched for a read ("block_fetches")
+            and fetched ahead ("block_prefetches") since the cache was opened
+"""
+def close_block_cache(link):
+    cache = _BLOCK_CACHES.pop(link)
+    cache["server"].shutdown()
+    cache["server"].server_close()
+    cache["executor"].shutdown(wait=True)
+    return dict(cache["stats"])
+
+
+
+
+"""Function to build a local memory-mapped index of dbSnp153
+    the index keeps one sorted array per field and per chromosome (position, rs ID as integer, ref and alt allele codes).
+    Only single base records are kept, which are the only records query_data can match.
+    The '.bb' file is read one chromosome per task (bed dumps one file per task), optionally in worker processes.
+    The finished tasks are recorded in the index directory, so an interrupted build can be run again to resume it.
+
+    Args:
+        source (str or list): path or link of the '.bb' file of dbSnp153, or path(s) of bed dumps of it (e.g. output of bigBedToBed, can be gzipped)
+        index_dir (str): the directory to write the index to
+        chroms (list): the chromosomes to be indexed, e.g. ["chr1", "chrX"]. Default to None (all chromosomes in the source).
+        window (int): the number of base pairs fetched from the '.bb' file at a time. Default to 1000000.
+        workers (int): if set, the tasks are run in this many worker processes. Default to None (one process).
+        resume (boolean): if true, the tasks finished by an earlier build of the same source into index_dir are skipped. Default to True.
+    Returns:
+        python dictionary: return the loaded index (see load_dbsnp_index)
+"""
+@_instrumented
+def build_dbsnp_index(source, index_dir, chroms=None, window=1000000, workers=None, resume=True):
+    os.makedirs(index_dir, exist_ok=True)
+    manifest = _read_index_manifest(index_dir, source, chroms) if resume else None
+    if manifest is not None and manifest["complete"]:
+        _log("index of " + str(source) + " is already built in " + index_dir)
+        return load_dbsnp_index(index_dir)
+    if manifest is None:
+        manifest = {"source": source, "chroms_requested": chroms, "complete": False, "chroms": {}, "done": {}}
+    tasks = _index_tasks(source, chroms)
+    todo = [(i, task) for i, task in enumerate(tasks) if str(i) not in manifest["done"]]
+    _log(len(tasks) - len(todo), " of ", len(tasks), " tasks already done")
+    parts_dir = os.path.join(index_dir, "parts")
+    if workers is None or workers <= 1:
+        outputs = ((i, _build_index_task(source, task, os.path.join(parts_dir, str(i)), chroms, window)) for i, task in todo)
+        for i, counts in outputs:
+            manifest["done"][str(i)] = counts
+            _write_index_manifest(index_dir, manifest)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_build_index_task, _bigbed_link(source), task, os.path.join(parts_dir, str(i)), chroms, window): i for i, task in todo}
+            for future in concurrent.futures.as_completed(futures):
+                manifest["done"][str(futures[future])] = future.result()
+                _write_index_manifest(index_dir, manifest)
+    manifest["chroms"] = _merge_index_parts(index_dir, parts_dir, [manifest["done"][str(i)] for i in range(len(tasks))])
+    manifest["complete"] = True
+    manifest["done"] = {}
+    _write_index_manifest(index_dir, manifest)
+    return load_dbsnp_index(index_dir)
+
+
+
+
+"""Function to load a dbSnp153 index built by build_dbsnp_index
+    the arrays are memory-mapped, so only the pages touched by a lookup are read from disk.
+
+    Args:
+        index_dir (str): the directory of the index
+    Returns:
+        python dictionary: return the index directory, the source it was built from and the arrays of each chromosome.
+"""
+def load_dbsnp_index(index_dir):
+    with open(os.path.join(index_dir, "index.json"), "r") as f:
+        manifest = json.load(f)
+    shards = {}
+    for chrom in manifest["chroms"]:
+        shards[chrom] = {field: np.load(os.path.join(index_dir, chrom + "." + field + ".npy"), mmap_mode="r") for field in _INDEX_DTYPES}
+    return {"index_dir": index_dir, "source": manifest["source"], "shards": shards}
+
+
+
+
+"""Function to look up the Chr + BP keys of a data frame in a dbSnp153 index
+
+    Args:
+        df (pandas.DataFrame): the data we want more info
+        index (python dictionary or str): the index returned by load_dbsnp_index, or the directory of the index
+    Returns:
+        pandas.DataFrame: return one row per matched key, with the Chr and BP of the key, the rs ID as integer and the ref/alt allele codes
+"""
+@_instrumented
+def lookup_dbsnp_index(df, index):
+    if not isinstance(index, dict):
+        index = load_dbsnp_index(index)
+    chrom_values = df["Chr"].astype(str)
+    bp_values = df["BP"].to_numpy(dtype="int64", na_value=-1)
+    found = []
+    for chrom, rows in chrom_values.groupby(chrom_values, sort=False).indices.items():
+        shard = index["shards"].get(_ucsc_chrom(chrom))
+        if shard is None:
+            continue
+        bp = bp_values[rows]
+        pos = shard["pos"]
+        idx = np.searchsorted(pos, bp)
+        idx[idx == len(pos)] = 0
+        hit = pos[idx] == bp
+        idx = idx[hit]
+        found.append(pd.DataFrame({
+            "Chr": chrom,
+            "BP": bp[hit],
+            "rsid": shard["rsid"][idx],
+            "ref": shard["ref"][idx],
+            "alt": shard["alt"][idx],
+        }))
+    if not found:
+        return pd.DataFrame({"Chr": pd.Series(dtype=str), "BP": pd.Series(dtype="int64"), "rsid": pd.Series(dtype="uint64"), "ref": pd.Series(dtype="uint8"), "alt": pd.Series(dtype="uint8")})
+    return pd.concat(found, ignore_index=True)
 
 """Function to save python data structure on disk
     Args:
@@ -220,14 +700,28 @@ def load_obj(obj_path ):
     Args:
         input_version (str): the genome build of the original data.
         output_version (str): the desired genome build you want to lift over to.
+        chain_file (str): path of a local '.over.chain' (or '.over.chain.gz') file. Default to None (the chain file is located or downloaded by pyliftover).
+        engine (str): "array" converts whole columns at once with a sorted array index of the chain file, "pyliftover" converts row by row with pyliftover. Default to "array".
     Returns:
         python dictionary: return the input version, output version and the liftover chain file.
 
 """
 
-def create_lo(input_version, output_version):
-    lo = LiftOver(input_version, output_version)
-    return {"input_version": input_version, "output_version":output_version, "lo":lo}
+@_instrumented
+def create_lo(input_version, output_version, chain_file=None, engine="array"):
+    if engine == "pyliftover":
+        lo = LiftOver(chain_file) if chain_file is not None else LiftOver(input_version, output_version)
+        return {"input_version": input_version, "output_version":output_version, "lo":lo}
+    elif engine == "array":
+        if chain_file is not None:
+            f = gzip.open(chain_file, "rb") if chain_file.endswith(".gz") else open(chain_file, "rb")
+        else:
+            f = open_liftover_chain_file(input_version, output_version)
+        chain_index = _build_chain_index(f)
+        f.close()
+        return {"input_version": input_version, "output_version":output_version, "chain_index":chain_index}
+    else:
+        raise ValueError('Illegal argument for engine! Choose between "array" and "pyliftover".')
 
 
 
@@ -243,6 +737,7 @@ def create_lo(input_version, output_version):
     Returns:
         pandas.DataFrame: return the data being lifted over to the desired genome build
 """
+@_instrumented
 def lift_over(df, lo_dict, keep_all=False, inplace= True):
     reference_table = _lift_over_basic(df, lo_dict)
     result = _lift_over_merge(df, reference_table)
@@ -254,6 +749,8 @@ def lift_over(df, lo_dict, keep_all=False, inplace= True):
         new_chr_col_name = lo_dict['output_version']+"_chr"
         new_pos_col_name = lo_dict['output_version']+"_pos"
         result = result[[new_chr_col_name, new_pos_col_name, "SNP", "A1", "A2", "EAF", "Beta", "Se", "P"]].rename({new_chr_col_name:"Chr", new_pos_col_name:"BP"}, axis="columns")
+        if isinstance(df["Chr"].dtype, pd.CategoricalDtype): # compact schema, keep the new Chr and BP compact
+            result = to_compact(result[["Chr", "BP"]]).join(result.drop(columns=["Chr", "BP"]))
     return result
 
 
@@ -264,36 +761,26 @@ def lift_over(df, lo_dict, keep_all=False, inplace= True):
 
     Args:
         df (pandas.DataFrame): the data to be added rs_ids
-        data (python dictionary): the dictionary containing required info from dbSnp153
+        data (pandas.DataFrame): the dbSnp153 records returned by query_data (needs the "name" field)
     Returns:
         pandas.DataFrame: return the data being added rs_ids.
 """
+@_instrumented
 def add_rsid(df, data, select_cols="drop_comments", filter_rows="drop"):
-    added_rsid = []
-    comment = []
-    for row in df.itertuples():
-        chrom = row.Chr
-        pos = row.BP
-        rs_id = row.SNP
-        key = (chrom, pos)
-        if key in data: # the row in the data can be found in dbSnp153
-            raw_string = data[key]
-            parsed_string = raw_string.split('\t')
-            data_rs_id = parsed_string[0] 
-            if pd.isna(rs_id): # rs_id is absence in original dataset
-                added_rsid.append(data_rs_id)
-                comment.append("A")
-            elif rs_id == data_rs_id: # if rs_id in original dataset is the same as dnSnp153
-                added_rsid.append(rs_id)
-                comment.append("S")
-            else: # find different rsid in dbSnp153, update with new
-                added_rsid.append(data_rs_id)
-                comment.append("D")
-        else:
-            added_rsid.append(pd.NA)
-            comment.append("NF")
+    data_rs_id = _join_dbsnp(df, data, ["name"])["name"]
+    if pd.api.types.is_integer_dtype(df["SNP"]): # compact schema, compare and add rs ID numbers
+        data_rs_id = _rsid_numbers(data_rs_id).astype(df["SNP"].dtype)
+    data_rs_id = data_rs_id.to_numpy(dtype=object, na_value=pd.NA)
+    rs_id = df["SNP"].to_numpy(dtype=object, na_value=pd.NA)
+    found = ~pd.isna(data_rs_id) # the row in the data can be found in dbSnp153
+    missing = pd.isna(rs_id) # rs_id is absence in original dataset
+    same = found & ~missing
+    same[same] = rs_id[same] == data_rs_id[same] # if rs_id in original dataset is the same as dnSnp153
+    # find different rsid in dbSnp153, update with new
+    comment = np.select([~found, missing, same], ["NF", "A", "S"], default="D")
+    _count_comments(comment)
     
-    result = df.assign(added_rsid = added_rsid)
+    result = df.assign(added_rsid = pd.array(data_rs_id, dtype=df["SNP"].dtype) if pd.api.types.is_integer_dtype(df["SNP"]) else data_rs_id)
     result = result.assign(comment=comment)
 
     # filter rows
@@ -330,57 +817,58 @@ def add_rsid(df, data, select_cols="drop_comments", filter_rows="drop"):
 
     Args:
         df (pandas.DataFrame): the data to be flipped to forward strand
-        data (python dictionary): the dictionary containing required info from dbSnp153
+        data (pandas.DataFrame): the dbSnp153 records returned by query_data (needs the "ref" and "alts" fields)
         keep_unconvertible (boolean): if true, the function will keep and mark the rows that are not flipped. Default to False.
 
     Returns:
         pandas.DataFrame: return the data being flipped to forward strand
 """
+@_instrumented
 def flip_strand( df, data, select_cols="drop_comments", filter_rows="drop"):
-    flipped_A1 = []
-    flipped_A2 =  []
-    comment = []
-    for row in df.itertuples():
-        chrom = row.Chr
-        pos = row.BP
-        A1 = row.A1
-        A2 = row.A2
-        key = (chrom, pos)
-        if key in data: # check if key in dnSnp153
-            cur_set = {A1, A2}
-            raw_string = data[key]
-            parsed_string = raw_string.split("\t")
-            data_a1 = [i for i in parsed_string[1] if i != ","]
-            data_a2 = [i for i in parsed_string[3] if i != ","]
-
-            if len(data_a1) == 1 and len(data_a2) == 1:
-                cur_set.add(data_a1[0])
-                cur_set.add(data_a2[0])
-                # print(cur_set)
-                if len(cur_set) == 4: # flip
-                    new_a1 = _flip(A1)
-                    new_a2 = _flip(A2)
-                    flipped_A1.append(new_a1)
-                    flipped_A2.append(new_a2)
-                    comment.append("F")
-                elif len(cur_set) == 2: # do not flip
-                    # print(i)
-                    flipped_A1.append(A1)
-                    flipped_A2.append(A2)
-                    comment.append("S")
-                else: # mark: what is this case? => original data T/C, dbsnp153 C/A: 10  94958283  rs111998500
-                    flipped_A1.append(data_a1[0])
-                    flipped_A2.append(data_a2[0])
-                    comment.append("D")
-            else: # tri-alleic snps in dbSnp153 -> mark
-                flipped_A1.append(pd.NA)
-                flipped_A2.append(pd.NA)
-                comment.append("ID")
-        else: # key not found
-            flipped_A1.append(pd.NA)
-            flipped_A2.append(pd.NA)
-            comment.append("NF") 
-
+    joined = _join_dbsnp(df, data, ["ref", "alts"])
+    found = joined["ref"].notna().to_numpy() # check if key in dnSnp153
+    data_a1, single_a1 = _parse_dbsnp_alleles(joined["ref"])
+    data_a2, single_a2 = _parse_dbsnp_alleles(joined["alts"])
+    # tri-alleic snps / indels in dbSnp153 -> mark
+    bi_allelic = found & single_a1 & single_a2
+
+    # encode the four alleles of each row as small integers, and count how many different alleles each row has
+    n = len(df)
+    alleles = np.concatenate([
+        df["A1"].to_numpy(dtype=object, na_value=pd.NA),
+        df["A2"].to_numpy(dtype=object, na_value=pd.NA),
+        data_a1,
+        data_a2,
+    ])
+    codes, uniques = pd.factorize(alleles)
+    codes = codes.reshape(4, n).T
+    sorted_codes = np.sort(codes[bi_allelic], axis=1)
+    n_alleles = np.zeros(n, dtype="int64")
+    n_alleles[bi_allelic] = 1 + (sorted_codes[:, 1:] != sorted_codes[:, :-1]).sum(axis=1)
+
+    flip = n_alleles == 4 # flip
+    same = n_alleles == 2 # do not flip
+    # mark: what is this case? => original data T/C, dbsnp153 C/A: 10  94958283  rs111998500
+    different = bi_allelic & ~flip & ~same
+    comment = np.select([~found, ~bi_allelic, flip, same], ["NF", "ID", "F", "S"], default="D")
+    _count_comments(comment)
+
+    # lookup tables from allele code to allele and to flipped allele, the last entry is for missing alleles (code -1)
+    allele_table = np.append(np.asarray(uniques, dtype=object), pd.NA)
+    flip_table = np.array([_flip(allele) for allele in uniques] + [""], dtype=object)
+    flipped_A1 = np.full(n, pd.NA, dtype=object)
+    flipped_A2 = np.full(n, pd.NA, dtype=object)
+    flipped_A1[flip] = flip_table[codes[flip, 0]]
+    flipped_A2[flip] = flip_table[codes[flip, 1]]
+    flipped_A1[same] = allele_table[codes[same, 0]]
+    flipped_A2[same] = allele_table[codes[same, 1]]
+    flipped_A1[different] = allele_table[codes[different, 2]]
+    flipped_A2[different] = allele_table[codes[different, 3]]
+
+    if isinstance(df["A1"].dtype, pd.CategoricalDtype): # compact schema, keep the alleles as categories
+        allele_type = _allele_dtype(pd.Series(np.concatenate([df["A1"].cat.categories, flipped_A1, flipped_A2])))
+        flipped_A1 = pd.Categorical(flipped_A1, dtype=allele_type)
+        flipped_A2 = pd.Categorical(flipped_A2, dtype=allele_type)
     result = df.assign(new_A1 = flipped_A1)
     result = result.assign(new_A2 = flipped_A2)
     result = result.assign(comment=comment)
@@ -415,6 +903,10 @@ def flip_strand( df, data, select_cols="drop_comments", filter_rows="drop"):
 
 """Function to align effect allele
     this function will align the effect allele of input data based on a reference data
+    the rows are matched to the reference by Chr + BP with one join (the first reference row of each key is used).
+    Rows with the alleles of the reference swapped get A1/A2 swapped back, Beta negated and EAF replaced by 1 - EAF.
+    A row with A1 == A2 matching the reference is kept once, unchanged (earlier versions returned it twice, unchanged
+    and swapped). The rows keep the order of the input data (earlier versions sorted them by Chr and BP).
 
     Args:
         reference (pandas.DataFrame): the reference table
@@ -423,76 +915,400 @@ def flip_strand( df, data, select_cols="drop_comments", filter_rows="drop"):
     Returns:
         pandas.DataFrame: return the data with its effect allele being aligned with the reference table.
 """
-# TODO: to be completed
+@_instrumented
 def align_effect_allele( reference, df, show_errors=False):
-    reference = reference[["Chr", "BP", "A1", "A2"]].rename({"A1":"reference_A1", "A2":"reference_A2"}, axis="columns")
-    process = df[["Chr", "BP", "A1", "A2"]].rename({"A1":"process_A1", "A2":"process_A2"}, axis="columns")
-    merge_table = pd.merge(process, reference, on=["Chr", "BP"], how="inner")
-    if len(merge_table) == 0:
-        print("reference data and process data have no records in common. Please check data source.")
+    # join on the packed Chr + BP keys, the same chromosome names get the same numbers in both tables
+    chrom_codes = {}
+    reference_key = _chr_bp_key(reference, chrom_codes)
+    reference, position, found, nochange, align, error = _match_alleles(reference, reference_key, df, _chr_bp_key(df, chrom_codes))
+    if not found.any():
+        _log("reference data and process data have no records in common. Please check data source.")
         return
-    nochange_mask = (merge_table["process_A1"] == merge_table["reference_A1"]) & (merge_table["process_A2"] == merge_table["reference_A2"])
-    align_mask = (merge_table["process_A1"] == merge_table["reference_A2"]) & (merge_table["process_A2"] == merge_table["reference_A1"])
-    error_mask = ~nochange_mask & ~align_mask
-
-    key_to_nochange = merge_table[nochange_mask][["Chr", "BP"]]
-    key_to_align = merge_table[align_mask][["Chr", "BP"]]
-    key_to_error = merge_table[error_mask][["Chr", "BP"]]
-    # print(key_to_error)
-
-    nochange = pd.merge(df, key_to_nochange, on=["Chr", "BP"], how="inner")
-    align = pd.merge(df, key_to_align, on=["Chr", "BP"], how="inner")
-    aligned = _swap_effect_allele(align)
-    # print("aligned")
-    # print(aligned)
-    error = pd.merge(df, key_to_error, on=["Chr", "BP"], how="inner")
-    # print(error)
-    # print(aligned)
-    result = nochange.append(aligned).reset_index(drop=True)
-    # print(result)
-    sorted_result = sort_by_chr_bp(result)
     if show_errors:
-        return pd.merge(error, merge_table[error_mask], on=["Chr", "BP"], how="inner")
-    print(str(nochange.shape[0]) + " rows were left unchanged (already aligned)")
-    print(str(aligned.shape[0]) + " rows were aligned successfully")
-    print(str(error.shape[0]) + " rows failed to align, dropped from result! Set the check_error_rows flag to True to view them.")
-    return sorted_result
+        return _error_rows(df, reference, position, error)
+    result = _aligned_rows(df, nochange, align)
+    _print_align_log(int(nochange.sum()), int(align.sum()), int(error.sum()))
+    return result
+
+
+
+
+"""Function to align effect allele of data larger than memory based on a reference larger than memory
+    both the data and the reference must be sorted by Chr and BP (see sort_by_chr_bp and sort_in_chunks). They are walked
+    once together, chunk by chunk (sorted merge-join), keeping only the reference rows in the range of the current chunk
+    in memory. The rows are aligned as in align_effect_allele and keep the order of the data.
+
+    Args:
+        reference_chunks (iterator): the chunks of the sorted reference, e.g. returned by read_formatted_data with chunksize set.
+        chunks (iterator): the chunks of the sorted data to be aligned.
+        show_errors (boolean): if true, the function will output the rows that cannot be aligned instead. Default to False.
+    Returns:
+        iterator: return the aligned data (or the rows that cannot be aligned) as an iterator of pandas DataFrames
+"""
+def align_effect_allele_in_chunks(reference_chunks, chunks, show_errors=False):
+    chrom_codes = {}
+    reference_chunks = iter(reference_chunks)
+    buffer = None
+    buffer_key = np.array([], dtype="uint64")
+    reference_last = None
+    data_last = None
+    counts = [0, 0, 0, 0] # found, nochange, align, error
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        key = _chr_bp_key(chunk, chrom_codes)
+        _check_sorted_chunk(key, data_last, "data")
+        data_last = key[-1]
+        # read the reference past the end of the chunk, dropping the reference rows before the chunk
+        parts = []
+        part_keys = []
+        while reference_last is None or reference_last <= key[-1]:
+            reference_chunk = next(reference_chunks, None)
+            if reference_chunk is None:
+                break
+            if len(reference_chunk) == 0:
+                continue
+            reference_key = _chr_bp_key(reference_chunk, chrom_codes)
+            _check_sorted_chunk(reference_key, reference_last, "reference")
+            reference_last = reference_key[-1]
+            keep = reference_key >= key[0]
+            parts.append(reference_chunk[keep])
+            part_keys.append(reference_key[keep])
+        if parts:
+            start = int(np.searchsorted(buffer_key, key[0]))
+            if buffer is not None and start < len(buffer_key):
+                parts.insert(0, buffer.iloc[start:])
+                part_keys.insert(0, buffer_key[start:])
+            buffer = pd.concat(parts)
+            buffer_key = np.concatenate(part_keys)
+        if buffer is None:
+            break
+
+        # only the reference rows in the range of the chunk are matched
+        start = int(np.searchsorted(buffer_key, key[0], side="left"))
+        end = int(np.searchsorted(buffer_key, key[-1], side="right"))
+        reference, position, found, nochange, align, error = _match_alleles(buffer.iloc[start:end], buffer_key[start:end], chunk, key)
+        for i, mask in enumerate([found, nochange, align, error]):
+            counts[i] += int(mask.sum())
+        piece = _error_rows(chunk, reference, position, error) if show_errors else _aligned_rows(chunk, nochange, align)
+        if len(piece) > 0:
+            yield piece
+    if counts[0] == 0:
+        _log("reference data and process data have no records in common. Please check data source.")
+    elif not show_errors:
+        _print_align_log(counts[1], counts[2], counts[3])
         
 
 
 
         
-"""Function to save the processed data in gz or csv
+"""Function to save the processed data in gz, csv, parquet, feather or block-gzipped tsv with a tabix index
 
     Args:
         output_path (str): the path you want the data to be saved.
         df (pandas.DataFrame): the processed data to be saved.
         name (str): the output name of the data.
-        save_format (str): the saving format. Choose between 'gzip' or 'csv'. Default to gz.
+        save_format (str): the saving format. Choose among 'gzip', 'csv', 'parquet', 'feather' (Arrow IPC) and 'bgzip'. Default to gz.
+            'bgzip' writes the data sorted by Chr and BP as a tab separated, block-gzipped (BGZF) '.tsv.gz' file, with a
+            tabix index ('.tsv.gz.tbi', see create_tbi_index), so that regions can be read without decompressing the whole file.
+        row_group_size (int): for 'parquet'/ 'feather', the number of rows per row group (record batch). Smaller row groups
+            let read_formatted_data skip more data with filters on sorted data. Default to None (pyarrow default).
+        compress_level (int): for 'gzip'/ 'bgzip', the compression level from 1 (fastest) to 9 (smallest). Default to 6.
+        threads (int): for 'gzip'/ 'bgzip', the number of threads formatting and compressing chunks of rows. Default to None (one per CPU).
     Returns:
-        pandas.DataFrame: return filtered data in the form of pandas DataFrame
+        str: return "successfully save", errors (e.g. a full disk) are raised and no partial '.gz'/ '.tsv.gz' file is left
 
 """
 
-def save_data(output_path, df, name, save_format="gzip"):
-    # TODO: add support for other compression format/ txt
+@_instrumented
+def save_data(output_path, df, name, save_format="gzip", row_group_size=None, compress_level=6, threads=None):
+    df = _restore_rsid(df)
     if save_format == "gzip":
+        # comma separated, in BGZF blocks: still a gzip file, and read back in parallel by read_formatted_data
         df_out = output_path + "/" + name +".gz"
-        try:
-            df.to_csv(df_out, compression='gzip', index=False)
-            return "successfully save"
-        except:
-            return "fail to save data"
+        _write_bgzf_table(df_out, _row_chunks(df), sep=",", level=compress_level, threads=threads)
+        return "successfully save"
     elif save_format == "csv": # csv
         df_out = output_path + "/" + name + ".csv"
-        try:
-            df.to_csv(df_out)
-            return "successfully save"
-        except:
-            return "fail to save data"
+        df.to_csv(df_out)
+        return "successfully save"
+    elif save_format == "parquet":
+        df_out = output_path + "/" + name + ".parquet"
+        df.to_parquet(df_out, index=False, row_group_size=row_group_size)
+        return "successfully save"
+    elif save_format == "feather":
+        df_out = output_path + "/" + name + ".feather"
+        df.reset_index(drop=True).to_feather(df_out, chunksize=row_group_size)
+        return "successfully save"
+    elif save_format == "bgzip":
+        df_out = output_path + "/" + name + ".tsv.gz"
+        if not is_sorted_by_chr_bp(df):
+            df = sort_by_chr_bp(df)
+        block_table, line_starts = _write_bgzf_table(df_out, _row_chunks(df), level=compress_level, threads=threads)
+        # the index is built from the data and the offsets of the lines, without reading the file again
+        has_position = df["Chr"].notna().to_numpy() & df["BP"].notna().to_numpy()
+        voffsets = _virtual_offsets(block_table, line_starts)
+        _write_tbi_index(df_out + ".tbi", df["Chr"].astype(str).to_numpy(dtype=object)[has_position],
+                         df["BP"].to_numpy(dtype="int64", na_value=0)[has_position] - 1,
+                         voffsets[1:-1][has_position], voffsets[2:][has_position], int((~has_position).sum()), 1, 2, 1, "#")
+        return "successfully save"
     else:
-        print("format not accepted, use 'gzip' or 'csv' for the `save_format` argument")
-        return
+        raise ValueError("Illegal save_format " + str(save_format) + "! Choose among 'gzip', 'csv', 'parquet', 'feather' and 'bgzip'.")
+
+
+
+
+
+"""Function to build a tabix index ('.tbi') of a block-gzipped (BGZF) text file sorted by chromosome and position
+    e.g. a '.tsv.gz' file written by save_data with save_format="bgzip", or by bgzip. The index is compatible with tabix
+    (generic format, 1-based positions) and lets query_db and other tools read only the blocks of a region.
+
+    Args:
+        input_path (str): path of the tab separated BGZF file.
+        seq_col (int): the column of the chromosome name, starting from 1. Default to 1 (Chr).
+        pos_col (int): the column of the 1-based position, starting from 1. Default to 2 (BP).
+        skip (int): the number of header lines at the start of the file. Default to 1.
+        meta (str): lines starting with this character are skipped. Default to "#".
+    Returns:
+        str: return the path of the index (input_path + ".tbi")
+"""
+@_instrumented
+def create_tbi_index(input_path, seq_col=1, pos_col=2, skip=1, meta="#"):
+    # the lists start with empty arrays, a file without lines gives an index without records
+    chroms, begs = [np.zeros(0, dtype=object)], [np.zeros(0, dtype="int64")]
+    starts, ends = [np.zeros(0, dtype="int64")], [np.zeros(0, dtype="int64")]
+    n_no_coor = 0
+    block_table = []
+    n_lines = 0
+    carry = b""
+    carry_start = 0
+    with open(input_path, "rb") as f:
+        blocks = _read_bgzf_blocks(f)
+        while True:
+            # decompress about 16MB at a time, only the complete lines are parsed
+            batch = list(itertools.islice(blocks, 256))
+            for coffset, ustart, data in batch:
+                block_table.append((coffset, ustart))
+            text = carry + b"".join(data for _, _, data in batch)
+            end = text.rfind(b"\n") + 1 if batch else len(text)
+            if end > 0:
+                lines = text[:end]
+                line_ends = np.flatnonzero(np.frombuffer(lines, dtype="uint8") == 10) + 1
+                if len(lines) and lines[-1:] != b"\n": # last line of the file without a newline
+                    line_ends = np.append(line_ends, len(lines))
+                line_starts = np.concatenate([[0], line_ends[:-1]])
+                keep = np.arange(n_lines, n_lines + len(line_starts)) >= skip
+                keep &= np.frombuffer(lines, dtype="uint8")[np.minimum(line_starts, len(lines) - 1)] != ord(meta)
+                fields = pd.read_csv(io.BytesIO(lines), sep="\t", header=None, usecols=[seq_col - 1, pos_col - 1], dtype=str,
+                                     quoting=3, skip_blank_lines=False, na_filter=False)
+                chrom = fields[seq_col - 1].to_numpy(dtype=object)[keep]
+                pos = pd.to_numeric(pd.Series(fields[pos_col - 1].to_numpy()[keep]), errors="coerce").to_numpy(dtype="float64")
+                has_position = (chrom != "") & ~np.isnan(pos)
+                n_no_coor += int((~has_position).sum())
+                chroms.append(chrom[has_position])
+                begs.append(pos[has_position].astype("int64") - 1)
+                starts.append(carry_start + line_starts[keep][has_position])
+                ends.append(carry_start + line_ends[keep][has_position])
+                n_lines += len(line_starts)
+            carry = text[end:]
+            carry_start += end
+            if not batch:
+                break
+    voffsets = _virtual_offsets(block_table, np.concatenate(starts + ends))
+    n = sum(len(part) for part in starts)
+    index_path = input_path + ".tbi"
+    _write_tbi_index(index_path, np.concatenate(chroms), np.concatenate(begs), voffsets[:n], voffsets[n:], n_no_coor, seq_col, pos_col, skip, meta)
+    return index_path
+
+
+
+
+"""Function to get the rows of processed data in genomic regions (e.g. +-500kb around a hit) without reading whole files
+    '.tsv.gz' files with a tabix index (save_data with save_format="bgzip", or create_tbi_index) only decompress the
+    blocks of the regions, and '.parquet'/ '.feather' files skip the row groups whose statistics do not match the
+    regions. Other '.gz' files are read in chunks and filtered. Several files are read at the same time with workers.
+
+    Args:
+        input_paths (str or list): the path of the processed data, or a list of paths.
+        chrom (str): the chromosome of a single region, e.g. "1" or "chr1" (matched with or without the "chr" prefix, as the
+            files name it). Default to None (regions must be set).
+        start (int): the first position (BP) of the region, 1-based. Default to None (start of the chromosome).
+        end (int): the last position (BP) of the region, 1-based and included. Default to None (end of the chromosome).
+        regions (str or pandas.DataFrame): several regions, used instead of chrom/ start/ end. The path of a BED file, or a
+            data frame whose first three columns are as in a BED file (chromosome, 0-based start, end). Default to None.
+        columns (list): if set, only these columns are returned. Default to None (all columns).
+        workers (int): if set, this many files are read at the same time. Default to None (one file at a time).
+    Returns:
+        pandas.DataFrame: return the rows in any of the regions, in the order of the files, with a "Source" column (the
+            path of the file) when input_paths is a list
+"""
+@_instrumented
+def query_db(input_paths, chrom=None, start=None, end=None, regions=None, columns=None, workers=None):
+    paths = [input_paths] if isinstance(input_paths, str) else list(input_paths)
+    regions = _read_regions(regions, chrom, start, end)
+    if workers is None or workers <= 1:
+        results = [_query_file(path, regions, columns) for path in paths]
+    else:
+        # threads are enough, the time is spent decompressing and parsing which release the GIL
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda path: _query_file(path, regions, columns), paths))
+    # the counts are added here, _count only reaches the instrumented call of its own thread, not of the worker threads
+    for path, (df, method, rows_scanned) in zip(paths, results):
+        _count(method + "_files", 1)
+        _count("rows_scanned", rows_scanned)
+        if method == "scan":
+            _log(path, "has no index, the whole file is read. Save it with save_format=\"bgzip\" or \"parquet\" to query regions faster")
+    if isinstance(input_paths, str):
+        return results[0][0]
+    frames = [df.assign(Source=path) for path, (df, method, rows_scanned) in zip(paths, results)]
+    return pd.concat(frames, ignore_index=True)
+
+
+
+
+"""Function to run a processing pipeline described by a JSON config (or python dictionary)
+    the steps are planned before running: consecutive filter_bi_allelic / deduplicate / sort_by_chr_bp steps are
+    fused into a single pass that copies the data once, and dbSnp153 is queried once for all add_rsid / flip_strand
+    steps (again only if lift_over changes the Chr + BP in between), returning only the fields these steps use.
+    The time and peak memory of each stage are reported. The peak memory of the process is reset at the start of each
+    stage, so it is the peak of the stage alone (on linux; elsewhere it is the peak of the process so far).
+
+    Args:
+        config (str or python dictionary): path of the JSON config, or the loaded config. Keys:
+            "input_path", "output_path", "output_name": as in the other JSON templates.
+            "Chr_col_name" ... "P_col_name": column names for read_data. If not given, the input is read with read_formatted_data.
+            "steps": list of step names, in order, among "lift_over", "filter_bi_allelic", "deduplicate", "sort_by_chr_bp", "add_rsid", "flip_strand".
+            "input_format", "output_format": genome builds for lift_over.
+            "chain_file": path of a local chain file for lift_over (see create_lo). Default to letting pyliftover locate it.
+            "dbSnp153_path": path of the '.bb' file or index of dbSnp153 for add_rsid / flip_strand.
+            "cache_dir": directory of the query_data cache (see query_data). Default to no cache.
+            "separate_by": separator of the input for read_data. Default to tab.
+            "block_cache_dir": directory of the block cache of a remote '.bb' file (see open_block_cache). Default to no block cache.
+            "select_cols", "filter_rows": options of add_rsid / flip_strand. Default to "inplace" and "drop".
+    Returns:
+        python dictionary: return the processed data ("result") and the list of stage reports ("stages": "stage", "time"
+            in seconds and "peak_memory_mb", the peak resident memory of the process during the stage in MB).
+"""
+
+@_instrumented
+def run_pipeline(config):
+    if isinstance(config, str):
+        with open(config, "r") as read_file:
+            config = json.load(read_file)
+    report = []
+    run_stage = _stage_runner(report)
+    df = run_stage("read_data", lambda: _read_config_input(config))
+    lo = {}
+    def get_lo():
+        if "lo_dict" not in lo:
+            lo["lo_dict"] = run_stage("create_lo", lambda: create_lo(config["input_format"], config["output_format"], chain_file=config.get("chain_file")))
+        return lo["lo_dict"]
+    fields = _pipeline_fields(config["steps"])
+    query = lambda df: run_stage("query_data", lambda: query_data(df, config["dbSnp153_path"], cache_dir=config.get("cache_dir"), fields=fields, block_cache_dir=config.get("block_cache_dir")))
+    df = _run_stages(df, config["steps"], config, get_lo, query, run_stage)
+    run_stage("save_data", lambda: save_data(config["output_path"], df, config["output_name"]))
+    return {"result": df, "stages": report}
+
+
+
+
+"""Function to run the same processing pipeline on many studies (batch mode)
+    the manifest has the keys of the run_pipeline config shared by all studies, and the list of studies, each with its
+    own input, output name and column names (any shared key except "steps" can be set per study). The lift over
+    chains are loaded once and dbSnp153 is queried once for the union of the Chr + BP of all studies (again only if
+    lift_over changes the Chr + BP in between), so each study only costs reading, processing and saving. The studies
+    are processed in worker processes, a study that fails is reported and does not stop the others.
+
+    Args:
+        manifest (str or python dictionary): path of the JSON manifest, or the loaded manifest. Keys, besides those of run_pipeline:
+            "studies": list of python dictionaries, one per study, e.g. with "input_path", "output_name", "Chr_col_name" ... "P_col_name"
+                and "separate_by" (separator of the input, default to tab).
+            "workers": the number of worker processes. Default to 1 (the studies are processed in this process).
+            "window": window of query_data for a '.bb' file (see query_data). Default to None.
+            "temp_dir": the directory for the data of the studies between two dbSnp153 queries. Default to the system temporary directory.
+    Returns:
+        python dictionary: return the report of each study ("studies": input_path, output_name, rows saved, time, stages
+            and error if it failed) and the number of distinct Chr + BP of each dbSnp153 query ("queried_keys").
+"""
+@_instrumented
+def run_batch(manifest):
+    if isinstance(manifest, str):
+        with open(manifest, "r") as read_file:
+            manifest = json.load(read_file)
+    shared = {key: value for key, value in manifest.items() if key != "studies"}
+    studies = [dict(shared, **study) for study in manifest["studies"]]
+    steps = manifest["steps"]
+    _plan_pipeline(steps) # check the steps before starting
+    segments = _batch_segments(steps)
+    lo_dict = create_lo(manifest["input_format"], manifest["output_format"], chain_file=manifest.get("chain_file")) if "lift_over" in steps else None
+    fields = _pipeline_fields(steps)
+    reports = [{"input_path": study.get("input_path"), "output_name": study.get("output_name"), "rows": None, "time": 0.0, "stages": []} for study in studies]
+    outputs = [None] * len(studies)
+    queried_keys = []
+    dbSnp153 = None
+    with tempfile.TemporaryDirectory(dir=manifest.get("temp_dir")) as temp_dir:
+        for k, segment in enumerate(segments):
+            active = [i for i in range(len(studies)) if "error" not in reports[i]]
+            if not active:
+                break
+            if k > 0: # the segment starts with add_rsid / flip_strand, query the union of the Chr + BP of the studies once
+                keys = pd.concat([outputs[i]["keys"] for i in active], ignore_index=True).drop_duplicates(ignore_index=True)
+                queried_keys.append(len(keys))
+                records = query_data(keys, manifest["dbSnp153_path"], window=manifest.get("window"), cache_dir=manifest.get("cache_dir"), fields=fields, block_cache_dir=manifest.get("block_cache_dir"))
+                dbSnp153 = _dbsnp_lookup(records)
+            tasks = [(studies[i], segment, k == 0, k == len(segments) - 1, os.path.join(temp_dir, str(i) + ".pkl")) for i in active]
+            for i, output in zip(active, _run_batch_tasks(tasks, manifest.get("workers"), lo_dict, dbSnp153)):
+                reports[i]["stages"].extend(output["stages"])
+                reports[i]["time"] += sum(stage["time"] for stage in output["stages"])
+                if "error" in output:
+                    reports[i]["error"] = output["error"]
+                    _log(reports[i]["input_path"], " failed: ", output["error"])
+                else:
+                    reports[i]["rows"] = output["rows"]
+                outputs[i] = output
+    _log(sum("error" not in report for report in reports), " of ", len(reports), " studies processed")
+    return {"studies": reports, "queried_keys": queried_keys}
+
+
+
+
+"""Function to process data larger than memory chunk by chunk and save the result as a gz file
+    every chunk goes through the steps and is written to disk as a sorted run, then the runs are merged
+    while only reading about chunksize rows at a time. Deduplication is done during the merge, so the output
+    is sorted whenever dedup or sort is set.
+
+    Args:
+        chunks (iterator): the chunks of the data, e.g. returned by read_data or read_formatted_data with chunksize set.
+        output_path (str): the path you want the data to be saved.
+        name (str): the output name of the data.
+        steps (list): the functions applied to each chunk in order, each taking and returning a pandas.DataFrame
+            (e.g. di.filter_bi_allelic, or lambda df: di.lift_over(df, lo_dict)). Default to None (no steps).
+        dedup (boolean): if true, drop all rows whose Chr + BP appears more than once in the whole data. Default to True.
+        sort (boolean): if true, sort the whole data by Chr and BP. Default to True.
+        chunksize (int): the number of rows held in memory when merging the sorted runs. Default to 1000000.
+        temp_dir (str): the directory for the sorted runs. Default to None (the system temporary directory).
+        compress_level (int): the compression level from 1 (fastest) to 9 (smallest). Default to 6.
+        threads (int): the number of threads formatting and compressing the output. Default to None (one per CPU).
+    Returns:
+        str: return "successfully save"
+"""
+
+@_instrumented
+def process_in_chunks(chunks, output_path, name, steps=None, dedup=True, sort=True, chunksize=1000000, temp_dir=None, compress_level=6, threads=None):
+    if steps is None:
+        steps = []
+    df_out = output_path + "/" + name +".gz"
+    # written like save_data, the pieces are formatted and compressed by threads while the next ones are processed
+    if not dedup and not sort:
+        pieces = (_restore_rsid(_apply_steps(chunk, steps)) for chunk in chunks)
+        _write_bgzf_table(df_out, pieces, sep=",", level=compress_level, threads=threads)
+        return "successfully save"
+    stats = {"rows": 0, "keys": 0}
+    pieces = (_restore_rsid(piece) for piece in _sort_chunks(chunks, steps, dedup, chunksize, temp_dir, stats))
+    _write_bgzf_table(df_out, pieces, sep=",", level=compress_level, threads=threads)
+    if dedup:
+        _print_dedup_log(stats)
+    return "successfully save"
 
 
 
@@ -503,6 +1319,537 @@ def save_data(output_path, df, name, save_format="gzip"):
 # ---------------------------------------------------------------------------------------------
 # Helper Functions
 
+# helper function to get the separator of a formatted text file, tab for the '.tsv.gz' files of save_data (bgzip),
+# comma for file objects (buffers)
+def _text_separator( path):
+    path = _fspath(path)
+    if path is None:
+        return ","
+    return "\t" if path.endswith(".tsv.gz") or path.endswith(".tsv") else ","
+
+# size of the uncompressed data of a BGZF block (as bgzip), the end-of-file block of the BGZF format, and the
+# compression level of the BGZF files written by save_data
+_BGZF_BLOCK_SIZE = 0xff00
+_BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+_BGZF_LEVEL = 6
+
+# helper function to compress one BGZF block: a gzip member with the compressed size in its extra field
+def _bgzf_block( data, level=_BGZF_LEVEL):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    if len(compressed) > 65536 - 26: # data that does not compress, stored as it is
+        compressor = zlib.compressobj(0, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+    header = struct.pack("<4BI2BH2BHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(compressed) + 25)
+    return header + compressed + struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data))
+
+# helper function to compress data as BGZF blocks, returns the blocks and the compressed and uncompressed size of each
+def _bgzf_compress( data, level=_BGZF_LEVEL):
+    view = memoryview(data)
+    blocks = [_bgzf_block(view[start:start + _BGZF_BLOCK_SIZE], level) for start in range(0, len(data), _BGZF_BLOCK_SIZE)]
+    sizes = [(len(block), min(_BGZF_BLOCK_SIZE, len(data) - i * _BGZF_BLOCK_SIZE)) for i, block in enumerate(blocks)]
+    return b"".join(blocks), sizes
+
+# helper function to write compressed BGZF pieces (from _bgzf_compress) and the end-of-file block, returns the
+# compressed and uncompressed offsets of the blocks
+def _write_bgzf_blocks( f, compressed_pieces):
+    block_table = []
+    coffset = f.tell()
+    ustart = 0
+    for compressed, sizes in compressed_pieces:
+        f.write(compressed)
+        for compressed_size, size in sizes:
+            block_table.append((coffset, ustart))
+            coffset += compressed_size
+            ustart += size
+    f.write(_BGZF_EOF)
+    block_table.append((coffset, ustart))
+    return block_table
+
+# helper function to write bytes as BGZF blocks, returns the compressed and uncompressed offsets of the blocks
+def _write_bgzf( f, pieces, level=_BGZF_LEVEL):
+    return _write_bgzf_blocks(f, (_bgzf_compress(piece, level) for piece in pieces))
+
+# helper function to map a function over items in a thread pool, yielding the results in order with a bounded
+# number of items in progress
+def _ordered_map( func, items, threads):
+    if threads == 1:
+        yield from map(func, items)
+        return
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = collections.deque()
+        try:
+            for item in items:
+                pending.append(executor.submit(func, item))
+                if len(pending) >= 2 * threads:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+# helper function to split a data frame into chunks of rows for _write_bgzf_table (at least one, for the header)
+def _row_chunks( df, rows=100000):
+    return (df.iloc[start:start + rows] for start in range(0, max(len(df), 1), rows))
+
+# helper function to write data frames as one text BGZF file, the frames are formatted and compressed by threads
+# and written in order. Returns the offsets of the blocks and the uncompressed offsets of the lines (with the header
+# line, and the end of the file last). The file is written under a temporary name and only renamed when complete
+def _write_bgzf_table( path, frames, sep="\t", level=_BGZF_LEVEL, threads=None):
+    def compress_chunk(item):
+        i, frame = item
+        text = frame.to_csv(sep=sep, index=False, header=i == 0).encode()
+        line_ends = np.flatnonzero(np.frombuffer(text, dtype="uint8") == 10) + 1
+        return _bgzf_compress(text, level) + (line_ends, len(text))
+    line_starts = [np.zeros(0, dtype="int64")]
+    total = [0]
+    def pieces():
+        for compressed, sizes, line_ends, length in _ordered_map(compress_chunk, enumerate(frames), threads or os.cpu_count()):
+            line_starts.append(total[0] + np.concatenate([[0], line_ends[:-1]]))
+            total[0] += length
+            yield compressed, sizes
+    part_path = path + ".part"
+    try:
+        with open(part_path, "wb") as f:
+            block_table = _write_bgzf_blocks(f, pieces())
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    os.replace(part_path, path)
+    return block_table, np.append(np.concatenate(line_starts), total[0])
+
+# compressed bytes read from a BGZF file at a time, the blocks of each read are decompressed by one thread
+_BGZF_READ_SIZE = 1 << 22
+
+# helper function to get a path (str or path-like) as a string, None for file objects (buffers), which are read by pandas
+def _fspath( path):
+    return os.fsdecode(path) if isinstance(path, (str, bytes, os.PathLike)) else None
+
+# helper function to tell whether a file is block-gzipped (BGZF), from the header of its first block. File objects are
+# not, they are read by pandas as before
+def _is_bgzf( path):
+    path = _fspath(path)
+    if path is None:
+        return False
+    try:
+        with open(path, "rb") as f:
+            header = f.read(18)
+    except OSError:
+        return False
+    return len(header) == 18 and header[:4] == b"\x1f\x8b\x08\x04" and header[12:14] == b"BC"
+
+# helper function to read gzipped text with pandas, BGZF files are decompressed by threads feeding the parser
+def _read_gzip_text( input_path, threads, **kwargs):
+    if threads == 1 or not _is_bgzf(input_path):
+        return pd.read_csv(input_path, compression='gzip', **kwargs)
+    source = io.BufferedReader(_BgzfReader(input_path, threads or os.cpu_count()), 1 << 20)
+    if kwargs.get("chunksize") is None:
+        with source:
+            return pd.read_csv(source, **kwargs)
+    return _close_after(pd.read_csv(source, **kwargs), source)
+
+# helper function to iterate over chunks and close their source at the end (or when the iteration is stopped)
+def _close_after( chunks, source):
+    try:
+        yield from chunks
+    finally:
+        source.close()
+
+# helper function to find the complete BGZF blocks in a buffer, returns their start offsets and the end of the last one
+def _bgzf_spans( buffer):
+    spans = []
+    offset = 0
+    while offset + 18 <= len(buffer):
+        if buffer[offset:offset + 4] != b"\x1f\x8b\x08\x04" or buffer[offset + 12:offset + 14] != b"BC":
+            raise ValueError("Corrupted BGZF data at a block header!")
+        block_size = struct.unpack_from("<H", buffer, offset + 16)[0] + 1
+        if offset + block_size > len(buffer):
+            break
+        spans.append(offset)
+        offset += block_size
+    return spans, offset
+
+# helper function to decompress BGZF blocks of a buffer and check them against their CRC32 and size
+def _inflate_bgzf_blocks( buffer, spans, end):
+    view = memoryview(buffer)
+    parts = []
+    for start, stop in zip(spans, spans[1:] + [end]):
+        data = zlib.decompress(view[start + 18:stop - 8], -15)
+        crc, size = struct.unpack_from("<II", buffer, stop - 8)
+        if size != len(data) or crc != zlib.crc32(data) & 0xffffffff:
+            raise ValueError("Corrupted BGZF block, its CRC32 or size does not match the data!")
+        parts.append(data)
+    return b"".join(parts)
+
+# helper class of a file object over the decompressed data of a BGZF file, while pandas parses a part the next ones
+# are decompressed by threads (zlib releases the GIL), in order
+class _BgzfReader(io.RawIOBase):
+    def __init__(self, path, threads):
+        self._file = open(path, "rb")
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        self._ahead = 2 * threads
+        self._pending = collections.deque()
+        self._carry = b""
+        self._eof = False
+        self._data = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def _submit(self):
+        while not self._eof and len(self._pending) < self._ahead:
+            read = self._file.read(_BGZF_READ_SIZE)
+            if not read:
+                self._eof = True
+                if self._carry:
+                    raise ValueError("Truncated BGZF file, the last block is incomplete!")
+                break
+            buffer = self._carry + read
+            spans, end = _bgzf_spans(buffer)
+            self._carry = buffer[end:]
+            if spans:
+                self._pending.append(self._executor.submit(_inflate_bgzf_blocks, buffer, spans, end))
+
+    def readinto(self, b):
+        while not len(self._data):
+            self._submit()
+            if not self._pending:
+                return 0
+            self._data = memoryview(self._pending.popleft().result())
+        n = min(len(b), len(self._data))
+        b[:n] = self._data[:n]
+        self._data = self._data[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._file.close()
+        super().close()
+
+# helper function to read the blocks of a BGZF file, yields the compressed offset, uncompressed offset and data of each block
+def _read_bgzf_blocks( f):
+    ustart = 0
+    while True:
+        coffset = f.tell()
+        header = f.read(18)
+        if len(header) < 18:
+            return
+        if header[:4] != b"\x1f\x8b\x08\x04" or header[12:14] != b"BC":
+            raise ValueError("The file is not block-gzipped (BGZF)! Save it with save_data(..., save_format=\"bgzip\") or compress it with bgzip.")
+        block_size = struct.unpack("<H", header[16:18])[0] + 1
+        body = f.read(block_size - 18)
+        data = zlib.decompress(body[:-8], -15)
+        yield coffset, ustart, data
+        ustart += len(data)
+
+# helper function to convert uncompressed offsets into BGZF virtual offsets (block offset << 16 | offset in the block).
+# An offset at the end of a block points to the start of the next block, as tabix does
+def _virtual_offsets( block_table, offsets):
+    table = np.array(block_table, dtype="int64").reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype="int64")
+    block = np.searchsorted(table[:, 1], offsets, side="right") - 1
+    return (table[block, 0].astype("uint64") << np.uint64(16)) | (offsets - table[block, 1]).astype("uint64")
+
+# helper function to get the tabix bins of regions [beg, end) (0-based), the smallest bin containing each region
+def _reg2bin( beg, end):
+    end = end - 1
+    bins = np.zeros(len(beg), dtype="int64")
+    done = np.zeros(len(beg), dtype=bool)
+    for shift, first_bin in [(14, 4681), (17, 585), (20, 73), (23, 9), (26, 1)]:
+        same = ~done & ((beg >> shift) == (end >> shift))
+        bins[same] = first_bin + (beg[same] >> shift)
+        done |= same
+    return bins
+
+# helper function to write a tabix index from the records of a sorted file: chromosome, 0-based position and the
+# virtual offsets of the start and end of each line
+def _write_tbi_index( path, chroms, begs, starts, ends, n_no_coor, seq_col, pos_col, skip, meta):
+    codes, names = pd.factorize(chroms)
+    # the records of one chromosome must be together, and sorted by position
+    change = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+    # without records (empty data, or no row with a Chr and BP) the index has no chromosome
+    bounds = np.concatenate([[0], change, [len(codes)]]).astype("int64") if len(codes) else np.zeros(1, dtype="int64")
+    if len(set(codes[bounds[:-1]].tolist())) != len(bounds) - 1 or np.any((np.diff(begs) < 0) & (codes[1:] == codes[:-1])):
+        raise ValueError("The file is not sorted by chromosome and position! Sort the data first (see sort_by_chr_bp).")
+    # the end column is the position column, as tabix -s seq_col -b pos_col -e pos_col
+    parts = [struct.pack("<4s6i", b"TBI\x01", len(names), 0, seq_col, pos_col, pos_col, ord(meta)) + struct.pack("<i", skip)]
+    name_bytes = b"".join(str(name).encode() + b"\x00" for name in names)
+    parts.append(struct.pack("<i", len(name_bytes)) + name_bytes)
+    for ref in range(len(names)):
+        first, last = bounds[ref], bounds[ref + 1]
+        beg, start, end = begs[first:last], starts[first:last], ends[first:last]
+        bins = _reg2bin(beg, beg + 1)
+        # consecutive records in the same bin make one chunk, chunks of a bin in the same block are merged
+        runs = np.concatenate([[0], np.flatnonzero(bins[1:] != bins[:-1]) + 1, [len(bins)]])
+        chunks = {}
+        for a, b in zip(runs[:-1], runs[1:]):
+            bin_chunks = chunks.setdefault(int(bins[a]), [])
+            if bin_chunks and bin_chunks[-1][1] >> 16 == int(start[a]) >> 16:
+                bin_chunks[-1][1] = max(bin_chunks[-1][1], int(end[b - 1]))
+            else:
+                bin_chunks.append([int(start[a]), int(end[b - 1])])
+        chunks[37450] = [[int(start[0]), int(end[-1])], [last - first, 0]] # pseudo bin: range of the chromosome and record counts
+        parts.append(struct.pack("<i", len(chunks)))
+        for bin_number, bin_chunks in chunks.items():
+            parts.append(struct.pack("<Ii", bin_number, len(bin_chunks)) + np.array(bin_chunks, dtype="<u8").tobytes())
+        # linear index: the offset of the first record of each 16kb window, empty windows take the previous offset
+        windows = beg >> 14
+        window_ids, first_rows = np.unique(windows, return_index=True)
+        linear = np.zeros(int(window_ids[-1]) + 1, dtype="uint64")
+        filled = np.zeros(len(linear), dtype=bool)
+        linear[window_ids] = start[first_rows]
+        filled[window_ids] = True
+        linear = linear[np.maximum.accumulate(np.where(filled, np.arange(len(linear)), 0))]
+        linear[:window_ids[0]] = start[0]
+        parts.append(struct.pack("<i", len(linear)) + linear.astype("<u8").tobytes())
+    parts.append(struct.pack("<Q", n_no_coor))
+    with open(path, "wb") as f:
+        _write_bgzf(f, [b"".join(parts)])
+
+# largest position of a tabix index, the end of the regions without end
+_TBI_MAX_END = 1 << 29
+
+# helper function to read the regions of query_db as a data frame of Chr, beg (0-based) and end, rows matching a
+# region have beg < BP <= end
+def _read_regions( regions, chrom, start, end):
+    if regions is None:
+        if chrom is None:
+            raise ValueError("No region given! Set chrom (and start/ end) or regions.")
+        regions = pd.DataFrame({"Chr": [chrom], "beg": [0 if start is None else start - 1], "end": [_TBI_MAX_END if end is None else end]})
+    else:
+        if isinstance(regions, str):
+            regions = pd.read_csv(regions, sep="\t", header=None, usecols=[0, 1, 2], dtype=str, comment="#", compression="infer")
+            regions = regions[~regions[0].str.startswith("track") & ~regions[0].str.startswith("browser")]
+        regions = regions.iloc[:, :3].copy()
+        regions.columns = ["Chr", "beg", "end"]
+    regions["Chr"] = regions["Chr"].astype(str)
+    regions["beg"] = regions["beg"].astype("int64")
+    regions["end"] = regions["end"].astype("int64")
+    return regions.reset_index(drop=True)
+
+# helper function to get the rows of one file in the regions, returns the rows, how the file was read and the number of rows parsed
+# (pyarrow filters the rows itself, only the rows in the regions are counted for parquet/ feather files)
+def _query_file( path, regions, columns):
+    read_columns = None if columns is None else list(dict.fromkeys(list(columns) + ["Chr", "BP"]))
+    if _arrow_format(path) is not None:
+        filters = [[("Chr", "in", _chrom_spellings(chrom)), ("BP", ">", beg), ("BP", "<=", end)] for chrom, beg, end in regions.itertuples(index=False)]
+        df = read_formatted_data(path, columns=columns, filters=filters)
+        return df.reset_index(drop=True), "arrow", len(df)
+    if os.path.exists(path + ".tbi"):
+        df, rows_scanned = _query_tabix(path, regions, read_columns)
+        method = "tabix"
+    else:
+        frames, rows_scanned = [], 0
+        for chunk in read_formatted_data(path, chunksize=1000000, columns=read_columns):
+            frames.append(chunk[_region_mask(chunk, regions)])
+            rows_scanned += len(chunk)
+        df, method = pd.concat(frames, ignore_index=True), "scan"
+    return (df if columns is None else df[list(columns)]), method, rows_scanned
+
+# helper function to get the two spellings of a chromosome name, with and without the "chr" prefix ("chr1" -> ["chr1", "1"])
+def _chrom_spellings( chrom):
+    return [chrom, chrom[len("chr"):]] if chrom.startswith("chr") else [chrom, "chr" + chrom]
+
+# helper function to select the rows of a data frame in any of the regions, the chromosomes of the regions match the
+# chromosomes of the data with or without the "chr" prefix
+def _region_mask( df, regions):
+    chrom = df["Chr"].astype(str).to_numpy()
+    bp = df["BP"].to_numpy(dtype="float64", na_value=np.nan)
+    mask = np.zeros(len(df), dtype=bool)
+    for region_chrom, beg, end in regions.itertuples(index=False):
+        mask |= np.isin(chrom, _chrom_spellings(region_chrom)) & (bp > beg) & (bp <= end)
+    return mask
+
+# helper function to read a tabix index, returns the chromosome names, the columns, the chunks of every bin and the linear index of each chromosome
+def _read_tbi_index( path):
+    data = gzip.decompress(open(path, "rb").read())
+    magic, n_ref, file_format, seq_col, pos_col, end_col, meta, skip, name_length = struct.unpack_from("<4s8i", data, 0)
+    if magic != b"TBI\x01":
+        raise ValueError(path + " is not a tabix index!")
+    offset = 36
+    names = [name.decode() for name in data[offset:offset + name_length].split(b"\x00")[:-1]]
+    offset += name_length
+    refs = []
+    for _ in range(n_ref):
+        n_bin = struct.unpack_from("<i", data, offset)[0]
+        offset += 4
+        bins = {}
+        for _ in range(n_bin):
+            bin_number, n_chunk = struct.unpack_from("<Ii", data, offset)
+            offset += 8
+            bins[bin_number] = np.frombuffer(data, dtype="<u8", count=2 * n_chunk, offset=offset).reshape(-1, 2)
+            offset += 16 * n_chunk
+        n_intv = struct.unpack_from("<i", data, offset)[0]
+        offset += 4
+        refs.append((bins, np.frombuffer(data, dtype="<u8", count=n_intv, offset=offset)))
+        offset += 8 * n_intv
+    return {"names": names, "seq_col": seq_col, "pos_col": pos_col, "skip": skip, "refs": refs}
+
+# helper function to get the tabix bins that may hold records overlapping [beg, end) (0-based)
+def _region_bins( beg, end):
+    end = min(end, _TBI_MAX_END) - 1
+    bins = [0]
+    for shift, first_bin in [(26, 1), (23, 9), (20, 73), (17, 585), (14, 4681)]:
+        bins.extend(range(first_bin + (beg >> shift), first_bin + (end >> shift) + 1))
+    return bins
+
+# helper function to get the merged chunks (virtual offsets) of a BGZF file to read for the regions
+def _tabix_chunks( index, regions):
+    chunks = []
+    for chrom, beg, end in regions.itertuples(index=False):
+        # the name of the chromosome in the index, as it is or with/ without the "chr" prefix
+        names = [name for name in _chrom_spellings(chrom) if name in index["names"]]
+        if not names:
+            continue
+        bins, linear = index["refs"][index["names"].index(names[0])]
+        # chunks ending before the first record of the window of beg cannot hold records of the region
+        min_offset = int(linear[min(beg >> 14, len(linear) - 1)]) if len(linear) else 0
+        for bin_number in _region_bins(beg, end):
+            for chunk_start, chunk_end in bins.get(bin_number, []):
+                if bin_number != 37450 and chunk_end > min_offset:
+                    chunks.append((max(int(chunk_start), min_offset), int(chunk_end)))
+    merged = []
+    for chunk_start, chunk_end in sorted(chunks):
+        if merged and chunk_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], chunk_end)
+        else:
+            merged.append([chunk_start, chunk_end])
+    return merged
+
+# helper function to read the uncompressed bytes of a BGZF file between two virtual offsets
+def _read_bgzf_range( f, start, end):
+    f.seek(start >> 16)
+    parts = []
+    for coffset, _, data in _read_bgzf_blocks(f):
+        if coffset >= end >> 16:
+            parts.append(data[:end & 0xffff])
+            break
+        parts.append(data)
+    return b"".join(parts)[start & 0xffff:]
+
+# helper function to get the rows of a BGZF file with a tabix index in the regions, only reading the blocks of the regions
+# returns the rows and the number of rows parsed from these blocks
+def _query_tabix( path, regions, columns):
+    index = _read_tbi_index(path + ".tbi")
+    with open(path, "rb") as f:
+        first_line = b""
+        for _, _, data in _read_bgzf_blocks(f):
+            first_line += data
+            if b"\n" in first_line:
+                break
+        names = first_line.split(b"\n")[0].decode().split("\t")
+        text = b"".join(_read_bgzf_range(f, chunk_start, chunk_end) for chunk_start, chunk_end in _tabix_chunks(index, regions))
+    if index["skip"] == 0: # no header, the columns are numbered and the indexed ones named Chr and BP
+        names = [str(i + 1) for i in range(len(names))]
+        names[index["seq_col"] - 1], names[index["pos_col"] - 1] = "Chr", "BP"
+    if not text:
+        text = "\t".join(names).encode() + b"\n"
+        raw_df = pd.read_csv(io.BytesIO(text), sep="\t", usecols=columns, dtype={"Chr": str})
+        return _cast_columns(raw_df, _FORMATTED_DTYPES), 0
+    raw_df = pd.read_csv(io.BytesIO(text), sep="\t", header=None, names=names, quotechar='"', usecols=columns, dtype={"Chr": str})
+    df = _cast_columns(raw_df, _FORMATTED_DTYPES)
+    return df[_region_mask(df, regions)].reset_index(drop=True), len(df)
+
+# helper function to tell whether a file is parquet or feather (Arrow IPC) from its extension, None for text files
+# and file objects (buffers), which are read as gzipped text
+def _arrow_format( path):
+    path = _fspath(path)
+    if path is None:
+        return None
+    if path.endswith(".parquet") or path.endswith(".pq"):
+        return "parquet"
+    if path.endswith(".feather") or path.endswith(".arrow") or path.endswith(".ipc"):
+        return "ipc"
+    return None
+
+# helper function to read parquet or feather data with pyarrow, only reading the selected columns and the row groups matching the filters
+def _read_arrow( input_path, columns=None, filters=None, chunksize=None):
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    dataset = ds.dataset(input_path, format=_arrow_format(input_path))
+    expression = pq.filters_to_expression(filters) if filters else None
+    if chunksize is None:
+        return dataset.to_table(columns=columns, filter=expression).to_pandas()
+    return (batch.to_pandas() for batch in dataset.to_batches(columns=columns, filter=expression, batch_size=chunksize))
+
+# helper function to cast the columns present in the data, columns already in the right type are not copied
+def _cast_columns( df, dtype):
+    dtype = {col: col_type for col, col_type in dtype.items() if col in df.columns and df[col].dtype != pd.api.types.pandas_dtype(col_type)}
+    return df.astype(dtype) if dtype else df
+
+# column types of the data formatted by this package
+_FORMATTED_DTYPES = dict(Chr="string", BP='Int64', SNP="string", A1="string", A2="string", EAF=float, Beta=float, Se=float, P=float)
+
+# chromosome categories of the compact schema, in sorting order
+_CHROMOSOMES = [str(i) for i in range(1, 23)] + ["X", "Y"]
+
+# helper function to get the rs ID numbers ("rs123" -> 123) as floats, missing for other IDs
+def _rsid_numbers( names):
+    names = names.astype("string")
+    return pd.to_numeric(names.str[2:].where(names.str.startswith("rs")), errors="coerce")
+
+# helper function to turn rs ID numbers back to rs IDs (123 -> "rs123")
+def _rsid_names( numbers):
+    numbers = numbers.astype("string")
+    return ("rs" + numbers).where(numbers.notna())
+
+# helper function to store rs IDs as their numbers in the compact schema, the IDs are kept as they are if some of
+# them are not rs IDs (or not written as "rs" + number, e.g. "rs0123") since the numbers could not give them back
+def _compact_rsid( names):
+    if pd.api.types.is_integer_dtype(names):
+        return names
+    numbers = _rsid_numbers(names).astype("UInt64")
+    names = names.astype("string")
+    present = names.notna()
+    if (_rsid_names(numbers)[present] != names[present]).fillna(True).any():
+        _log("SNP is kept as text in the compact schema, some IDs are not rs IDs")
+        return names
+    return numbers
+
+# helper function to turn the rs ID numbers (SNP and added_rsid columns) of data in the compact schema back to rs IDs before saving
+# chunks read in the compact schema with and without rs ID numbers give object columns mixing numbers and IDs once concatenated
+def _restore_rsid( df):
+    cols = {}
+    for col in ["SNP", "added_rsid"]:
+        if col not in df.columns:
+            continue
+        if pd.api.types.is_integer_dtype(df[col]):
+            cols[col] = _rsid_names(df[col])
+        elif df[col].dtype == object:
+            values = df[col].to_numpy()
+            is_number = np.fromiter((isinstance(value, (int, np.integer)) for value in values), dtype=bool, count=len(values))
+            if is_number.any():
+                values = values.copy()
+                values[is_number] = "rs" + values[is_number].astype(str).astype(object)
+                cols[col] = pd.Series(values, index=df.index, dtype="string")
+    return df.assign(**cols) if cols else df
+
+# helper function to create the category type of alleles in the compact schema, A/C/G/T first so that
+# data with only single base alleles always get the same categories
+def _allele_dtype( alleles):
+    extra = set(alleles.dropna().astype(str).unique()) - {"A", "C", "G", "T"}
+    return pd.CategoricalDtype(["A", "C", "G", "T"] + sorted(extra))
+
+# helper function to select, rename and format the columns of raw data
+def _format_data( raw_df, col_names, compact=False):
+    result = raw_df.loc[:,list(col_names)]
+    res = result.rename(col_names, axis="columns")
+    dtype = dict(Chr="string", BP='Int64', SNP="string", A1="string", A2="string", EAF=float, Beta=float, Se=float, P=float)
+    res = res.astype(dtype)
+    res["Chr"] = res["Chr"].str.upper()
+    res["Chr"] = res["Chr"].apply(lambda y: "X" if y=="23" else("Y" if y=="24" else y))
+    res["A1"] = res["A1"].str.upper()
+    res["A2"] = res["A2"].str.upper()
+    res["SNP"] = res["SNP"].str.lower()
+    dtype = dict(Chr="string", BP='Int64', SNP="string", A1="string", A2="string", EAF=float, Beta=float, Se=float, P=float)
+    res = res.astype(dtype)
+    if compact:
+        res = to_compact(res)
+    return res
+
 # helper function to flip strand for one row
 def _flip( allele):
     new_allele = ""
@@ -516,19 +1863,525 @@ def _flip( allele):
         new_allele = "C"
     return new_allele
 
-# helper function to swap effect allele and align effect size
+# helper function to mark the bi-allelic rows of the data
+def _bi_allelic_mask( df):
+    len_mask = (df['A1'].str.len() == 1) & (df['A2'].str.len() == 1)
+    val_mask = (df['A1'] != "I") & (df['A1'] != "D") & (df['A1'] != "R") & (df['A2'] != "I") & (df['A2'] != "D") & (df['A2'] != "R")
+    chr_mask = df['Chr'].str.isdigit()
+    mask = len_mask & val_mask & chr_mask
+    return mask
+
+# steps of run_pipeline that only drop or reorder rows, and can be fused into one pass
+_FUSED_STEPS = ["filter_bi_allelic", "deduplicate", "sort_by_chr_bp"]
+
+# helper function to group the steps of run_pipeline into stages, consecutive fusable steps become one stage
+def _plan_pipeline( steps):
+    stages = []
+    for step in steps:
+        if step not in _FUSED_STEPS + ["lift_over", "add_rsid", "flip_strand"]:
+            raise ValueError('Illegal step ' + str(step) + '! Choose among "lift_over", "filter_bi_allelic", "deduplicate", "sort_by_chr_bp", "add_rsid" and "flip_strand".')
+        if step in _FUSED_STEPS and stages and stages[-1][0] in _FUSED_STEPS:
+            stages[-1].append(step)
+        else:
+            stages.append([step])
+    return stages
+
+# helper function to run fused filter_bi_allelic / deduplicate / sort_by_chr_bp steps with one mask and one copy of the data
+def _fused_filter( df, steps):
+    mask = np.ones(len(df), dtype=bool)
+    for step in steps:
+        if step == "filter_bi_allelic":
+            mask &= _bi_allelic_mask(df).to_numpy(dtype=bool, na_value=False)
+        elif step == "deduplicate": # only the rows kept by the previous steps count as duplicates
+            mask[mask] = ~_duplicate_mask(_chr_bp_key(df[['Chr', 'BP']][mask]))
+    rows = np.flatnonzero(mask)
+    if "sort_by_chr_bp" in steps: # sorting commutes with the row filters, so it can be done last
+        rows = rows[np.argsort(_chr_bp_key(df[['Chr', 'BP']].iloc[rows]), kind="stable")]
+    return df.take(rows).reset_index(drop=True)
+
+# helper function to make the run_stage function of run_pipeline, which runs one stage and appends its time and
+# peak memory to report
+def _stage_runner( report):
+    def run_stage(name, func):
+        start = time.time()
+        _reset_peak_memory() # the peak memory of the stage alone
+        result = func()
+        report.append({"stage": name, "time": time.time() - start, "peak_memory_mb": _peak_memory_mb()})
+        _log("Time used (" + name + "):", report[-1]["time"])
+        return result
+    return run_stage
+
+# helper function to read the input of a run_pipeline config, with read_data if the column names are given
+def _read_config_input( config):
+    if "Chr_col_name" in config:
+        col_names = [config[col] for col in ["Chr_col_name", "BP_col_name", "SNP_col_name", "A1_col_name", "A2_col_name", "EAF_col_name", "Beta_col_name", "Se_col_name", "P_col_name"]]
+        return read_data(config["input_path"], *col_names, separate_by=config.get("separate_by", "\t"))
+    return read_formatted_data(config["input_path"])
+
+# helper function to get the dbSnp153 fields used by the steps, so that query_data only returns these
+def _pipeline_fields( steps):
+    return (["name"] if "add_rsid" in steps else []) + (["ref", "alts"] if "flip_strand" in steps else [])
+
+# helper function to run the steps of run_pipeline on the data. get_lo returns the lift over dictionary and query(df)
+# returns the dbSnp153 records of the data, called before the first add_rsid / flip_strand and after each lift_over
+def _run_stages( df, steps, config, get_lo, query, run_stage):
+    select_cols = config.get("select_cols", "inplace")
+    filter_rows = config.get("filter_rows", "drop")
+    dbSnp153 = None
+    for stage in _plan_pipeline(steps):
+        if stage[0] in _FUSED_STEPS:
+            df = run_stage("+".join(stage), lambda: _fused_filter(df, stage))
+        elif stage == ["lift_over"]:
+            lo_dict = get_lo()
+            df = run_stage("lift_over", lambda: lift_over(df, lo_dict))
+            dbSnp153 = None # Chr + BP changed, query again
+        elif stage == ["add_rsid"] or stage == ["flip_strand"]:
+            if dbSnp153 is None:
+                dbSnp153 = query(df)
+            step = add_rsid if stage == ["add_rsid"] else flip_strand
+            df = run_stage(stage[0], lambda: step(df, dbSnp153, select_cols=select_cols, filter_rows=filter_rows))
+    return df
 
-def _swap_effect_allele( df):
-    col_list = list(df)
-    col_list[3], col_list[4] = col_list[4], col_list[3]
-    df.columns = col_list
-    df["Beta"] = -1 * df["Beta"]
-    df["EAF"] = 1 - df["EAF"]
-    df = df[["Chr", "BP", "SNP", "A1", "A2", "EAF", "Beta", "Se", "P"]]
+# helper function to split the steps of run_batch where dbSnp153 must be queried: every segment after the first one
+# starts with the first add_rsid / flip_strand at the beginning or after a lift_over
+def _batch_segments( steps):
+    segments = [[]]
+    queried = False
+    for step in steps:
+        if step in ["add_rsid", "flip_strand"]:
+            if not queried:
+                segments.append([])
+                queried = True
+        elif step == "lift_over":
+            queried = False
+        segments[-1].append(step)
+    return segments
+
+# helper function to index the dbSnp153 records queried by run_batch by chromosome and sorted position
+def _dbsnp_lookup( records):
+    positions = {}
+    chrom_values = records["Chr"].astype(str)
+    bp_values = records["BP"].to_numpy(dtype="int64")
+    for chrom, rows in chrom_values.groupby(chrom_values, sort=False).indices.items():
+        order = np.argsort(bp_values[rows], kind="stable")
+        positions[chrom] = (bp_values[rows][order], rows[order])
+    return {"records": records, "positions": positions}
+
+# helper function to get the dbSnp153 records of one study from the records of all studies, by binary search
+def _dbsnp_subset( lookup, df):
+    chrom_values = df["Chr"].astype(str)
+    bp_values = df["BP"].to_numpy(dtype="int64", na_value=-1)
+    rows = [np.array([], dtype="int64")]
+    for chrom, idx in chrom_values.groupby(chrom_values, sort=False).indices.items():
+        if chrom not in lookup["positions"]:
+            continue
+        pos, record_rows = lookup["positions"][chrom]
+        bp = np.unique(bp_values[idx])
+        found = np.minimum(np.searchsorted(pos, bp), len(pos) - 1)
+        rows.append(record_rows[found[pos[found] == bp]])
+    return lookup["records"].take(np.concatenate(rows)).reset_index(drop=True)
+
+# state of the run_batch worker processes: the lift over dictionary and the dbSnp153 records of all studies
+_BATCH_STATE = {}
+
+# helper function to set the state of a run_batch worker process
+def _batch_init( lo_dict, dbSnp153, silent):
+    _BATCH_STATE["lo_dict"] = lo_dict
+    _BATCH_STATE["dbSnp153"] = dbSnp153
+    _SETTINGS["silent"] = silent
+
+# helper function to run one segment of the steps of run_batch on one study. The first segment reads the input,
+# the others load the data saved by the previous segment, the last one saves the result; the other segments
+# save the data and return its Chr + BP for the next dbSnp153 query
+def _batch_study_task( config, steps, first, last, temp_path):
+    report = []
+    run_stage = _stage_runner(report)
+    try:
+        df = run_stage("read_data", lambda: _read_config_input(config)) if first else pd.read_pickle(temp_path)
+        query = lambda df: run_stage("dbSnp153_subset", lambda: _dbsnp_subset(_BATCH_STATE["dbSnp153"], df))
+        df = _run_stages(df, steps, config, lambda: _BATCH_STATE["lo_dict"], query, run_stage)
+        if last:
+            run_stage("save_data", lambda: save_data(config["output_path"], df, config["output_name"]))
+            return {"rows": len(df), "stages": report}
+        df.to_pickle(temp_path)
+        keys = pd.DataFrame({"Chr": df["Chr"].astype(str).to_numpy(dtype=object), "BP": df["BP"].to_numpy(dtype="int64", na_value=-1)})
+        return {"rows": len(df), "stages": report, "keys": keys[keys["BP"] > 0].drop_duplicates(ignore_index=True)}
+    except Exception as e:
+        return {"error": repr(e), "stages": report}
+
+# helper function to run the tasks of one segment of run_batch, in worker processes if workers is set
+def _run_batch_tasks( tasks, workers, lo_dict, dbSnp153):
+    if workers is None or workers <= 1:
+        silent = _SETTINGS["silent"]
+        _batch_init(lo_dict, dbSnp153, silent)
+        try:
+            return [_batch_study_task(*task) for task in tasks]
+        finally:
+            _BATCH_STATE.clear()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_batch_init, initargs=(lo_dict, dbSnp153, _SETTINGS["silent"])) as executor:
+        futures = [executor.submit(_batch_study_task, *task) for task in tasks]
+        return [future.result() for future in futures]
+
+# helper function to reset the peak memory of the process, so that _peak_memory_mb gives the peak since then
+# (linux only, elsewhere the peak stays the peak since the start of the process)
+def _reset_peak_memory():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+# helper function to get the peak memory used by the process since the start or the last _reset_peak_memory, in MB
+def _peak_memory_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB on linux
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+# helper function to apply the steps of process_in_chunks to one chunk
+def _apply_steps( df, steps):
+    for step in steps:
+        df = step(df)
     return df
 
+# chromosome numbers used for sorting, numbered chromosomes use their number, then X, Y, M, MT (kept apart from
+# the numbers, so that different names never share a key), and other names are numbered from _OTHER_CHR in order
+# of first appearance. Missing Chr and BP sort last.
+_OTHER_CHR = 1 << 20
+_CHR_CODES = {"X": _OTHER_CHR - 4, "Y": _OTHER_CHR - 3, "M": _OTHER_CHR - 2, "MT": _OTHER_CHR - 1}
+_MISSING_CHR = (1 << 31) - 1
+_MISSING_BP = (1 << 32) - 1
+
+# helper function to convert a chromosome name to the number used for sorting, chrom_codes keeps the numbers of
+# the names seen so far, so that the chunks of one data get the same numbers
+def _chr_code( chrom, chrom_codes):
+    if chrom not in chrom_codes:
+        if chrom.isdigit() and str(int(chrom)) == chrom: # not "01", which would share the key of "1"
+            chrom_codes[chrom] = int(chrom)
+        elif chrom in _CHR_CODES:
+            chrom_codes[chrom] = _CHR_CODES[chrom]
+        else:
+            chrom_codes[chrom] = _OTHER_CHR + sum(1 for code in chrom_codes.values() if code >= _OTHER_CHR)
+    return chrom_codes[chrom]
+
+# helper function to pack Chr + BP of each row into one integer key that sorts in the same order as sort_by_chr_bp
+def _chr_bp_key( df, chrom_codes=None):
+    if chrom_codes is None:
+        chrom_codes = {}
+    codes, uniques = pd.factorize(df["Chr"])
+    # the last entry is for missing Chr (code -1)
+    chr_numbers = np.array([_chr_code(str(chrom), chrom_codes) for chrom in uniques] + [_MISSING_CHR], dtype="uint64")
+    return (chr_numbers[codes] << np.uint64(32)) | df["BP"].to_numpy(dtype="uint64", na_value=_MISSING_BP)
+
+# helper function to check if the keys are sorted
+def _is_sorted( key):
+    return bool(np.all(key[1:] >= key[:-1]))
+
+# helper function to mark the rows whose key appears more than once, sorted keys only need to be compared with
+# the next key, other keys are hashed
+def _duplicate_mask( key):
+    if not _is_sorted(key):
+        return pd.Series(key).duplicated(keep=False).to_numpy()
+    same = key[1:] == key[:-1]
+    duplicate = np.zeros(len(key), dtype=bool)
+    duplicate[1:] |= same
+    duplicate[:-1] |= same
+    return duplicate
+
+# helper function to drop the rows whose key appears more than once, and count the rows and keys dropped
+def _drop_duplicate_keys( df, key, stats):
+    duplicate = _duplicate_mask(key)
+    if duplicate.any():
+        stats["rows"] += int(duplicate.sum())
+        stats["keys"] += len(np.unique(key[duplicate]))
+        return df[~duplicate]
+    return df
+
+# helper function to deduplicate sorted chunks in one pass, the rows of the last key of a chunk are held back
+# until the next chunk shows whether the key continues
+def _dedup_sorted_chunks( chunks, stats):
+    chrom_codes = {}
+    held = None
+    held_key = None
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        key = _chr_bp_key(chunk, chrom_codes)
+        if not _is_sorted(key) or (held_key is not None and key[0] < held_key[-1]):
+            raise ValueError("The chunks are not sorted by Chr and BP! Sort them first (see sort_in_chunks) or set sorted_input to False.")
+        if held is not None:
+            chunk = pd.concat([held, chunk])
+            key = np.concatenate([held_key, key])
+        last = int(np.searchsorted(key, key[-1]))
+        held, held_key = chunk.iloc[last:], key[last:]
+        piece = _drop_duplicate_keys(chunk.iloc[:last], key[:last], stats)
+        if len(piece) > 0:
+            yield piece
+    if held is not None:
+        piece = _drop_duplicate_keys(held, held_key, stats)
+        if len(piece) > 0:
+            yield piece
+
+# helper function to print how many rows and keys were dropped by deduplication
+def _print_dedup_log( stats):
+    _count("duplicate_rows_dropped", stats["rows"])
+    _count("duplicate_keys", stats["keys"])
+    _log(stats["rows"], " rows with ", stats["keys"], " duplicate keys (Chr + BP) dropped")
+
+# number of rows per block of the sorted runs on disk
+_RUN_BLOCK_ROWS = 8192
+
+# largest number of runs merged at once, more runs are merged in several passes so that the open files and the
+# buffered blocks stay bounded. Blocks have at least _MIN_RUN_BLOCK_ROWS rows, so a merge buffers about
+# max(chunksize, _MERGE_FAN_IN * _MIN_RUN_BLOCK_ROWS) rows whatever the number of runs
+_MERGE_FAN_IN = 64
+_MIN_RUN_BLOCK_ROWS = 1024
+
+# helper function to get the rows of the blocks of the runs, small enough that the blocks of _MERGE_FAN_IN runs fit in chunksize rows
+def _run_block_rows( chunksize):
+    return max(min(_RUN_BLOCK_ROWS, chunksize // _MERGE_FAN_IN), _MIN_RUN_BLOCK_ROWS)
+
+# helper function to write a sorted run (or the next part of it) to disk, as pickled blocks that keep the dtypes
+def _write_run( path, run, block_rows=_RUN_BLOCK_ROWS):
+    with open(path, "ab") as f:
+        for start in range(0, len(run), block_rows):
+            pickle.dump(run.iloc[start:start + block_rows], f, pickle.HIGHEST_PROTOCOL)
+
+# helper function to read a sorted run from disk, about block_rows rows at a time
+def _read_run( path, block_rows):
+    with open(path, "rb") as f:
+        blocks = []
+        rows = 0
+        while True:
+            try:
+                block = pickle.load(f)
+            except EOFError:
+                break
+            blocks.append(block)
+            rows += len(block)
+            if rows >= block_rows:
+                yield pd.concat(blocks)
+                blocks = []
+                rows = 0
+        if blocks:
+            yield pd.concat(blocks)
+
+# helper function to apply the steps to every chunk, then sort it and write it to disk as a run
+# chunks that continue the order of the previous run are appended to it, so sorted data gives one run
+def _spill_sorted_runs( chunks, steps, spill_dir, block_rows=_RUN_BLOCK_ROWS):
+    runs = []
+    chrom_codes = {}
+    last_key = None
+    for chunk in chunks:
+        chunk = _apply_steps(chunk, steps)
+        if len(chunk) == 0:
+            continue
+        key = _chr_bp_key(chunk, chrom_codes)
+        if _is_sorted(key):
+            run = chunk.assign(chr_bp_key=key)
+        else:
+            order = np.argsort(key, kind="stable")
+            run = chunk.iloc[order].assign(chr_bp_key=key[order])
+        if not runs or key.min() < last_key:
+            runs.append(os.path.join(spill_dir, "run_" + str(len(runs)) + ".pkl"))
+        _write_run(runs[-1], run, block_rows)
+        last_key = key.max()
+    return runs
+
+# helper function to sort (and deduplicate) the chunks on disk after applying the steps, returns the merged pieces
+def _sort_chunks( chunks, steps, dedup, chunksize, temp_dir, stats):
+    with tempfile.TemporaryDirectory(dir=temp_dir) as spill_dir:
+        runs = _spill_sorted_runs(chunks, steps, spill_dir, _run_block_rows(chunksize))
+        runs = _reduce_runs(runs, chunksize, spill_dir)
+        block_rows = max(chunksize // max(len(runs), 1), _MIN_RUN_BLOCK_ROWS)
+        for piece in _merge_sorted_runs(runs, block_rows, dedup, stats):
+            yield piece
+
+# helper function to merge groups of _MERGE_FAN_IN runs into longer runs until at most _MERGE_FAN_IN are left
+# (duplicates are kept, they are dropped by the last merge)
+def _reduce_runs( runs, chunksize, spill_dir):
+    merge_pass = 0
+    while len(runs) > _MERGE_FAN_IN:
+        merged = []
+        for start in range(0, len(runs), _MERGE_FAN_IN):
+            group = runs[start:start + _MERGE_FAN_IN]
+            path = os.path.join(spill_dir, "merge_" + str(merge_pass) + "_" + str(len(merged)) + ".pkl")
+            for piece in _merge_runs(group, _run_block_rows(chunksize)):
+                _write_run(path, piece, _run_block_rows(chunksize))
+            for run in group:
+                os.remove(run)
+            merged.append(path)
+        runs = merged
+        merge_pass += 1
+    return runs
+
+# helper function to merge the sorted runs, deduplicate them if needed, and drop the sorting key
+def _merge_sorted_runs( runs, block_rows, dedup, stats):
+    for piece in _merge_runs(runs, block_rows):
+        if dedup:
+            piece = _drop_duplicate_keys(piece, piece["chr_bp_key"].to_numpy(), stats)
+        if len(piece) > 0:
+            yield piece.drop(columns=["chr_bp_key"]).reset_index(drop=True)
+
+# helper function to merge the sorted runs, reading block_rows rows of each run at a time
+# rows are only emitted once their key is below the last read key of every unfinished run, so all the rows of one
+# key are emitted together and can be deduplicated. Rows of the same key keep the order of the runs
+def _merge_runs( runs, block_rows):
+    if not runs:
+        return
+    readers = [_read_run(path, block_rows) for path in runs]
+    last_keys = [None] * len(runs) # last key read from each run, None once the run is finished
+    buffer = None
+    buffer_runs = np.zeros(0, dtype="int64")
+    to_read = range(len(runs))
+    while True:
+        blocks, block_runs = [], []
+        for i in to_read:
+            block = next(readers[i], None)
+            last_keys[i] = None if block is None else block["chr_bp_key"].iloc[-1]
+            if block is not None:
+                blocks.append(block)
+                block_runs.append(np.full(len(block), i))
+        if blocks:
+            buffer = pd.concat(([] if buffer is None else [buffer]) + blocks)
+            buffer_runs = np.concatenate([buffer_runs] + block_runs)
+        limits = [key for key in last_keys if key is not None]
+        bound = min(limits) if limits else None
+        keys = buffer["chr_bp_key"].to_numpy()
+        ready = np.ones(len(keys), dtype=bool) if bound is None else keys < bound
+        if ready.any():
+            order = np.lexsort((buffer_runs[ready], keys[ready]))
+            yield buffer[ready].iloc[order]
+            buffer = buffer[~ready]
+            buffer_runs = buffer_runs[~ready]
+        if bound is None:
+            return
+        to_read = [i for i, key in enumerate(last_keys) if key is not None and key == bound]
+
+# fields of the dbSnp153 records returned by query_data, and their column in the rest of a '.bb' entry
+_DBSNP_FIELDS = ["name", "ref", "alts"]
+_DBSNP_COLUMNS = {"name": 0, "ref": 1, "alts": 3}
+
+# helper function to parse the given fields (in the order of _DBSNP_FIELDS) from the rest of a dbSnp153 '.bb' entry,
+# the line is only split up to the last field asked for
+# ("rs123\tA\t2\tC,T,\t...", fields: name, ref, altCount, alts, ...) -> ("rs123", "A", "C,T")
+def _parse_dbsnp_entry( raw_string, fields):
+    entry = raw_string.split("\t", _DBSNP_COLUMNS[fields[-1]] + 1 if fields else 0)
+    parsed = []
+    for field in fields:
+        column = _DBSNP_COLUMNS[field]
+        value = entry[column] if column < len(entry) else ""
+        parsed.append(value.rstrip(",") if field == "alts" else value)
+    return tuple(parsed)
+
+# helper function to turn the parsed records of query_data into a table, the alleles repeat a lot and are stored as categories
+def _dbsnp_frame( result, fields):
+    keys = list(result)
+    records = pd.DataFrame({
+        "Chr": pd.Series([key[0] for key in keys], dtype=object),
+        "BP": np.array([key[1] for key in keys], dtype="int64"),
+    })
+    values = list(result.values())
+    for i, field in enumerate(fields):
+        col = [value[i] for value in values]
+        records[field] = pd.array(col, dtype="string") if field == "name" else pd.Categorical(col)
+    return records
+
+# helper function to split the raw dbSnp153 strings of the python dictionary returned by older versions of query_data
+# (e.g. saved with save_obj) into columns, the tables returned by query_data are used as they are
+def _dbsnp_records( data):
+    if isinstance(data, pd.DataFrame):
+        return data
+    keys = list(data.keys())
+    records = pd.DataFrame({
+        "Chr": [key[0] for key in keys],
+        "BP": np.array([key[1] for key in keys], dtype="int64"),
+    })
+    fields = pd.Series(list(data.values()), dtype=object).str.split("\t", n=4, expand=True)
+    for name, col in _DBSNP_COLUMNS.items():
+        records[name] = fields[col] if col in fields else pd.Series(dtype=object)
+    return records
+
+# helper function to join the dbSnp153 records to the rows of the data, rows not found in dbSnp153 get missing values
+def _join_dbsnp( df, data, fields):
+    records = _dbsnp_records(data)
+    for field in fields:
+        if field not in records.columns:
+            raise ValueError('The dbSnp153 data has no "' + field + '" field! Query it with query_data(..., fields=' + str(fields) + ').')
+    keys = pd.DataFrame({
+        "Chr": df["Chr"].astype(str).to_numpy(dtype=object),
+        "BP": df["BP"].to_numpy(dtype="int64", na_value=-1),
+    })
+    return keys.merge(records[["Chr", "BP"] + fields], on=["Chr", "BP"], how="left")
+
+# helper function to parse the ref/alts strings of dbSnp153 (e.g. "A,T,"), each distinct string is only parsed once
+def _parse_dbsnp_alleles( raw_alleles):
+    codes, uniques = pd.factorize(raw_alleles.to_numpy(dtype=object, na_value=None))
+    parsed = [allele.replace(",", "") for allele in uniques]
+    allele_table = np.array(parsed + [pd.NA], dtype=object)
+    single_table = np.array([len(allele) == 1 for allele in parsed] + [False])
+    return allele_table[codes], single_table[codes]
+
+# helper function to match the rows of the data to the reference by packed Chr + BP keys (the first reference row of
+# each key is used), and compare the alleles: nochange (same alleles), align (alleles swapped) or error
+def _match_alleles( reference, reference_key, df, key):
+    first = ~pd.Series(reference_key).duplicated().to_numpy()
+    reference = reference[first]
+    position = pd.Index(reference_key[first]).get_indexer(key)
+    found = position >= 0
+    # encode the four alleles of each row as integers (missing or not found: -1), and compare the codes
+    n = len(df)
+    alleles = np.concatenate([
+        df["A1"].to_numpy(dtype=object, na_value=None),
+        df["A2"].to_numpy(dtype=object, na_value=None),
+        np.append(reference["A1"].to_numpy(dtype=object, na_value=None), None)[position],
+        np.append(reference["A2"].to_numpy(dtype=object, na_value=None), None)[position],
+    ])
+    codes = pd.factorize(alleles)[0].reshape(4, n)
+    known = (codes >= 0).all(axis=0)
+    nochange = known & (codes[0] == codes[2]) & (codes[1] == codes[3])
+    align = known & ~nochange & (codes[0] == codes[3]) & (codes[1] == codes[2])
+    error = found & ~nochange & ~align
+    return reference, position, found, nochange, align, error
+
+# helper function to keep the rows that can be aligned, with one copy of them, and swap the aligned rows in place
+def _aligned_rows( df, nochange, align):
+    keep = nochange | align
+    result = df[keep].reset_index(drop=True)
+    swap = pd.Series(align[keep])
+    a1 = result["A1"]
+    result["A1"] = a1.where(~swap, result["A2"])
+    result["A2"] = result["A2"].where(~swap, a1)
+    result["Beta"] = result["Beta"].where(~swap, -result["Beta"])
+    result["EAF"] = result["EAF"].where(~swap, 1 - result["EAF"])
+    return result
+
+# helper function to get the rows that cannot be aligned, with the alleles of both tables
+def _error_rows( df, reference, position, error):
+    error_rows = df[error].reset_index(drop=True)
+    error_rows["process_A1"] = error_rows["A1"]
+    error_rows["process_A2"] = error_rows["A2"]
+    error_rows["reference_A1"] = reference["A1"].take(position[error]).reset_index(drop=True)
+    error_rows["reference_A2"] = reference["A2"].take(position[error]).reset_index(drop=True)
+    return error_rows
+
+# helper function to print the summary of align_effect_allele
+def _print_align_log( nochange, align, error):
+    _count("unchanged", nochange)
+    _count("aligned", align)
+    _count("align_errors", error)
+    _log(str(nochange) + " rows were left unchanged (already aligned)")
+    _log(str(align) + " rows were aligned successfully")
+    _log(str(error) + " rows failed to align, dropped from result! Set the check_error_rows flag to True to view them.")
+
+# helper function to check that a chunk is sorted and continues the order of the previous chunk
+def _check_sorted_chunk( key, last_key, name):
+    if not _is_sorted(key) or (last_key is not None and key[0] < last_key):
+        raise ValueError("The " + name + " chunks are not sorted by Chr and BP! Sort them first (see sort_in_chunks).")
+
 # helper function to lift over
 def _lift_over_basic( df, lo_dict):
+    if "chain_index" in lo_dict:
+        return _lift_over_array(df, lo_dict)
     cols = list(df.columns)
     temp = []
     lo = lo_dict["lo"]
@@ -551,11 +2404,737 @@ def _lift_over_basic( df, lo_dict):
     temp_df = temp_df.astype(dtype)
     return temp_df
 
+# helper function to lift over whole columns with the array index of the chain file, gives the same table as the row by row version
+def _lift_over_array( df, lo_dict):
+    chain_index = lo_dict["chain_index"]
+    output_version = lo_dict["output_version"]
+    chrom_values = df["Chr"].astype(str)
+    bp_values = df["BP"].to_numpy(dtype="int64", na_value=-1)
+    new_chrom = np.full(len(df), -1, dtype="int64")
+    new_pos = np.zeros(len(df), dtype="int64")
+    for chrom, rows in chrom_values.groupby(chrom_values, sort=False).indices.items():
+        chain = chain_index["chroms"].get("chr" + chrom)
+        if chain is None:
+            continue
+        new_chrom[rows], new_pos[rows] = _convert_positions(chain, bp_values[rows])
+    mask = (new_chrom >= 0) & (bp_values >= 0)
+    # target names without the "chr" prefix, as in the row by row version
+    targets = np.array([target[3:] for target in chain_index["targets"]], dtype=object)
+    new_chr_name = output_version + '_' + 'chr'
+    new_pos_name = output_version + '_' + 'pos'
+    temp_df = pd.DataFrame({
+        "Chr": chrom_values.to_numpy(dtype=object)[mask],
+        "BP": bp_values[mask],
+        new_chr_name: targets[new_chrom[mask]],
+        new_pos_name: new_pos[mask],
+    })
+    dtype= {new_chr_name: str, new_pos_name:'Int64'}
+    temp_df.drop_duplicates(subset = ['Chr','BP'], inplace=True)
+    temp_df = temp_df.astype(dtype)
+    return temp_df
+
+# helper function to convert positions of one chromosome, returns the target chromosome code (-1 if not convertible) and position
+def _convert_positions( chain, pos):
+    seg = np.searchsorted(chain["start"], pos, side="right") - 1
+    valid = seg >= 0
+    seg[~valid] = 0
+    target = np.where(valid & (pos < chain["end"][seg]), chain["target"][seg], -1)
+    new_pos = pos + chain["offset"][seg]
+    # positions on the reverse strand are counted from the end of the target chromosome
+    new_pos = np.where(chain["reverse"][seg], chain["size"][seg] - 1 - new_pos, new_pos)
+    return target, new_pos
+
+# helper function to read a chain file into per chromosome sorted arrays of non-overlapping segments
+# where chains overlap, the segment is mapped by the chain with the highest score, ties are broken as pyliftover does (see _tree_priorities)
+def _build_chain_index( f):
+    targets = {}
+    blocks = {}
+    sizes = {}
+    chain_id = 0
+    for line in f:
+        if isinstance(line, bytes):
+            line = line.decode("ascii")
+        fields = line.split()
+        if not fields or fields[0].startswith("#"):
+            continue
+        if fields[0] == "chain":
+            # chain score tName tSize tStrand tStart tEnd qName qSize qStrand qStart qEnd id
+            score = int(fields[1])
+            chrom_blocks = blocks.setdefault(fields[2], [])
+            sizes.setdefault(fields[2], int(fields[3]))
+            sfrom = int(fields[5])
+            target = targets.setdefault(fields[7], len(targets))
+            target_size = int(fields[8])
+            reverse = fields[9] == "-"
+            tfrom = int(fields[10])
+            chain_id += 1
+            continue
+        size = int(fields[0])
+        if size > 0:
+            chrom_blocks.append((sfrom, sfrom + size, tfrom - sfrom, target, target_size, reverse, score, chain_id))
+        if len(fields) == 3:
+            sfrom += size + int(fields[1])
+            tfrom += size + int(fields[2])
+    chroms = {}
+    for chrom, chrom_blocks in blocks.items():
+        arr = np.array(chrom_blocks, dtype="int64").reshape(-1, 8)
+        start, end = arr[:, 0], arr[:, 1]
+        order = np.argsort(start, kind="stable")
+        if len(arr) > 1 and np.any(start[order][1:] < np.maximum.accumulate(end[order])[:-1]):
+            # split into elementary segments and paint the (parts of) blocks over them, lowest priority first
+            part_block, part_start, part_end, priority = _tree_priorities(start, end, arr[:, 6], sizes[chrom])
+            bounds = np.unique(np.concatenate([part_start, part_end]))
+            winner = np.full(len(bounds) - 1, -1, dtype="int64")
+            for i in priority:
+                winner[np.searchsorted(bounds, part_start[i]):np.searchsorted(bounds, part_end[i])] = part_block[i]
+            covered = winner >= 0
+            seg_start, seg_end, arr = bounds[:-1][covered], bounds[1:][covered], arr[winner[covered]]
+        else:
+            arr = arr[order]
+            seg_start, seg_end = arr[:, 0], arr[:, 1]
+        chroms[chrom] = {
+            "start": seg_start,
+            "end": seg_end,
+            "offset": arr[:, 2],
+            "target": arr[:, 3],
+            "size": arr[:, 4],
+            "reverse": arr[:, 5].astype(bool),
+        }
+    return {"targets": list(targets), "chroms": chroms}
+
+# helper function to order the blocks of one chromosome (in file order) as pyliftover picks among overlapping ones:
+# the highest score, then the first returned by its interval tree (pyliftover.intervaltree). The tree node of each block
+# is found as pyliftover builds it: a node [min, max) with a single interval keeps it, otherwise an interval goes left
+# if it ends at or before the center, right if it starts after it, and stays in the node if it contains it. A query x
+# lists the intervals of the left child then those of the node by start when x < center, and those of the node by
+# decreasing end then the right child otherwise (stable sorts, so file order on ties). The blocks staying in a node are
+# split at the center, each part then has a fixed rank. Returns the block, start and end of the parts and their
+# painting order (the part painted last wins)
+def _tree_priorities( start, end, score, size):
+    n = len(start)
+    node = np.ones(n, dtype="int64") # path from the root, 1 then one bit per level (1 = right)
+    low, high = np.zeros(n), np.full(n, float(size))
+    center = np.full(n, np.nan) # center of the node of each block, nan for a node with a single interval
+    active = np.ones(n, dtype=bool)
+    while active.any():
+        idx = np.flatnonzero(active)
+        _, inverse, counts = np.unique(node[idx], return_inverse=True, return_counts=True)
+        single = counts[inverse] == 1
+        active[idx[single]] = False
+        idx = idx[~single]
+        mid = (low[idx] + high[idx]) / 2
+        left, right = end[idx] <= mid, start[idx] > mid
+        stays = ~left & ~right
+        center[idx[stays]] = mid[stays]
+        active[idx[stays]] = False
+        # children as in pyliftover: IntervalTree(int(min), center) and IntervalTree(center, int(max))
+        go = idx[left]
+        node[go], low[go], high[go] = 2 * node[go], np.trunc(low[go]), mid[left]
+        go = idx[right]
+        node[go], low[go], high[go] = 2 * node[go] + 1, mid[right], np.trunc(high[go])
+    parts, keys = [], []
+    for i in range(n):
+        path = tuple(int(bit) for bit in bin(node[i])[3:])
+        if np.isnan(center[i]):
+            parts.append((i, start[i], end[i]))
+            keys.append((score[i], path + (0, start[i], i)))
+            continue
+        split = min(max(int(np.ceil(center[i])), start[i]), end[i])
+        # x < center: after the blocks of the left child, by start. x >= center: before the right child, by decreasing end
+        if split > start[i]:
+            parts.append((i, start[i], split))
+            keys.append((score[i], path + (1, start[i], i)))
+        if split < end[i]:
+            parts.append((i, split, end[i]))
+            keys.append((score[i], path + (0, -end[i], i)))
+    # lowest score first, and among equal scores the block listed first by the tree last
+    priority = sorted(range(len(parts)), key=lambda j: keys[j][1], reverse=True)
+    priority.sort(key=lambda j: keys[j][0])
+    part_block, part_start, part_end = (np.array(values, dtype="int64") for values in zip(*parts))
+    return part_block, part_start, part_end, priority
 
 # helper function for liftover
 def _lift_over_merge( df, reference_table):
     result = pd.merge(reference_table, df, on=["Chr", "BP"], how="right")
     return result
+
+
+# fields and dtypes of the dbSnp153 index arrays, alleles are stored as codes into _ALLELES (0: not a single base)
+_INDEX_DTYPES = dict(pos="uint32", rsid="uint64", ref="uint8", alt="uint8")
+_ALLELES = np.array(["", "A", "C", "G", "T", "N"], dtype=object)
+
+# helper function to convert the chromosome name in the data to the chromosome name in dbSnp153
+def _ucsc_chrom( chrom):
+    chrom = str(chrom)
+    if chrom == "23":
+        return "chrX"
+    if chrom == "24":
+        return "chrY"
+    return "chr" + chrom
+
+# helper function to encode alleles as codes into _ALLELES
+def _encode_alleles( alleles):
+    stripped = alleles.astype(str).str.replace(",", "", regex=False)
+    # other alleles (several bases or several alleles) get code 0
+    codes = pd.Categorical(stripped.where(stripped.isin(_ALLELES[1:])), categories=_ALLELES[1:]).codes + 1
+    return codes.astype("uint8")
+
+# helper function to parse the fields of dbSnp153 records into index arrays
+def _parse_dbsnp_fields( pos, name, ref, alts):
+    rsid = _rsid_numbers(name).fillna(0)
+    return {
+        "pos": np.asarray(pos),
+        "rsid": rsid.to_numpy(dtype="uint64"),
+        "ref": _encode_alleles(ref),
+        "alt": _encode_alleles(alts),
+    }
+
+# helper function to concatenate the parsed parts of one chromosome
+def _concat_shard( parts):
+    if not parts:
+        return {field: np.array([], dtype=dtype) for field, dtype in _INDEX_DTYPES.items()}
+    return {field: np.concatenate([part[field] for part in parts]) for field in _INDEX_DTYPES}
+
+# helper function to read dbSnp153 records per chromosome from the '.bb' file, one window at a time
+def _read_dbsnp_bigbed( link, chroms, window):
+    bb = _open_bigbed(link)
+    sizes = bb.chroms()
+    if chroms is None:
+        chroms = list(sizes)
+    for chrom in chroms:
+        if chrom not in sizes:
+            _log(chrom, " cannot be found in ", link)
+            continue
+        parts = []
+        for start in range(0, sizes[chrom], window):
+            dat = bb.entries(chrom, start, min(start + window, sizes[chrom]))
+            if dat is None:
+                continue
+            starts = np.array([i[0] for i in dat], dtype="int64")
+            ends = np.array([i[1] for i in dat], dtype="int64")
+            # records overlapping the window border are returned twice, keep them in the window they start in
+            keep = (ends - starts == 1) & (starts >= start)
+            if not keep.any():
+                continue
+            fields = pd.Series([i[2] for i in dat])[keep].str.split("\t", n=4, expand=True)
+            parts.append(_parse_dbsnp_fields(ends[keep], fields[0], fields[1], fields[3]))
+        yield chrom, _concat_shard(parts)
+    bb.close()
+
+# helper function to read dbSnp153 records per chromosome from bed dumps
+def _read_dbsnp_bed( paths, chroms):
+    if isinstance(paths, str):
+        paths = [paths]
+    parts = {}
+    for path in paths:
+        reader = pd.read_csv(path, sep="\t", header=None, usecols=[0, 1, 2, 3, 4, 6], dtype={0: str, 3: str, 4: str, 6: str}, keep_default_na=False, chunksize=1000000)
+        for chunk in reader:
+            chunk = chunk[chunk[2] - chunk[1] == 1]
+            if chroms is not None:
+                chunk = chunk[chunk[0].isin(chroms)]
+            for chrom, group in chunk.groupby(0, sort=False):
+                parts.setdefault(chrom, []).append(_parse_dbsnp_fields(group[2].to_numpy(), group[3], group[4], group[6]))
+    for chrom, chrom_parts in parts.items():
+        yield chrom, _concat_shard(chrom_parts)
+
+# helper function to list the tasks of build_dbsnp_index: the chromosomes of the '.bb' file, largest first so that
+# the workers finish at about the same time, or the bed dump files
+def _index_tasks( source, chroms):
+    if isinstance(source, str) and source.endswith(".bb"):
+        bb = _open_bigbed(source)
+        sizes = bb.chroms()
+        bb.close()
+        if chroms is None:
+            chroms = list(sizes)
+        return sorted(chroms, key=lambda chrom: -sizes.get(chrom, 0))
+    if isinstance(source, str):
+        return [source]
+    return list(source)
+
+# helper function to run one task of build_dbsnp_index, the chromosomes read are written as sorted parts into part_dir
+def _build_index_task( source, task, part_dir, chroms, window):
+    os.makedirs(part_dir, exist_ok=True)
+    if isinstance(source, str) and source.endswith(".bb"):
+        shards = _read_dbsnp_bigbed(source, [task], window)
+    else:
+        shards = _read_dbsnp_bed(task, chroms)
+    counts = {}
+    for chrom, shard in shards:
+        count = _write_index_shard(part_dir, chrom, shard)
+        if count > 0:
+            counts[chrom] = count
+    return counts
+
+# helper function to turn the parts written by the tasks into the index shards, parts of one chromosome from
+# several bed dumps are merged in the order of the files
+def _merge_index_parts( index_dir, parts_dir, task_counts):
+    chrom_parts = {}
+    for i, counts in enumerate(task_counts):
+        for chrom, count in counts.items():
+            chrom_parts.setdefault(chrom, []).append((os.path.join(parts_dir, str(i)), count))
+    counts = {}
+    for chrom, parts in chrom_parts.items():
+        if len(parts) == 1: # already sorted and deduplicated, only move the files
+            part_dir, counts[chrom] = parts[0]
+            for field in _INDEX_DTYPES:
+                name = chrom + "." + field + ".npy"
+                os.replace(os.path.join(part_dir, name), os.path.join(index_dir, name))
+        else:
+            shard = _concat_shard([{field: np.load(os.path.join(part_dir, chrom + "." + field + ".npy")) for field in _INDEX_DTYPES} for part_dir, _ in parts])
+            counts[chrom] = _write_index_shard(index_dir, chrom, shard)
+    if os.path.isdir(parts_dir):
+        shutil.rmtree(parts_dir)
+    return counts
+
+# helper function to read the manifest of an index being built, None if there is no build of the same source to resume
+def _read_index_manifest( index_dir, source, chroms):
+    path = os.path.join(index_dir, "index.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        manifest = json.load(f)
+    if manifest.get("source") != source or manifest.get("chroms_requested") != chroms or "done" not in manifest:
+        return None
+    return manifest
+
+# helper function to write the manifest of the index, through a temporary file so an interrupted write does not lose it
+def _write_index_manifest( index_dir, manifest):
+    path = os.path.join(index_dir, "index.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(path + ".tmp", path)
+
+# helper function to sort one chromosome of the index and write it to disk
+def _write_index_shard( index_dir, chrom, shard):
+    order = np.argsort(shard["pos"], kind="stable")
+    pos = shard["pos"][order]
+    if len(pos) == 0:
+        return 0
+    # dbSnp153 can have several records at one position, keep the last one as query_data does
+    keep = order[np.append(pos[1:] != pos[:-1], True)]
+    for field, dtype in _INDEX_DTYPES.items():
+        np.save(os.path.join(index_dir, chrom + "." + field + ".npy"), shard[field][keep].astype(dtype))
+    return len(keep)
+
+# helper function to print the summary of a dbSnp153 query
+def _print_query_log( not_found, log, print_log):
+    _count("not_found", not_found)
+    _count("unmatched_chrom", len(log))
+    _log(not_found, " cannot be found in dbSnp153")
+    if print_log:
+        _log("The following Chr + BP cannot be matched with current genome build version")
+        _log(log)
+    else:
+        _log(len(log), " does not be matched with current genome build")
+
+# block caches opened by open_block_cache, by link
+_BLOCK_CACHES = {}
+
+# helper function to tell whether a link is a remote file
+def _is_remote( link):
+    return isinstance(link, str) and (link.startswith("http://") or link.startswith("https://") or link.startswith("ftp://"))
+
+# helper function to get the link to open, the local link of the block cache if one is open for the link
+def _bigbed_link( link):
+    if isinstance(link, str) and link in _BLOCK_CACHES:
+        return _BLOCK_CACHES[link]["local_link"]
+    return link
+
+# helper function to open a '.bb' file, through its block cache if one is open
+def _open_bigbed( link):
+    return pyBigWig.open(_bigbed_link(link))
+
+# helper function to get the block statistics of the cache of a link (zeros without a cache)
+def _block_cache_stats( link):
+    if isinstance(link, str) and link in _BLOCK_CACHES:
+        return dict(_BLOCK_CACHES[link]["stats"])
+    return {"block_hits": 0, "block_fetches": 0, "block_prefetches": 0}
+
+# helper function to get the size of a remote file, and its ETag or modified time to notice when it changes
+def _remote_file_info( link):
+    with urllib.request.urlopen(urllib.request.Request(link, method="HEAD")) as response:
+        size = response.headers.get("Content-Length")
+        version = response.headers.get("ETag") or response.headers.get("Last-Modified")
+    if size is None: # no size in the HEAD response, ask for the first byte
+        with urllib.request.urlopen(urllib.request.Request(link, headers={"Range": "bytes=0-0"})) as response:
+            size = response.headers["Content-Range"].split("/")[-1]
+    return int(size), version
+
+# helper function to fetch the bytes [start, end) of a remote file
+def _fetch_range( link, start, end):
+    request = urllib.request.Request(link, headers={"Range": "bytes=" + str(start) + "-" + str(end - 1)})
+    with urllib.request.urlopen(request) as response:
+        data = response.read()
+        if response.status == 200: # the server ignored the range and sent the whole file
+            data = data[start:end]
+    if len(data) != end - start:
+        raise IOError("Incomplete read of " + link + " (bytes " + str(start) + "-" + str(end - 1) + ")")
+    return data
+
+# helper function to get the path of a block of the cache, fetching it if it is not on disk. A block being loaded by
+# another thread (e.g. fetched ahead) is waited for instead of fetched twice
+def _cached_block( cache, i, prefetched=False):
+    with cache["lock"]:
+        if prefetched and i not in cache["window"]: # the reads moved past the block before it was fetched ahead
+            return None
+        future = cache["loading"].get(i)
+        owner = future is None
+        if owner:
+            future = cache["loading"][i] = concurrent.futures.Future()
+    if owner:
+        try:
+            future.set_result(_load_block(cache, i, prefetched))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with cache["lock"]:
+                cache["loading"].pop(i, None)
+    return future.result()
+
+# helper function to load one block: read from disk (marked as recently used), or fetched, written and the least
+# recently used blocks removed if the cache is too large
+def _load_block( cache, i, prefetched):
+    path = os.path.join(cache["block_dir"], str(i) + ".blk")
+    if os.path.exists(path):
+        os.utime(path)
+        if not prefetched:
+            with cache["lock"]:
+                cache["stats"]["block_hits"] += 1
+        return path
+    start = i * cache["block_size"]
+    data = _fetch_range(cache["link"], start, min(start + cache["block_size"], cache["size"]))
+    with tempfile.NamedTemporaryFile(dir=cache["block_dir"], suffix=".tmp", delete=False) as f:
+        f.write(data)
+    os.replace(f.name, path)
+    with cache["lock"]:
+        cache["stats"]["block_prefetches" if prefetched else "block_fetches"] += 1
+        cache["used"] += len(data)
+        if cache["used"] > cache["max_size"]:
+            _evict_blocks(cache, path)
+    return path
+
+# helper function to remove the least recently used blocks until the cache fits its maximum size, keeping the block just
+# added, the blocks of the last read and the blocks fetched ahead of it
+def _evict_blocks( cache, keep):
+    window = set(os.path.join(cache["block_dir"], str(i) + ".blk") for i in cache["window"])
+    paths = [os.path.join(cache["block_dir"], name) for name in os.listdir(cache["block_dir"]) if name.endswith(".blk")]
+    blocks = []
+    for path in paths:
+        if path in window:
+            continue
+        try:
+            blocks.append((os.path.getmtime(path), path))
+        except OSError:
+            continue
+    for _, path in sorted(blocks):
+        if cache["used"] <= cache["max_size"]:
+            break
+        if path == keep:
+            continue
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            continue
+        cache["used"] -= size
+
+# helper function to read the bytes [start, end) of the remote file from the blocks of the cache, and fetch the
+# next blocks ahead when the reads move forward
+def _read_cached_range( cache, start, end):
+    first = start // cache["block_size"]
+    last = (end - 1) // cache["block_size"]
+    ahead = range(last + 1, last + 1)
+    if cache["prefetch"] > 0 and first >= cache["last_block"]:
+        # only as many blocks as fit in the cache next to the blocks of this read, so that none is removed before it is read
+        fit = cache["max_size"] // cache["block_size"] - (last - first + 1)
+        ahead = range(last + 1, min(last + 1 + max(0, min(cache["prefetch"], fit)), (cache["size"] - 1) // cache["block_size"] + 1))
+    with cache["lock"]:
+        cache["window"] = range(first, ahead.stop)
+    for i in ahead:
+        if i not in cache["loading"] and not os.path.exists(os.path.join(cache["block_dir"], str(i) + ".blk")):
+            cache["executor"].submit(_cached_block, cache, i, True)
+    cache["last_block"] = last
+    for i in range(first, last + 1):
+        block_start = i * cache["block_size"]
+        offset = max(start, block_start) - block_start
+        length = min(end, block_start + cache["block_size"]) - block_start - offset
+        for attempt in range(2):
+            try:
+                with open(_cached_block(cache, i), "rb") as f:
+                    f.seek(offset)
+                    data = f.read(length)
+                break
+            except FileNotFoundError: # removed by another process sharing the cache, load it again
+                if attempt == 1:
+                    raise
+        yield data
+
+# helper class of the local HTTP server of a block cache, answering HEAD and (range) GET requests from the cache
+class _BlockCacheHandler(http.server.BaseHTTPRequestHandler):
+    cache = None
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self._send(body=False)
+
+    def do_GET(self):
+        self._send(body=True)
+
+    def _send(self, body):
+        size = self.cache["size"]
+        start, end = 0, size
+        status = 200
+        ranges = self.headers.get("Range")
+        if ranges is not None and ranges.startswith("bytes="):
+            first, _, last = ranges[len("bytes="):].split(",")[0].strip().partition("-")
+            if first == "": # the last bytes of the file
+                start, end = max(0, size - int(last)), size
+            else:
+                start, end = int(first), min(size, int(last) + 1) if last else size
+            if start >= size or start >= end:
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */" + str(size))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+        self.send_response(status)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start))
+        if status == 206:
+            self.send_header("Content-Range", "bytes " + str(start) + "-" + str(end - 1) + "/" + str(size))
+        self.end_headers()
+        if body:
+            for data in _read_cached_range(self.cache, start, end):
+                self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+# helper function to query the positions of one chromosome from the '.bb' file, one window of nearby positions at a time
+def _query_bigbed_chrom( bb, chrom, bp, window, fields):
+    result = {}
+    ucsc_chrom = _ucsc_chrom(chrom)
+    # positions on a chromosome not in the '.bb' file or past its end cannot be queried, as in the row by row query
+    # they are logged and not counted as not found
+    outside = bp > (bb.chroms(ucsc_chrom) or 0)
+    log = [(ucsc_chrom, pos - 1, pos) for pos in bp[outside].tolist()]
+    bp = bp[~outside]
+    positions = np.unique(bp)
+    i = 0
+    while i < len(positions):
+        j = int(np.searchsorted(positions, positions[i] + window))
+        start_pos = int(positions[i]) - 1
+        end_pos = int(positions[j - 1])
+        dat = bb.entries(ucsc_chrom, start_pos, end_pos)
+        hits = {}
+        if dat != None:
+            for entry in dat:
+                if entry[1] - entry[0] == 1: # only single base records can match a Chr + BP key
+                    hits[entry[1]] = entry[2]
+        for pos in positions[i:j].tolist():
+            if pos in hits:
+                result[(chrom, pos)] = _parse_dbsnp_entry(hits[pos], fields) # only the matched entries are parsed
+        i = j
+    not_found = sum(1 for pos in bp.tolist() if (chrom, pos) not in result)
+    return result, not_found, log
+
+# helper function to query one chunk of positions in a worker process, the '.bb' file is opened once per process
+_worker_bb = {}
+def _query_bigbed_task( link, chrom, bp, window, fields):
+    if link not in _worker_bb:
+        _worker_bb[link] = _open_bigbed(link)
+    return _query_bigbed_chrom(_worker_bb[link], chrom, bp, window, fields)
+
+# helper function to query the '.bb' file per chromosome, in chunks of sorted positions and optionally in worker processes
+def _query_bigbed_grouped( df, link, window, workers, chunk_size, fields):
+    bp_values = df["BP"].to_numpy(dtype="int64", na_value=-1)
+    chrom_values = df["Chr"].astype(str)
+    tasks = []
+    for chrom, rows in chrom_values.groupby(chrom_values, sort=False).indices.items():
+        bp = np.sort(bp_values[rows])
+        bp = bp[bp > 0]
+        for start in range(0, len(bp), chunk_size):
+            tasks.append((chrom, bp[start:start + chunk_size]))
+    if workers is None or workers <= 1:
+        bb = _open_bigbed(link)
+        outputs = [_query_bigbed_chrom(bb, chrom, bp, window, fields) for chrom, bp in tasks]
+        bb.close()
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            # the workers read the link through the block cache of this process, if one is open
+            futures = [executor.submit(_query_bigbed_task, _bigbed_link(link), chrom, bp, window, fields) for chrom, bp in tasks]
+            outputs = [future.result() for future in futures]
+    result = {}
+    log = []
+    not_found = 0
+    for task_result, task_not_found, task_log in outputs:
+        result.update(task_result)
+        not_found += task_not_found
+        log.extend(task_log)
+    return result, not_found, log
+
+# helper function to query the '.bb' file, returns the records (the given fields only), the number of rows not found
+# and the rows of unknown chromosomes
+def _query_bigbed( df, link, window, workers, chunk_size, fields):
+    if window is not None or workers is not None:
+        # one query per distinct position is the same as one query per row
+        return _query_bigbed_grouped(df, link, window or 1, workers, chunk_size, fields)
+    bb = _open_bigbed(link)
+    result = {}
+    log = []
+    not_found = 0
+    for row in df.itertuples():       
+        chrom = _ucsc_chrom(row.Chr)
+        end_pos = row.BP
+        start_pos =end_pos - 1
+        # print(chrom, start_pos, end_pos)
+        try:
+            dat = bb.entries(chrom, start_pos, end_pos)
+        except RuntimeError:
+            log.append((chrom, start_pos, end_pos))
+            continue
+        key = (str(row.Chr), int(end_pos))
+        if dat != None:  
+            for i in dat:
+                reference_start = i[0]
+                reference_end = i[1]
+                raw_string = i[2]
+                if reference_start == start_pos and reference_end == end_pos:
+                    result[key] = _parse_dbsnp_entry(raw_string, fields)
+        # not found: no single base record at the position, as in the grouped query
+        if key not in result:
+            not_found += 1
+    bb.close()
+    return result, not_found, log
+
+# version of the layout of the query cache (keys and segments), to be increased whenever the layout changes, and the
+# number of segments above which the segments of a '.bb' file are compacted into one
+_QUERY_CACHE_VERSION = 3
+_QUERY_CACHE_MAX_SEGMENTS = 16
+
+# helper function to get the directory caching the query results of one '.bb' file
+# local files are identified by their path, size and modified time, so the cache is not used after the file changes
+def _query_cache_dir( link, cache_dir):
+    if os.path.isfile(link):
+        stat = os.stat(link)
+        source = {"path": os.path.abspath(link), "size": stat.st_size, "mtime": stat.st_mtime_ns}
+    else:
+        source = {"link": link}
+    source["version"] = _QUERY_CACHE_VERSION
+    source_json = json.dumps(source, sort_keys=True)
+    source_dir = os.path.join(cache_dir, hashlib.sha1(source_json.encode()).hexdigest())
+    if not os.path.isdir(source_dir):
+        os.makedirs(source_dir)
+        with open(os.path.join(source_dir, "source.json"), "w") as f:
+            f.write(source_json)
+    return source_dir
+
+# helper function to read all the cached segments of one '.bb' file, segments of another version of the layout are
+# skipped, and once there are more than _QUERY_CACHE_MAX_SEGMENTS segments they are compacted into one
+# returns the found records, the keys not in dbSnp153 and the keys of chromosomes not in the '.bb' file
+def _read_query_cache( source_dir):
+    found = {}
+    missing = set()
+    unknown = set()
+    paths = []
+    for name in sorted(os.listdir(source_dir)):
+        if name.endswith(".pkl"):
+            try:
+                segment = load_obj(os.path.join(source_dir, name))
+            except FileNotFoundError: # compacted by another process meanwhile
+                continue
+            if not isinstance(segment, dict) or segment.get("version") != _QUERY_CACHE_VERSION:
+                continue
+            found.update(segment["found"])
+            missing.update(segment["missing"])
+            unknown.update(segment["unknown"])
+            paths.append(os.path.join(source_dir, name))
+    if len(paths) > _QUERY_CACHE_MAX_SEGMENTS:
+        # the merged segment is written before the segments it replaces are removed, so no record is ever lost
+        merged = _write_query_cache(source_dir, found, missing, unknown)
+        for path in paths:
+            if path != merged:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+    return found, missing, unknown
+
+# helper function to write one segment of the cache, named by the hash of its content so the same segment is only stored once
+# returns the path of the segment
+def _write_query_cache( source_dir, found, missing, unknown):
+    content = pickle.dumps({"version": _QUERY_CACHE_VERSION, "found": found, "missing": missing, "unknown": unknown}, pickle.HIGHEST_PROTOCOL)
+    path = os.path.join(source_dir, hashlib.sha1(content).hexdigest() + ".pkl")
+    if os.path.exists(path):
+        return path
+    # write to a temporary file first, so other processes never read a partial segment
+    with tempfile.NamedTemporaryFile(dir=source_dir, suffix=".tmp", delete=False) as f:
+        f.write(content)
+    os.replace(f.name, path)
+    return path
+
+# helper function to query the '.bb' file through the on-disk cache, only the keys not cached are queried
+# (with all the fields, as the cache serves the queries of any fields)
+def _query_cached( df, link, window, workers, chunk_size, cache_dir):
+    source_dir = _query_cache_dir(link, cache_dir)
+    found, missing, unknown = _read_query_cache(source_dir)
+    keys = list(zip(df["Chr"].astype(str), df["BP"].tolist()))
+    hit = np.array([key in found or key in missing or key in unknown for key in keys], dtype=bool)
+    _log(int(hit.sum()), " of ", len(keys), " rows found in the query cache")
+    _count("cache_hits", hit.sum())
+    _count("cache_misses", len(keys) - hit.sum())
+    result = {}
+    not_found = 0
+    log = []
+    for key, is_hit in zip(keys, hit):
+        if not is_hit:
+            continue
+        if key in found:
+            result[key] = found[key]
+        elif key in missing:
+            not_found += 1
+        else:
+            log.append((_ucsc_chrom(key[0]), key[1] - 1, key[1]))
+    if hit.all():
+        return result, not_found, log
+    new_df = df[~hit]
+    new_result, new_not_found, new_log = _query_bigbed(new_df, link, window, workers, chunk_size, _DBSNP_FIELDS)
+    result.update(new_result)
+    # the positions that could not be queried (unknown chromosome or past its end), the others not found are missing
+    unknown_positions = set((entry[0], entry[2]) for entry in new_log)
+    new_missing = []
+    new_unknown = []
+    for key in set(zip(new_df["Chr"].astype(str), new_df["BP"].tolist())):
+        if key in new_result or pd.isna(key[1]):
+            continue
+        if (_ucsc_chrom(key[0]), key[1]) in unknown_positions:
+            new_unknown.append(key)
+        else:
+            new_missing.append(key)
+    _write_query_cache(source_dir, new_result, new_missing, new_unknown)
+    return result, not_found + new_not_found, log + new_log
+
+# helper function to query the dbSnp153 index in the same way as query_data queries the '.bb' file
+def _query_index( df, index, print_log, fields):
+    if not isinstance(index, dict):
+        index = load_dbsnp_index(index)
+    found = lookup_dbsnp_index(df, index)
+    unknown_chrom = ~df["Chr"].astype(str).map(_ucsc_chrom).isin(index["shards"].keys())
+    log = [(_ucsc_chrom(row.Chr), row.BP - 1, row.BP) for row in df[unknown_chrom].itertuples()]
+    not_found = len(df) - int(unknown_chrom.sum()) - len(found)
+    found = found.drop_duplicates(subset=["Chr", "BP"]).reset_index(drop=True) # one record per Chr + BP, as for the '.bb' file
+    result = found[["Chr", "BP"]].astype({"Chr": object})
+    if "name" in fields:
+        result["name"] = pd.array(np.where(found["rsid"] > 0, "rs" + found["rsid"].astype(str), ""), dtype="string")
+    allele_type = pd.CategoricalDtype(_ALLELES)
+    if "ref" in fields:
+        result["ref"] = pd.Categorical.from_codes(found["ref"].to_numpy(), dtype=allele_type)
+    if "alts" in fields:
+        result["alts"] = pd.Categorical.from_codes(found["alt"].to_numpy(), dtype=allele_type)
+    _print_query_log(not_found, log, print_log)
+    return result
     
 
 
@@ -575,12 +3154,6 @@ def delete():
     pass
 
 
-def create_tbi_index( df):
-    pass
-
-def query_db():
-    pass
-
 # ---------------------------------------------------------------------------------------------
 
 
@@ -0,0 +1,22 @@
+from dataintegrator import DataIntegrator as di
+import sys
+import time
+
+def main():
+    # read command line arguments (read in as JSON manifest) and run the steps on all studies listed in it
+    A = time.time()
+    batch = di.run_batch(sys.argv[1])
+    B = time.time()
+
+    for study in batch["studies"]:
+        if "error" in study:
+            print(study["input_path"], ": failed,", study["error"])
+        else:
+            print(study["input_path"], ":", study["rows"], "rows saved as", study["output_name"], "in", study["time"], "s")
+    print("Chr + BP queried in dbSnp153:", batch["queried_keys"])
+    print("Time used (total):", B-A)
+
+
+
+if __name__ == "__main__":
+    main()
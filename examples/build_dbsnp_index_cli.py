@@ -0,0 +1,22 @@
+from dataintegrator import DataIntegrator as di
+import sys
+import json
+import time
+
+def main():
+    # read command line arguments (read in as JSON file)
+    with open(sys.argv[1], "r") as read_file:
+        data = json.load(read_file)
+
+    # build the index, run the same command again to resume an interrupted build
+    A = time.time()
+    index = di.build_dbsnp_index(data["source"], data["index_dir"], chroms=data.get("chroms"), workers=data.get("workers"))
+    B = time.time()
+
+    print(len(index["shards"]), "chromosomes indexed in", data["index_dir"])
+    print("Time used (build_dbsnp_index):", B-A)
+
+
+
+if __name__ == "__main__":
+    main()
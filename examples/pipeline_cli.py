@@ -0,0 +1,16 @@
+from dataintegrator import DataIntegrator as di
+import sys
+
+def main():
+    # read command line arguments (read in as JSON file) and run all steps listed in it
+    pipeline = di.run_pipeline(sys.argv[1])
+
+    print(pipeline["result"])
+    print("Time used (total):", sum(stage["time"] for stage in pipeline["stages"]))
+    for stage in pipeline["stages"]:
+        print(stage["stage"], ": peak memory (MB)", stage["peak_memory_mb"])
+
+
+
+if __name__ == "__main__":
+    main()
@@ -28,7 +28,9 @@ setup(
         classifiers=classifiers,
         keywords='Data Integrator',
         packages=find_packages(include=['dataintegrator']),
-        install_requires=["pyBigWig","pyliftover","numpy", "pandas>=1.0.0"] # add any additional packages that 
+        python_requires=">=3.9", # the BGZF reader stops its threads with executor.shutdown(cancel_futures=True)
+        install_requires=["pyBigWig","pyliftover","numpy", "pandas>=1.1.3"], # add any additional packages that 
         # needs to be installed along with your package. Eg: 'caer'
+        extras_require={"arrow": ["pyarrow>=10"]} # parquet/ feather input and output, pip install dataintegrator[arrow]
 
 )
\ No newline at end of file
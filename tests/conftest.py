@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from dataintegrator import DataIntegrator as di
+
+
+@pytest.fixture(autouse=True)
+def silent():
+    di.set_silent()
+    yield
+    di.set_silent(False)
+
+
+# a random study in the formatted columns, on chromosomes 1, 2 and X, BP below max_bp (default rows / 2, so some
+# Chr + BP are duplicated)
+def make_study(rows, seed=0, max_bp=None):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "Chr": rng.choice(["1", "2", "X"], rows),
+        "BP": rng.integers(1, max_bp or max(rows // 2, 2), rows),
+        "SNP": ["rs" + str(i) for i in range(rows)],
+        "A1": rng.choice(list("ACGT"), rows),
+        "A2": rng.choice(list("ACGT"), rows),
+        "EAF": rng.random(rows),
+        "Beta": rng.normal(size=rows),
+        "Se": rng.random(rows),
+        "P": rng.random(rows),
+    })
+
+
+# a dbSnp153 '.bb' file as pyBigWig reads it: entries(chrom, start, end) lists the records overlapping [start, end) as
+# (start, end, rest of the line), None if there is none, and raises RuntimeError on unknown chromosomes or past their end
+class FakeBigBed:
+    def __init__(self, records, sizes):
+        self.records = records
+        self.sizes = sizes
+        self.starts = {chrom: np.array([record[0] for record in chrom_records], dtype="int64") for chrom, chrom_records in records.items()}
+
+    def chroms(self, chrom=None):
+        return dict(self.sizes) if chrom is None else self.sizes.get(chrom)
+
+    def entries(self, chrom, start, end):
+        if chrom not in self.records or end > self.sizes[chrom] or start < 0 or start >= end:
+            raise RuntimeError("Invalid interval bounds!")
+        # the records are at most 2 bases long
+        first, last = np.searchsorted(self.starts[chrom], [start - 2, end])
+        found = [record for record in self.records[chrom][first:last] if record[0] < end and record[1] > start]
+        return found or None
+
+    def close(self):
+        pass
+
+
+# random dbSnp153 records on chr1, chr2 and chrX: single base SNVs (some multi-allelic), 2 base deletions and insertions
+def make_dbsnp(records=3000, seed=0):
+    rng = np.random.default_rng(seed)
+    sizes = {"chr1": 200000, "chr2": 150000, "chrX": 100000}
+    chrom_records = {}
+    for chrom, size in sizes.items():
+        found = []
+        for start in np.sort(rng.choice(size - 5, records, replace=False)).tolist():
+            kind = rng.random()
+            ref = str(rng.choice(list("ACGT")))
+            alts = [str(allele) for allele in rng.choice([allele for allele in "ACGT" if allele != ref], int(rng.integers(1, 3)), replace=False)]
+            end = start + 1
+            if kind < 0.1:
+                ref, alts, end = ref + "T", [ref], start + 2
+            elif kind < 0.2:
+                alts = [alts[0] + "T"]
+            rest = "\t".join(["rs" + str(int(rng.integers(1, 10 ** 8))), ref, str(len(alts)), ",".join(alts) + ",", "0", "0,"])
+            found.append((start, end, rest))
+        chrom_records[chrom] = found
+    return FakeBigBed(chrom_records, sizes)
+
+
+# a study on chromosomes 1, 2, X and 3 (not in dbSnp153): most rows at a dbSnp153 record, some at other positions
+# (a few past the end of the chromosomes), with some rows repeated. At the records, the SNP is the rs ID of the record,
+# missing or another ID, and the alleles are those of the record on either strand (sometimes swapped) or other alleles
+def study_at_records(bb, rows, seed=0):
+    rng = np.random.default_rng(seed)
+    complement = {"A": "T", "C": "G", "G": "C", "T": "A"}
+    df = make_study(rows, seed)
+    chroms, bps, snps, a1s, a2s = [], [], list(df["SNP"]), list(df["A1"]), list(df["A2"])
+    for i in range(rows):
+        chrom = str(rng.choice(["1", "2", "X", "3"]))
+        records = bb.records.get("chr" + chrom)
+        kind = rng.random()
+        chroms.append(chrom)
+        if records is not None and kind < 0.7:
+            start, end, rest = records[int(rng.integers(len(records)))]
+            bps.append(end)
+            name, ref, _, alts = rest.split("\t")[:4]
+            kind = rng.random()
+            snps[i] = name if kind < 0.6 else None if kind < 0.8 else "rs1"
+            alleles = [ref[0], alts.split(",")[0][0]]
+            kind = rng.random()
+            if kind < 0.2:
+                alleles = alleles[::-1]
+            elif kind < 0.4:
+                alleles = [complement[allele] for allele in alleles]
+            elif kind < 0.5:
+                alleles = [complement[allele] for allele in alleles[::-1]]
+            if kind < 0.9:
+                a1s[i], a2s[i] = alleles
+        elif records is not None and kind < 0.75:
+            bps.append(bb.sizes["chr" + chrom] + int(rng.integers(1, 1000)))
+        else:
+            bps.append(int(rng.integers(1, 100000)))
+    df = df.assign(Chr=chroms, BP=bps, SNP=snps, A1=a1s, A2=a2s)
+    df = pd.concat([df, df.iloc[: rows // 20]], ignore_index=True)
+    return df.astype({"Chr": "string", "BP": "Int64", "SNP": "string", "A1": "string", "A2": "string"})
+
+
+@pytest.fixture
+def dbsnp(monkeypatch):
+    # pyBigWig.open gives the fake '.bb' file, also in the worker processes forked afterwards
+    bb = make_dbsnp()
+    monkeypatch.setattr(di.pyBigWig, "open", lambda link: FakeBigBed(bb.records, bb.sizes))
+    return bb
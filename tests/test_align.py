@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_study
+from dataintegrator import DataIntegrator as di
+
+
+# align_effect_allele as it was written: a merge to classify the keys, a merge per class, then a sort
+def old_align_effect_allele(reference, df, show_errors=False):
+    reference = reference[["Chr", "BP", "A1", "A2"]].rename({"A1": "reference_A1", "A2": "reference_A2"}, axis="columns")
+    process = df[["Chr", "BP", "A1", "A2"]].rename({"A1": "process_A1", "A2": "process_A2"}, axis="columns")
+    merge_table = pd.merge(process, reference, on=["Chr", "BP"], how="inner")
+    nochange_mask = (merge_table["process_A1"] == merge_table["reference_A1"]) & (merge_table["process_A2"] == merge_table["reference_A2"])
+    align_mask = (merge_table["process_A1"] == merge_table["reference_A2"]) & (merge_table["process_A2"] == merge_table["reference_A1"])
+    error_mask = ~nochange_mask & ~align_mask
+    nochange = pd.merge(df, merge_table[nochange_mask][["Chr", "BP"]], on=["Chr", "BP"], how="inner")
+    align = pd.merge(df, merge_table[align_mask][["Chr", "BP"]], on=["Chr", "BP"], how="inner")
+    aligned = align.rename({"A1": "A2", "A2": "A1"}, axis="columns").assign(Beta=-align["Beta"], EAF=1 - align["EAF"])
+    aligned = aligned[["Chr", "BP", "SNP", "A1", "A2", "EAF", "Beta", "Se", "P"]]
+    error = pd.merge(df, merge_table[error_mask][["Chr", "BP"]], on=["Chr", "BP"], how="inner")
+    if show_errors:
+        return pd.merge(error, merge_table[error_mask], on=["Chr", "BP"], how="inner")
+    return di.sort_by_chr_bp(pd.concat([nochange, aligned]).reset_index(drop=True))
+
+
+# a study with one row per Chr + BP and two different alleles (see test_rows_with_the_same_two_alleles_are_kept_once),
+# and a reference with most of its keys (with the same alleles, swapped alleles or other alleles) and keys of its own
+def study_and_reference(rows, seed):
+    rng = np.random.default_rng(seed)
+    df = make_study(rows, seed, max_bp=rows * 10).drop_duplicates(subset=["Chr", "BP"])
+    df = df[df["A1"] != df["A2"]].reset_index(drop=True)
+    reference = make_study(len(df), seed + 1).assign(Chr=df["Chr"], BP=df["BP"], A1=df["A1"], A2=df["A2"])
+    kind = rng.random(len(df))
+    swap = kind < 0.3
+    reference.loc[swap, ["A1", "A2"]] = df.loc[swap, ["A2", "A1"]].to_numpy()
+    other = (kind >= 0.3) & (kind < 0.4)
+    reference.loc[other, "A1"] = "N"
+    reference = pd.concat([reference[kind < 0.9], make_study(rows // 10, seed + 2).assign(BP=rows * 10 + 1)])
+    return df, reference.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_align_matches_the_old_merges(seed):
+    df, reference = study_and_reference(5000, seed)
+    expected = old_align_effect_allele(reference, df)
+    # the rows keep the order of the data, the old result was sorted by Chr and BP
+    result = di.align_effect_allele(reference, df)
+    pd.testing.assert_frame_equal(di.sort_by_chr_bp(result), expected)
+    pd.testing.assert_frame_equal(di.align_effect_allele(reference, df, show_errors=True), old_align_effect_allele(reference, df, show_errors=True))
+
+
+def test_rows_with_the_same_two_alleles_are_kept_once():
+    df = make_study(4).assign(Chr="1", BP=[10, 20, 30, 40], A1=["A", "A", "C", "G"], A2=["A", "C", "C", "T"])
+    reference = df.assign(A1=["A", "C", "C", "T"], A2=["A", "A", "C", "G"])
+    # A1 == A2 matches the reference both ways: the old merges returned such a row twice, once unchanged and once
+    # swapped, it is now kept once, unchanged
+    old = old_align_effect_allele(reference, df)
+    assert old["BP"].tolist() == [10, 10, 20, 30, 30, 40]
+    result = di.align_effect_allele(reference, df)
+    assert result["BP"].tolist() == [10, 20, 30, 40]
+    pd.testing.assert_frame_equal(result.iloc[[0, 2]], df.iloc[[0, 2]])
+    pd.testing.assert_frame_equal(result, old.drop_duplicates(subset=["Chr", "BP"], keep="first").reset_index(drop=True))
+
+
+def test_first_reference_row_of_a_key_is_used():
+    df = make_study(2).assign(Chr="1", BP=[10, 20], A1=["A", "G"], A2=["C", "T"])
+    reference = pd.concat([df.assign(A1=["C", "G"], A2=["A", "T"]), df]).reset_index(drop=True)
+    # the old merges returned the rows once per reference row of their key
+    assert len(old_align_effect_allele(reference, df)) == 4
+    result = di.align_effect_allele(reference, df)
+    assert result[["A1", "A2"]].values.tolist() == [["C", "A"], ["G", "T"]]
+
+
+def chunks_of(df, rows):
+    # with an empty chunk in between
+    for start in range(0, len(df), rows):
+        yield df.iloc[start:start + rows]
+        if start == rows:
+            yield df.iloc[:0]
+
+
+@pytest.mark.parametrize("rows, reference_rows", [(7, 3), (50, 1000), (1000, 11), (10000, 10000)])
+@pytest.mark.parametrize("show_errors", [False, True])
+def test_chunked_align_matches_the_in_memory_align(rows, reference_rows, show_errors):
+    df, reference = study_and_reference(3000, 2)
+    # repeated keys in the data and in the reference, and rows with A1 == A2
+    df = di.sort_by_chr_bp(pd.concat([df, df.iloc[::7].assign(A2=df["A1"])]))
+    reference = di.sort_by_chr_bp(pd.concat([reference, reference.iloc[::5].assign(A1="T")]))
+    expected = di.align_effect_allele(reference, df, show_errors=show_errors)
+    pieces = list(di.align_effect_allele_in_chunks(chunks_of(reference, reference_rows), chunks_of(df, rows), show_errors=show_errors))
+    pd.testing.assert_frame_equal(pd.concat(pieces, ignore_index=True), expected)
+    assert len(expected) > 0
@@ -0,0 +1,76 @@
+import pandas as pd
+import pytest
+
+from conftest import study_at_records
+from dataintegrator import DataIntegrator as di
+
+COLUMNS = {"Chr": "chromosome", "BP": "base_pair_location", "SNP": "variant_id", "A1": "effect_allele", "A2": "other_allele",
+           "EAF": "effect_allele_frequency", "Beta": "beta", "Se": "standard_error", "P": "p_value"}
+STEPS = [
+    ["filter_bi_allelic", "deduplicate", "sort_by_chr_bp", "add_rsid", "flip_strand"],
+    ["add_rsid", "lift_over", "sort_by_chr_bp", "flip_strand"],
+]
+
+
+# a chain file mapping each dbSnp153 chromosome onto itself, so that the lifted positions are still in dbSnp153
+def write_identity_chain_file(path, sizes):
+    lines = []
+    for chain_id, (chrom, size) in enumerate(sizes.items(), 1):
+        lines += ["chain 1000 %s %d + 0 %d %s %d + 0 %d %d" % (chrom, size, size, chrom, size, size, chain_id), str(size), ""]
+    path.write_text("\n".join(lines) + "\n")
+
+
+@pytest.fixture
+def batch(tmp_path, dbsnp):
+    # three studies with their own column names, on the dbSnp153 records
+    studies = []
+    for i in range(3):
+        path = tmp_path / ("study%d.tsv.gz" % i)
+        study_at_records(dbsnp, 1000, seed=i).rename(columns=COLUMNS).to_csv(path, sep="\t", index=False)
+        studies.append(dict({key + "_col_name": name for key, name in COLUMNS.items()}, input_path=str(path), output_name="study%d" % i))
+    write_identity_chain_file(tmp_path / "identity.over.chain", dbsnp.sizes)
+    (tmp_path / "batch").mkdir()
+    (tmp_path / "single").mkdir()
+    shared = {"dbSnp153_path": "dbSnp153.bb", "input_format": "hg19", "output_format": "hg38",
+              "chain_file": str(tmp_path / "identity.over.chain")}
+    return tmp_path, shared, studies
+
+
+def saved(path):
+    return pd.read_csv(path, dtype={"Chr": str})
+
+
+@pytest.mark.parametrize("steps", STEPS)
+@pytest.mark.parametrize("workers", [1, 2])
+def test_batch_matches_the_pipeline_of_each_study(batch, steps, workers):
+    tmp_path, shared, studies = batch
+    manifest = dict(shared, steps=steps, output_path=str(tmp_path / "batch"), studies=studies, workers=workers)
+    report = di.run_batch(manifest)
+    # dbSnp153 is queried once before the first step using it, and once after lift_over
+    assert len(report["queried_keys"]) == (2 if "lift_over" in steps else 1)
+    for study, study_report in zip(studies, report["studies"]):
+        config = dict(shared, steps=steps, output_path=str(tmp_path / "single"), **study)
+        result = di.run_pipeline(config)["result"]
+        assert "error" not in study_report
+        assert study_report["rows"] == len(result) > 0
+        name = study["output_name"] + ".gz"
+        pd.testing.assert_frame_equal(saved(tmp_path / "batch" / name), saved(tmp_path / "single" / name))
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_failing_study_does_not_stop_the_others(batch, workers):
+    tmp_path, shared, studies = batch
+    # a study with a missing file, and one without the column names of the manifest
+    (tmp_path / "other_columns.tsv.gz").write_bytes((tmp_path / "study0.tsv.gz").read_bytes())
+    broken = [dict(studies[0], input_path=str(tmp_path / "missing.tsv.gz"), output_name="missing"),
+              dict(studies[0], input_path=str(tmp_path / "other_columns.tsv.gz"), output_name="other_columns", P_col_name="pval")]
+    manifest = dict(shared, steps=STEPS[1], output_path=str(tmp_path / "batch"), studies=[broken[0], studies[0], broken[1], studies[1]], workers=workers)
+    report = di.run_batch(manifest)["studies"]
+    assert ["error" in study_report for study_report in report] == [True, False, True, False]
+    assert not (tmp_path / "batch" / "missing.gz").exists()
+    assert not (tmp_path / "batch" / "other_columns.gz").exists()
+    for study in studies[:2]:
+        config = dict(shared, steps=STEPS[1], output_path=str(tmp_path / "single"), **study)
+        di.run_pipeline(config)
+        name = study["output_name"] + ".gz"
+        pd.testing.assert_frame_equal(saved(tmp_path / "batch" / name), saved(tmp_path / "single" / name))
@@ -0,0 +1,157 @@
+import http.server
+import importlib.util
+import os
+import random
+import threading
+import urllib.request
+
+import pyBigWig
+import pytest
+
+from dataintegrator import DataIntegrator as di
+
+# a small real bigBed file shipped with pyBigWig
+_SPEC = importlib.util.find_spec("pyBigWigTest")
+BIGBED = None if _SPEC is None else os.path.join(os.path.dirname(_SPEC.origin), "test.bigBed")
+
+pytestmark = pytest.mark.skipif(BIGBED is None or not os.path.exists(BIGBED), reason="pyBigWig test bigBed not found")
+
+
+@pytest.fixture
+def remote_bigbed():
+    # serves the bigBed with range requests, as a remote host would, and records the ranges asked for
+    data = open(BIGBED, "rb").read()
+    requests = []
+
+    class RangeHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("ETag", '"test"')
+            self.end_headers()
+
+        def do_GET(self):
+            first, last = self.headers["Range"][len("bytes="):].split("-")
+            start, end = int(first), int(last) + 1
+            requests.append((start, end))
+            self.send_response(206)
+            self.send_header("Content-Length", str(end - start))
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end - 1, len(data)))
+            self.end_headers()
+            self.wfile.write(data[start:end])
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield "http://127.0.0.1:%d/test.bigBed" % server.server_address[1], data, requests
+    server.shutdown()
+    server.server_close()
+
+
+def read_range(link, start, end):
+    request = urllib.request.Request(link, headers={"Range": "bytes=%d-%d" % (start, end - 1)})
+    with urllib.request.urlopen(request) as response:
+        assert response.status == 206
+        return response.read()
+
+
+def all_entries(bb):
+    return {chrom: bb.entries(chrom, 0, size) for chrom, size in bb.chroms().items()}
+
+
+def test_ranges_read_through_the_cache_match_the_file_and_blocks_are_reused(tmp_path, remote_bigbed):
+    link, data, requests = remote_bigbed
+    ranges = [(0, 64)] + [(start, min(len(data), start + random.Random(start).randrange(1, 5000))) for start in range(0, len(data), 1500)]
+    local_link = di.open_block_cache(link, str(tmp_path), block_size_mb=4096 / 2 ** 20, prefetch=0)
+    try:
+        for start, end in ranges:
+            assert read_range(local_link, start, end) == data[start:end]
+    finally:
+        stats = di.close_block_cache(link)
+    blocks = (len(data) - 1) // 4096 + 1
+    assert stats["block_fetches"] == len(requests) == blocks
+    # the blocks on disk are used by the next run, nothing is fetched again
+    requests.clear()
+    local_link = di.open_block_cache(link, str(tmp_path), block_size_mb=4096 / 2 ** 20, prefetch=0)
+    try:
+        for start, end in ranges:
+            assert read_range(local_link, start, end) == data[start:end]
+    finally:
+        stats = di.close_block_cache(link)
+    assert requests == []
+    assert stats["block_fetches"] == 0
+    assert stats["block_hits"] > 0
+
+
+@pytest.mark.skipif(not pyBigWig.remote, reason="pyBigWig was built without remote file support")
+def test_bigbed_read_through_the_cache_matches_a_local_read(tmp_path, remote_bigbed):
+    link, data, requests = remote_bigbed
+    bb = pyBigWig.open(BIGBED)
+    expected = all_entries(bb)
+    bb.close()
+    for run in range(2):
+        di.open_block_cache(link, str(tmp_path), block_size_mb=4096 / 2 ** 20, prefetch=0)
+        try:
+            bb = di._open_bigbed(link)
+            assert all_entries(bb) == expected
+            bb.close()
+        finally:
+            stats = di.close_block_cache(link)
+        if run == 0:
+            assert stats["block_fetches"] > 0
+            requests.clear()
+    assert requests == []
+    assert stats["block_fetches"] == 0
+
+
+def forward_reads(local_link, data, step=300, length=200):
+    for start in range(0, len(data), step):
+        end = min(len(data), start + length)
+        assert read_range(local_link, start, end) == data[start:end]
+
+
+def cached_size(tmp_path):
+    return sum(path.stat().st_size for path in tmp_path.rglob("*.blk"))
+
+
+def test_least_recently_used_blocks_are_evicted(tmp_path, remote_bigbed):
+    link, data, requests = remote_bigbed
+    block_size = 1024
+    local_link = di.open_block_cache(link, str(tmp_path), max_size_mb=4 * block_size / 2 ** 20, block_size_mb=block_size / 2 ** 20, prefetch=0)
+    try:
+        forward_reads(local_link, data)
+        blocks = (len(data) - 1) // block_size + 1
+        assert len(requests) == blocks
+        assert cached_size(tmp_path) <= 4 * block_size
+        # the last blocks are still cached, the first ones were evicted and are fetched again
+        requests.clear()
+        assert read_range(local_link, len(data) - 100, len(data)) == data[-100:]
+        assert requests == []
+        assert read_range(local_link, 0, 100) == data[:100]
+        assert requests == [(0, block_size)]
+        assert cached_size(tmp_path) <= 4 * block_size
+    finally:
+        stats = di.close_block_cache(link)
+    assert stats["block_fetches"] == blocks + 1
+    assert stats["block_hits"] > 0
+
+
+@pytest.mark.parametrize("max_blocks", [100, 3])
+def test_blocks_fetched_ahead_are_fetched_once(tmp_path, remote_bigbed, max_blocks):
+    link, data, requests = remote_bigbed
+    block_size = 1024
+    local_link = di.open_block_cache(link, str(tmp_path), max_size_mb=max_blocks * block_size / 2 ** 20, block_size_mb=block_size / 2 ** 20, prefetch=4)
+    try:
+        forward_reads(local_link, data)
+    finally:
+        stats = di.close_block_cache(link)
+    blocks = (len(data) - 1) // block_size + 1
+    # with a small cache, fewer blocks are fetched ahead, but none is removed before it is read
+    assert sorted(requests) == [(i * block_size, min(len(data), (i + 1) * block_size)) for i in range(blocks)]
+    assert stats["block_fetches"] + stats["block_prefetches"] == blocks
+    assert stats["block_prefetches"] > 0
+    assert cached_size(tmp_path) <= max_blocks * block_size
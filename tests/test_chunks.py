@@ -0,0 +1,46 @@
+import pandas as pd
+import pytest
+
+from conftest import make_study
+from dataintegrator import DataIntegrator as di
+
+
+def chunks_of(df, rows):
+    return (df.iloc[start:start + rows] for start in range(0, len(df), rows))
+
+
+@pytest.mark.parametrize("fan_in", [4, 64])
+def test_sort_in_chunks_merges_many_runs_in_passes(monkeypatch, fan_in):
+    # 15 row chunks give hundreds of runs, more than the fan-in, so they are merged in several passes
+    monkeypatch.setattr(di, "_MERGE_FAN_IN", fan_in)
+    df = make_study(6000)
+    result = pd.concat(di.sort_in_chunks(chunks_of(df, 15), chunksize=15), ignore_index=True)
+    expected = di.sort_by_chr_bp(df).reset_index(drop=True)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_deduplicate_in_chunks_merges_many_runs_in_passes(monkeypatch):
+    monkeypatch.setattr(di, "_MERGE_FAN_IN", 4)
+    df = make_study(6000)
+    result = pd.concat(di.deduplicate_in_chunks(chunks_of(df, 15), chunksize=15), ignore_index=True)
+    expected = di.sort_by_chr_bp(di.deduplicate(df)).reset_index(drop=True)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_merge_keeps_few_runs_open(monkeypatch):
+    monkeypatch.setattr(di, "_MERGE_FAN_IN", 4)
+    opened = []
+    read_run = di._read_run
+    def counting_read_run(path, block_rows):
+        opened.append(path)
+        return read_run(path, block_rows)
+    monkeypatch.setattr(di, "_read_run", counting_read_run)
+    merges = []
+    merge_runs = di._merge_runs
+    def counting_merge_runs(runs, block_rows):
+        merges.append(len(runs))
+        return merge_runs(runs, block_rows)
+    monkeypatch.setattr(di, "_merge_runs", counting_merge_runs)
+    list(di.sort_in_chunks(chunks_of(make_study(3000), 15), chunksize=15))
+    assert len(opened) > 4
+    assert max(merges) <= 4
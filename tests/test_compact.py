@@ -0,0 +1,64 @@
+import gzip
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_study
+from dataintegrator import DataIntegrator as di
+
+
+# a study with the given SNP IDs, one per row of chromosome 1. EAF, Beta and Se are exact in float32 (compact schema)
+def study_with_snps(snps):
+    return make_study(len(snps)).assign(Chr="1", BP=np.arange(1, len(snps) + 1) * 100, SNP=pd.array(snps, dtype="string"),
+                                        EAF=0.25, Beta=0.5, Se=0.125)
+
+
+def dbsnp_names(df, names):
+    return pd.DataFrame({"Chr": df["Chr"].astype(str), "BP": df["BP"].astype("int64"), "name": names})
+
+
+def test_rs_ids_are_stored_as_numbers():
+    df = study_with_snps(["rs1", "rs22", None])
+    compact = di.to_compact(df)
+    assert pd.api.types.is_integer_dtype(compact["SNP"])
+    assert di.from_compact(compact)["SNP"].tolist() == df["SNP"].tolist()
+
+
+@pytest.mark.parametrize("snps", [["rs1", ".", "rs3"], ["rs1", "1:300:A:G", None], ["rs1", "rs0123", "rs3"]])
+def test_ids_that_are_not_rs_ids_are_kept(snps):
+    df = study_with_snps(snps)
+    compact = di.to_compact(df)
+    assert di.from_compact(compact)["SNP"].tolist() == df["SNP"].tolist()
+
+
+def test_add_rsid_gives_the_same_result_in_both_schemas(tmp_path):
+    df = study_with_snps(["rs1", ".", None, "rs9"])
+    data = dbsnp_names(df, ["rs1", "rs2", "rs3", "rs4"])
+    default = di.add_rsid(df, data, filter_rows="all", select_cols="all")
+    compact = di.add_rsid(di.to_compact(df), data, filter_rows="all", select_cols="all")
+    assert compact["comment"].tolist() == default["comment"].tolist() == ["S", "D", "A", "D"]
+    di.save_data(str(tmp_path), di.add_rsid(df, data), "default")
+    di.save_data(str(tmp_path), di.add_rsid(di.to_compact(df), data), "compact")
+    with gzip.open(tmp_path / "default.gz", "rt") as f:
+        default_text = f.read()
+    with gzip.open(tmp_path / "compact.gz", "rt") as f:
+        compact_text = f.read()
+    assert compact_text == default_text
+    assert "rs4" in compact_text
+
+
+def test_added_rsid_is_restored_from_compact():
+    df = di.to_compact(study_with_snps(["rs1", "rs2"]))
+    added = di.add_rsid(df, dbsnp_names(df, ["rs1", "rs5"]))
+    assert pd.api.types.is_integer_dtype(added["added_rsid"])
+    assert di.from_compact(added)["added_rsid"].tolist() == ["rs1", "rs5"]
+
+
+def test_chunks_with_and_without_rs_numbers_are_saved_as_rs_ids(tmp_path):
+    # the merge of the sorted runs concatenates the chunks, SNP then mixes numbers and IDs
+    second = study_with_snps(["rs3", "."]).assign(BP=[1000, 2000])
+    chunks = [di.to_compact(study_with_snps(["rs1", "rs2"])), di.to_compact(second)]
+    di.process_in_chunks(iter(chunks), str(tmp_path), "mixed", dedup=False, sort=True)
+    saved = pd.read_csv(tmp_path / "mixed.gz")
+    assert saved["SNP"].tolist() == ["rs1", "rs2", "rs3", "."]
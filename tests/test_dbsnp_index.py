@@ -0,0 +1,109 @@
+import gzip
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import study_at_records
+from dataintegrator import DataIntegrator as di
+
+LINK = "dbSnp153.bb"
+
+
+def sorted_records(records):
+    return records.sort_values(["Chr", "BP"]).reset_index(drop=True)
+
+
+@pytest.fixture
+def index_dir(tmp_path, dbsnp):
+    di.build_dbsnp_index(LINK, str(tmp_path / "index"))
+    return str(tmp_path / "index")
+
+
+def test_index_lookup_matches_the_bigbed_query(dbsnp, index_dir):
+    df = study_at_records(dbsnp, 3000)
+    expected = sorted_records(di.query_data(df, LINK))
+    result = sorted_records(di.query_data(df, index_dir))
+    pd.testing.assert_frame_equal(result[["Chr", "BP", "name"]], expected[["Chr", "BP", "name"]])
+    assert result["ref"].astype(str).tolist() == expected["ref"].astype(str).tolist()
+    # multi-allelic or multi-base alleles are stored as empty alleles
+    alts = expected["alts"].astype(str)
+    assert result["alts"].astype(str).tolist() == alts.where(alts.str.len() == 1, "").tolist()
+    lookup = di.lookup_dbsnp_index(df, index_dir)
+    assert len(lookup) == sum(key in set(zip(expected["Chr"], expected["BP"])) for key in zip(df["Chr"], df["BP"]))
+    names = dict(zip(zip(expected["Chr"], expected["BP"]), expected["name"]))
+    assert ["rs" + str(rsid) for rsid in lookup["rsid"]] == [names[key] for key in zip(lookup["Chr"], lookup["BP"])]
+
+
+@pytest.mark.parametrize("step", ["add_rsid", "flip_strand"])
+def test_steps_give_the_same_result_with_the_index(dbsnp, index_dir, step):
+    df = study_at_records(dbsnp, 3000, seed=2)
+    records = di.query_data(df, LINK)
+    step = getattr(di, step)
+    expected = step(df, records, select_cols="all", filter_rows="all")
+    result = step(df, di.query_data(df, index_dir), select_cols="all", filter_rows="all")
+    pd.testing.assert_frame_equal(result, expected)
+    assert expected["comment"].nunique() >= 3
+
+
+def index_arrays(index):
+    return {chrom: {field: np.asarray(values) for field, values in shard.items()} for chrom, shard in index["shards"].items()}
+
+
+def assert_same_index(result, expected):
+    assert list(result) == list(expected)
+    for chrom, shard in expected.items():
+        for field, values in shard.items():
+            np.testing.assert_array_equal(result[chrom][field], values)
+
+
+def test_index_is_the_same_with_workers_and_windows(tmp_path, dbsnp):
+    expected = index_arrays(di.build_dbsnp_index(LINK, str(tmp_path / "serial")))
+    assert sum(len(shard["pos"]) for shard in expected.values()) > 0
+    # records overlapping a window border are kept once
+    assert_same_index(index_arrays(di.build_dbsnp_index(LINK, str(tmp_path / "windows"), window=997)), expected)
+    assert_same_index(index_arrays(di.build_dbsnp_index(LINK, str(tmp_path / "workers"), workers=2)), expected)
+
+
+def test_interrupted_build_is_resumed(tmp_path, dbsnp, monkeypatch):
+    expected = index_arrays(di.build_dbsnp_index(LINK, str(tmp_path / "full")))
+    build_task = di._build_index_task
+    tasks = []
+    interrupt = [True]
+
+    def interrupted_task(source, task, part_dir, chroms, window):
+        tasks.append(task)
+        if len(tasks) == 2 and interrupt:
+            interrupt.clear()
+            raise RuntimeError("interrupted")
+        return build_task(source, task, part_dir, chroms, window)
+
+    monkeypatch.setattr(di, "_build_index_task", interrupted_task)
+    index_dir = str(tmp_path / "index")
+    with pytest.raises(RuntimeError, match="interrupted"):
+        di.build_dbsnp_index(LINK, index_dir)
+    assert len(tasks) == 2
+    tasks.clear()
+    assert_same_index(index_arrays(di.build_dbsnp_index(LINK, index_dir)), expected)
+    # the task finished before the interruption is not run again
+    assert len(tasks) == len(dbsnp.sizes) - 1
+    tasks.clear()
+    assert_same_index(index_arrays(di.build_dbsnp_index(LINK, index_dir)), expected)
+    assert tasks == []
+
+
+def test_bed_dumps_give_the_index_of_the_bigbed(tmp_path, dbsnp):
+    expected = index_arrays(di.build_dbsnp_index(LINK, str(tmp_path / "bigbed")))
+    # chr2 is split across the two files
+    lines = [[], []]
+    for chrom, records in dbsnp.records.items():
+        for i, (start, end, rest) in enumerate(records):
+            file = 0 if chrom == "chr1" or (chrom == "chr2" and i < len(records) // 2) else 1
+            lines[file].append("\t".join([chrom, str(start), str(end), rest]))
+    paths = []
+    for i, file_lines in enumerate(lines):
+        paths.append(str(tmp_path / ("dbSnp153.%d.bed.gz" % i)))
+        with gzip.open(paths[-1], "wt") as f:
+            f.write("\n".join(file_lines) + "\n")
+    result = index_arrays(di.build_dbsnp_index(paths, str(tmp_path / "bed")))
+    assert_same_index({chrom: result[chrom] for chrom in expected}, expected)
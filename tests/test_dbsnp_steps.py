@@ -0,0 +1,124 @@
+import pandas as pd
+import pytest
+
+from conftest import study_at_records
+from dataintegrator import DataIntegrator as di
+
+LINK = "dbSnp153.bb"
+SELECT_COLS = ["all", "inplace", "drop_comments"]
+FILTER_ROWS = ["all", "errors", "drop"]
+
+
+# the dbSnp153 records as the row by row query_data returned them: the rest of the line of the single base records,
+# by (Chr, BP)
+def rowwise_records(bb):
+    return {(chrom[len("chr"):], end): rest for chrom, records in bb.records.items() for start, end, rest in records if end - start == 1}
+
+
+def select(result, select_cols, filter_rows, errors, na_cols, inplace_cols, drop_comments_cols):
+    if filter_rows == "errors":
+        result = result[errors]
+    elif filter_rows == "drop":
+        result = result.dropna(subset=na_cols).reset_index(drop=True)
+    if select_cols == "inplace":
+        result = result[inplace_cols[0]].rename(inplace_cols[1], axis="columns")
+    elif select_cols == "drop_comments":
+        result = result[drop_comments_cols]
+    return result
+
+
+# add_rsid as it was written, one row at a time
+def rowwise_add_rsid(df, data, select_cols, filter_rows):
+    added_rsid = []
+    comment = []
+    for row in df.itertuples():
+        key = (row.Chr, row.BP)
+        if key in data:
+            data_rs_id = data[key].split("\t")[0]
+            if pd.isna(row.SNP):
+                added_rsid.append(data_rs_id)
+                comment.append("A")
+            elif row.SNP == data_rs_id:
+                added_rsid.append(row.SNP)
+                comment.append("S")
+            else:
+                added_rsid.append(data_rs_id)
+                comment.append("D")
+        else:
+            added_rsid.append(pd.NA)
+            comment.append("NF")
+    result = df.assign(added_rsid=added_rsid, comment=comment)
+    return select(result, select_cols, filter_rows, pd.isna(result["added_rsid"]), ["added_rsid"],
+                  (["Chr", "BP", "added_rsid", "A1", "A2", "EAF", "Beta", "Se", "P"], {"added_rsid": "SNP"}),
+                  ["Chr", "BP", "SNP", "A1", "A2", "EAF", "Beta", "Se", "P", "added_rsid"])
+
+
+# flip_strand as it was written, one row at a time
+def rowwise_flip_strand(df, data, select_cols, filter_rows):
+    complement = {"A": "T", "T": "A", "C": "G", "G": "C"}
+    flipped_A1 = []
+    flipped_A2 = []
+    comment = []
+    for row in df.itertuples():
+        key = (row.Chr, row.BP)
+        if key in data:
+            cur_set = {row.A1, row.A2}
+            parsed_string = data[key].split("\t")
+            data_a1 = [i for i in parsed_string[1] if i != ","]
+            data_a2 = [i for i in parsed_string[3] if i != ","]
+            if len(data_a1) == 1 and len(data_a2) == 1:
+                cur_set.update([data_a1[0], data_a2[0]])
+                if len(cur_set) == 4:
+                    flipped_A1.append(complement.get(row.A1, ""))
+                    flipped_A2.append(complement.get(row.A2, ""))
+                    comment.append("F")
+                elif len(cur_set) == 2:
+                    flipped_A1.append(row.A1)
+                    flipped_A2.append(row.A2)
+                    comment.append("S")
+                else:
+                    flipped_A1.append(data_a1[0])
+                    flipped_A2.append(data_a2[0])
+                    comment.append("D")
+            else:
+                flipped_A1.append(pd.NA)
+                flipped_A2.append(pd.NA)
+                comment.append("ID")
+        else:
+            flipped_A1.append(pd.NA)
+            flipped_A2.append(pd.NA)
+            comment.append("NF")
+    result = df.assign(new_A1=flipped_A1, new_A2=flipped_A2, comment=comment)
+    return select(result, select_cols, filter_rows, (result["comment"] != "flipped") & (result["comment"] != "same"), ["new_A1", "new_A2"],
+                  (["Chr", "BP", "new_A1", "new_A2", "EAF", "Beta", "Se", "P"], {"new_A1": "A1", "new_A2": "A2"}),
+                  ["Chr", "BP", "A1", "A2", "EAF", "Beta", "Se", "P", "new_A1", "new_A2"])
+
+
+@pytest.fixture
+def study(dbsnp):
+    return study_at_records(dbsnp, 3000, seed=3)
+
+
+@pytest.mark.parametrize("select_cols", SELECT_COLS)
+@pytest.mark.parametrize("filter_rows", FILTER_ROWS)
+def test_add_rsid_matches_the_row_by_row_steps(dbsnp, study, select_cols, filter_rows):
+    records = rowwise_records(dbsnp)
+    expected = rowwise_add_rsid(study, records, select_cols, filter_rows)
+    if select_cols == "all" and filter_rows == "all":
+        assert set(expected["comment"]) == {"A", "S", "D", "NF"}
+    # the records of query_data, or in the old dictionary
+    for data in [di.query_data(study, LINK), records]:
+        result = di.add_rsid(study, data, select_cols=select_cols, filter_rows=filter_rows)
+        pd.testing.assert_frame_equal(result, expected)
+
+
+@pytest.mark.parametrize("select_cols", SELECT_COLS)
+@pytest.mark.parametrize("filter_rows", FILTER_ROWS)
+def test_flip_strand_matches_the_row_by_row_steps(dbsnp, study, select_cols, filter_rows):
+    records = rowwise_records(dbsnp)
+    expected = rowwise_flip_strand(study, records, select_cols, filter_rows)
+    if select_cols == "all" and filter_rows == "all":
+        assert set(expected["comment"]) == {"F", "S", "D", "ID", "NF"}
+    for data in [di.query_data(study, LINK), records]:
+        result = di.flip_strand(study, data, select_cols=select_cols, filter_rows=filter_rows)
+        pd.testing.assert_frame_equal(result, expected)
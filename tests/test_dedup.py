@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_study
+from dataintegrator import DataIntegrator as di
+
+CHROMS = [str(chrom) for chrom in range(1, 23)] + ["X", "Y", "MT", "GL000192.1", "chr5_random"]
+
+
+# deduplicate as it was written
+def old_deduplicate(df):
+    return df.drop_duplicates(subset=["Chr", "BP"], keep=False)
+
+
+# a study with many repeated Chr + BP, on all the chromosomes and some contigs, with some missing Chr and BP
+def study_with_duplicates(rows, seed):
+    rng = np.random.default_rng(seed)
+    df = make_study(rows, seed).assign(Chr=rng.choice(CHROMS, rows), BP=rng.integers(1, rows, rows))
+    df = df.astype({"Chr": "string", "BP": "Int64"})
+    df.loc[rng.random(rows) < 0.01, "Chr"] = pd.NA
+    df.loc[rng.random(rows) < 0.01, "BP"] = pd.NA
+    return df
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_deduplicate_matches_the_old_deduplicate(seed):
+    df = study_with_duplicates(20000, seed)
+    expected = old_deduplicate(df)
+    assert 0 < len(expected) < len(df)
+    pd.testing.assert_frame_equal(di.deduplicate(df), expected)
+    # sorted data is compared with the next key instead of hashed
+    df = di.sort_by_chr_bp(df)
+    pd.testing.assert_frame_equal(di.deduplicate(df), old_deduplicate(df))
+
+
+@pytest.mark.parametrize("sorted_input", [False, True])
+def test_deduplicate_in_chunks_matches_the_old_deduplicate(sorted_input):
+    df = study_with_duplicates(6000, 3)
+    if sorted_input:
+        df = di.sort_by_chr_bp(df)
+    # chunks of 25 rows split the rows of many keys over two chunks
+    chunks = (df.iloc[start:start + 25] for start in range(0, len(df), 25))
+    result = pd.concat(di.deduplicate_in_chunks(chunks, sorted_input=sorted_input, chunksize=25), ignore_index=True)
+    expected = di.sort_by_chr_bp(old_deduplicate(df))
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_chromosome_names_do_not_share_keys():
+    df = pd.DataFrame({"Chr": ["1", "01", "X", "23", "1"], "BP": [5, 5, 5, 5, 6]})
+    pd.testing.assert_frame_equal(di.deduplicate(df), old_deduplicate(df))
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from dataintegrator import DataIntegrator as di
+
+SOURCE_SIZES = {"chr1": 30000, "chr2": 7000}
+TARGET_SIZES = {"chr1": 40000, "chr3": 25000, "chr5": 9000}
+
+
+def write_chain_file(path, chains, seed):
+    # random chains on both strands, overlapping each other on the source, most with the same score
+    rng = np.random.default_rng(seed)
+    lines = []
+    for chain_id in range(1, chains + 1):
+        source = rng.choice(list(SOURCE_SIZES))
+        target = rng.choice(list(TARGET_SIZES))
+        blocks = []
+        sfrom = int(rng.integers(0, SOURCE_SIZES[source] // 2))
+        tfrom = int(rng.integers(0, TARGET_SIZES[target] // 2))
+        sstart, tstart = sfrom, tfrom
+        for _ in range(int(rng.integers(1, 6))):
+            size = int(rng.integers(1, 800))
+            sgap, tgap = int(rng.integers(0, 300)), int(rng.integers(0, 300))
+            if sfrom + size + sgap >= SOURCE_SIZES[source] or tfrom + size + tgap >= TARGET_SIZES[target]:
+                break
+            blocks.append((size, sgap, tgap))
+            sfrom += size + sgap
+            tfrom += size + tgap
+        if not blocks:
+            continue
+        size = blocks.pop()[0]
+        send = sstart + sum(block[0] + block[1] for block in blocks) + size
+        tend = tstart + sum(block[0] + block[2] for block in blocks) + size
+        score = int(rng.choice([1000, 1000, 1000, 5000]))
+        strand = rng.choice(["+", "-"])
+        lines.append("chain %d %s %d + %d %d %s %d %s %d %d %d" % (
+            score, source, SOURCE_SIZES[source], sstart, send, target, TARGET_SIZES[target], strand, tstart, tend, chain_id))
+        lines.extend("%d %d %d" % block for block in blocks)
+        lines.append("%d" % size)
+        lines.append("")
+    path.write_text("\n".join(lines) + "\n")
+
+
+def lifted_positions(lo_dict, df):
+    table = di._lift_over_basic(df, lo_dict)
+    return table.set_index(["Chr", "BP"]).sort_index()
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_array_engine_maps_as_pyliftover(tmp_path, seed):
+    pytest.importorskip("pyliftover")
+    path = tmp_path / "test.over.chain"
+    write_chain_file(path, 60, seed)
+    df = pd.DataFrame({
+        "Chr": pd.array(["1"] * SOURCE_SIZES["chr1"] + ["2"] * SOURCE_SIZES["chr2"] + ["4"] * 10, dtype="string"),
+        "BP": pd.array(list(range(SOURCE_SIZES["chr1"])) + list(range(SOURCE_SIZES["chr2"])) + list(range(10)), dtype="Int64"),
+    })
+    expected = lifted_positions(di.create_lo("hg19", "hg38", chain_file=str(path), engine="pyliftover"), df)
+    result = lifted_positions(di.create_lo("hg19", "hg38", chain_file=str(path)), df)
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(result, expected)
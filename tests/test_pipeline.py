@@ -0,0 +1,17 @@
+import os
+
+import numpy as np
+import pytest
+
+from dataintegrator import DataIntegrator as di
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/clear_refs"), reason="the peak memory can only be reset on linux")
+def test_stage_peak_memory_is_the_peak_of_the_stage():
+    report = []
+    run_stage = di._stage_runner(report)
+    # about 400 MB, then about 8 MB
+    run_stage("large", lambda: np.ones(50000000).sum())
+    run_stage("small", lambda: np.ones(1000000).sum())
+    assert [stage["stage"] for stage in report] == ["large", "small"]
+    assert report[0]["peak_memory_mb"] > report[1]["peak_memory_mb"] + 300
@@ -0,0 +1,43 @@
+import os
+import pickle
+
+from dataintegrator import DataIntegrator as di
+
+
+def segment_names(source_dir):
+    return [name for name in os.listdir(source_dir) if name.endswith(".pkl")]
+
+
+def test_cache_key_has_the_layout_version(tmp_path, monkeypatch):
+    link = "http://example.org/dbSnp153.bb"
+    source_dir = di._query_cache_dir(link, str(tmp_path))
+    assert di._query_cache_dir(link, str(tmp_path)) == source_dir
+    monkeypatch.setattr(di, "_QUERY_CACHE_VERSION", di._QUERY_CACHE_VERSION + 1)
+    assert di._query_cache_dir(link, str(tmp_path)) != source_dir
+
+
+def test_segments_of_another_version_are_skipped(tmp_path):
+    source_dir = di._query_cache_dir("http://example.org/dbSnp153.bb", str(tmp_path))
+    di._write_query_cache(source_dir, {("1", 100): "current"}, [("1", 200)], [])
+    with open(os.path.join(source_dir, "old.pkl"), "wb") as f:
+        pickle.dump({"found": {("1", 300): "stale"}, "missing": set(), "unknown": set()}, f)
+    found, missing, unknown = di._read_query_cache(source_dir)
+    assert found == {("1", 100): "current"}
+    assert missing == {("1", 200)}
+    assert unknown == set()
+
+
+def test_segments_are_compacted_above_the_threshold(tmp_path, monkeypatch):
+    monkeypatch.setattr(di, "_QUERY_CACHE_MAX_SEGMENTS", 4)
+    source_dir = di._query_cache_dir("http://example.org/dbSnp153.bb", str(tmp_path))
+    for i in range(4):
+        di._write_query_cache(source_dir, {("1", i): "rs" + str(i)}, [("2", i)], [])
+    di._read_query_cache(source_dir)
+    assert len(segment_names(source_dir)) == 4
+    di._write_query_cache(source_dir, {("1", 4): "rs4"}, [("2", 4)], [("3", 4)])
+    found, missing, unknown = di._read_query_cache(source_dir)
+    assert len(segment_names(source_dir)) == 1
+    assert di._read_query_cache(source_dir) == (found, missing, unknown)
+    assert found == {("1", i): "rs" + str(i) for i in range(5)}
+    assert missing == {("2", i) for i in range(5)}
+    assert unknown == {("3", 4)}
@@ -0,0 +1,90 @@
+import pandas as pd
+import pytest
+
+from conftest import study_at_records
+from dataintegrator import DataIntegrator as di
+
+LINK = "dbSnp153.bb"
+
+
+def query_with_counts(df, **kwargs):
+    records = []
+    hook = di.add_metrics_hook(records.append)
+    try:
+        result = di.query_data(df, LINK, **kwargs)
+    finally:
+        di.remove_metrics_hook(hook)
+    counts = [record for record in records if record["function"] == "query_data"][0]["counts"]
+    result = result.sort_values(["Chr", "BP"]).reset_index(drop=True)
+    return result, counts.get("not_found", 0), counts.get("unmatched_chrom", 0)
+
+
+@pytest.mark.parametrize("window", [1, 1000, 100000])
+def test_window_query_matches_the_row_by_row_query(dbsnp, window):
+    df = study_at_records(dbsnp, 3000)
+    result, not_found, unmatched = query_with_counts(df)
+    window_result, window_not_found, window_unmatched = query_with_counts(df, window=window)
+    pd.testing.assert_frame_equal(window_result, result)
+    assert (window_not_found, window_unmatched) == (not_found, unmatched)
+    # every row has an exact single base match, is not found, or cannot be queried (chromosome 3, past the end)
+    keys = set(zip(result["Chr"], result["BP"]))
+    matched = sum((chrom, bp) in keys for chrom, bp in zip(df["Chr"], df["BP"]))
+    assert matched + not_found + unmatched == len(df)
+    assert unmatched > (df["Chr"] == "3").sum() > 0
+    assert not_found > 0
+
+
+@pytest.mark.parametrize("window", [None, 1000])
+def test_worker_query_matches_the_row_by_row_query(dbsnp, window):
+    df = study_at_records(dbsnp, 3000, seed=1)
+    expected = query_with_counts(df)
+    # small chunks, so each chromosome (also the unknown chromosome 3) is split over several tasks
+    result = query_with_counts(df, workers=2, window=window, chunk_size=200)
+    pd.testing.assert_frame_equal(result[0], expected[0])
+    assert result[1:] == expected[1:]
+    assert (df["Chr"] == "3").sum() > 200
+
+
+def test_entries_are_parsed_up_to_the_fields_asked_for():
+    entry = "rs12\tA\t2\tC,T,\t0\t0,"
+    assert di._parse_dbsnp_entry(entry, ["name", "ref", "alts"]) == ("rs12", "A", "C,T")
+    assert di._parse_dbsnp_entry(entry, ["name", "alts"]) == ("rs12", "C,T")
+    assert di._parse_dbsnp_entry(entry, ["ref"]) == ("A",)
+    assert di._parse_dbsnp_entry("rs12", ["name"]) == ("rs12",)
+
+
+@pytest.mark.parametrize("window", [None, 1000])
+def test_only_the_fields_asked_for_are_parsed(dbsnp, monkeypatch, window):
+    df = study_at_records(dbsnp, 1000)
+    expected = query_with_counts(df, window=window)[0]
+    parse = di._parse_dbsnp_entry
+    parsed_fields = set()
+
+    def recording_parse(raw_string, fields):
+        parsed_fields.add(tuple(fields))
+        return parse(raw_string, fields)
+
+    monkeypatch.setattr(di, "_parse_dbsnp_entry", recording_parse)
+    for fields, columns in [(["name"], ["name"]), (["alts", "ref"], ["ref", "alts"])]:
+        result = query_with_counts(df, window=window, fields=fields)[0]
+        pd.testing.assert_frame_equal(result, expected[["Chr", "BP"] + columns])
+    assert parsed_fields == {("name",), ("ref", "alts")}
+
+
+def test_cache_keeps_all_the_fields(dbsnp, tmp_path):
+    df = study_at_records(dbsnp, 1000)
+    expected = query_with_counts(df)[0]
+    name = query_with_counts(df, fields=["name"], cache_dir=str(tmp_path))[0]
+    pd.testing.assert_frame_equal(name, expected[["Chr", "BP", "name"]])
+    # the next query of all the fields is answered by the cache
+    pd.testing.assert_frame_equal(query_with_counts(df, cache_dir=str(tmp_path))[0], expected)
+
+
+def test_cached_query_counts_as_the_query(dbsnp, tmp_path):
+    df = study_at_records(dbsnp, 1000, seed=4)
+    expected = query_with_counts(df)
+    # the first query fills the cache, the second is answered by it
+    for run in range(2):
+        result = query_with_counts(df, cache_dir=str(tmp_path))
+        pd.testing.assert_frame_equal(result[0], expected[0])
+        assert result[1:] == expected[1:]
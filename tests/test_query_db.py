@@ -0,0 +1,39 @@
+import pandas as pd
+import pytest
+
+from conftest import make_study
+from dataintegrator import DataIntegrator as di
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_rows_scanned_are_counted_with_worker_threads(tmp_path, workers):
+    df = di.sort_by_chr_bp(make_study(20000, max_bp=1 << 20))
+    di.save_data(str(tmp_path), df, "indexed", save_format="bgzip")
+    di.save_data(str(tmp_path), df, "plain")
+    records = []
+    hook = di.add_metrics_hook(records.append)
+    try:
+        result = di.query_db([str(tmp_path / "indexed.tsv.gz"), str(tmp_path / "plain.gz")], chrom="1", start=1, end=100000, workers=workers)
+    finally:
+        di.remove_metrics_hook(hook)
+    expected = df[(df["Chr"] == "1") & (df["BP"] <= 100000)]
+    assert len(result) == 2 * len(expected)
+    counts = [record for record in records if record["function"] == "query_db"][0]["counts"]
+    assert counts["tabix_files"] == 1
+    assert counts["scan_files"] == 1
+    # the whole plain file is parsed, only the first blocks of the indexed one
+    assert 20000 + len(expected) <= counts["rows_scanned"] < 2 * 20000
+
+
+@pytest.mark.parametrize("prefix", ["", "chr"])
+@pytest.mark.parametrize("save_format, name", [("bgzip", "study.tsv.gz"), ("parquet", "study.parquet"), ("gzip", "study.gz")])
+def test_regions_match_chromosomes_with_or_without_the_chr_prefix(tmp_path, prefix, save_format, name):
+    df = di.sort_by_chr_bp(make_study(20000, max_bp=1 << 20)).reset_index(drop=True)
+    expected = df[((df["Chr"] == "1") & (df["BP"] > 1000) & (df["BP"] <= 200000)) | ((df["Chr"] == "X") & (df["BP"] <= 5000))]
+    df["Chr"] = prefix + df["Chr"]
+    di.save_data(str(tmp_path), df, "study", save_format=save_format)
+    for chroms in [["1", "X"], ["chr1", "chrX"]]:
+        result = di.query_db(str(tmp_path / name), regions=pd.DataFrame({"chrom": chroms, "start": [1000, 0], "end": [200000, 5000]}))
+        assert len(expected) > 0
+        assert result["SNP"].tolist() == expected["SNP"].tolist()
+        assert set(result["Chr"]) == {prefix + "1", prefix + "X"}
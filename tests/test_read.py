@@ -0,0 +1,99 @@
+import gzip
+import io
+
+import pandas as pd
+import pytest
+
+from conftest import make_study
+from dataintegrator import DataIntegrator as di
+
+
+def raw_study(rows):
+    # the study with the column names of a raw input file
+    return make_study(rows).rename(columns={"Chr": "chrom", "BP": "pos", "SNP": "id", "P": "pval"})
+
+
+def read_raw(path, **kwargs):
+    return di.read_data(path, "chrom", "pos", "id", "A1", "A2", "EAF", "Beta", "Se", "pval", **kwargs)
+
+
+def write_bgzf(path, df, sep):
+    di._write_bgzf_table(str(path), di._row_chunks(df, 1000), sep=sep)
+
+
+@pytest.fixture
+def small_reads(monkeypatch):
+    # a few blocks per read, so the data is decompressed in many parts by several threads
+    monkeypatch.setattr(di, "_BGZF_READ_SIZE", 1 << 16)
+
+
+@pytest.mark.parametrize("chunksize", [None, 777])
+def test_threaded_bgzf_read_matches_the_pandas_read(tmp_path, small_reads, chunksize):
+    di.save_data(str(tmp_path), make_study(20000), "study")
+    path = str(tmp_path / "study.gz")
+    assert di._is_bgzf(path)
+    threaded = di.read_formatted_data(path, chunksize=chunksize, threads=4)
+    single = di.read_formatted_data(path, chunksize=chunksize, threads=1)
+    if chunksize is not None:
+        threaded, single = pd.concat(threaded, ignore_index=True), pd.concat(single, ignore_index=True)
+    pd.testing.assert_frame_equal(threaded, single)
+
+
+@pytest.mark.parametrize("chunksize", [None, 777])
+def test_threaded_bgzf_read_of_raw_data_matches_the_pandas_read(tmp_path, small_reads, chunksize):
+    path = tmp_path / "raw.tsv.gz"
+    write_bgzf(path, raw_study(20000), "\t")
+    threaded = read_raw(str(path), chunksize=chunksize, threads=4)
+    single = read_raw(str(path), chunksize=chunksize, threads=1)
+    if chunksize is not None:
+        threaded, single = pd.concat(threaded, ignore_index=True), pd.concat(single, ignore_index=True)
+    pd.testing.assert_frame_equal(threaded, single)
+
+
+def test_plain_gzip_is_read_by_pandas(tmp_path):
+    path = str(tmp_path / "plain.gz")
+    with gzip.open(path, "wt") as f:
+        make_study(1000).to_csv(f, index=False)
+    assert not di._is_bgzf(path)
+    pd.testing.assert_frame_equal(di.read_formatted_data(path), di.read_formatted_data(path, threads=1))
+
+
+def test_truncated_bgzf_file_is_an_error(tmp_path):
+    path = tmp_path / "study.gz"
+    di.save_data(str(tmp_path), make_study(20000), "study")
+    data = path.read_bytes()
+    path.write_bytes(data[:len(data) // 2])
+    with pytest.raises(ValueError):
+        di.read_formatted_data(str(path), threads=2)
+
+
+def test_buffers_are_not_bgzf_and_read_by_pandas(tmp_path):
+    di.save_data(str(tmp_path), make_study(1000), "study")
+    data = (tmp_path / "study.gz").read_bytes()
+    assert not di._is_bgzf(io.BytesIO(data))
+    result = di._read_gzip_text(io.BytesIO(data), None, header=0)
+    pd.testing.assert_frame_equal(result, pd.read_csv(tmp_path / "study.gz", compression="gzip", header=0))
+
+
+def test_path_and_buffer_inputs_are_read_as_before(tmp_path):
+    # read as in the first versions of the package: pandas took paths, path-likes and open files
+    di.save_data(str(tmp_path), make_study(1000), "study")
+    expected = di.read_formatted_data(str(tmp_path / "study.gz"))
+    pd.testing.assert_frame_equal(di.read_formatted_data(tmp_path / "study.gz"), expected)
+    with open(tmp_path / "study.gz", "rb") as f:
+        pd.testing.assert_frame_equal(di.read_formatted_data(f), expected)
+    buffer = io.BytesIO((tmp_path / "study.gz").read_bytes())
+    pd.testing.assert_frame_equal(pd.concat(di.read_formatted_data(buffer, chunksize=300), ignore_index=True), expected)
+    path = tmp_path / "raw.tsv.gz"
+    write_bgzf(path, raw_study(1000), "\t")
+    expected = read_raw(str(path))
+    pd.testing.assert_frame_equal(read_raw(path), expected)
+    pd.testing.assert_frame_equal(read_raw(io.BytesIO(path.read_bytes())), expected)
+
+
+def test_path_inputs_of_arrow_formats(tmp_path):
+    pytest.importorskip("pyarrow")
+    di.save_data(str(tmp_path), make_study(1000), "study", save_format="parquet")
+    expected = di.read_formatted_data(str(tmp_path / "study.parquet"))
+    pd.testing.assert_frame_equal(di.read_formatted_data(tmp_path / "study.parquet"), expected)
+    assert len(expected) == 1000
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_study
+from dataintegrator import DataIntegrator as di
+
+CHROMS = [str(chrom) for chrom in range(1, 23)] + ["X", "Y"]
+
+
+# sort_by_chr_bp as it was written: a numeric chromosome column, then a sort on it and BP
+def old_sort_by_chr_bp(df):
+    df = df.assign(chr_numeric=lambda x: x["Chr"].apply(lambda y: 23 if y == "X" else (24 if y == "Y" else int(y))))
+    return df.sort_values(by=["chr_numeric", "BP"]).drop(["chr_numeric"], axis=1).reset_index(drop=True)
+
+
+# a study on all the chromosomes, with many repeated Chr + BP (to check that their rows keep their order) and some
+# missing BP
+def study_on_all_chromosomes(rows, seed):
+    rng = np.random.default_rng(seed)
+    df = make_study(rows, seed).assign(Chr=rng.choice(CHROMS, rows), BP=rng.integers(1, 300, rows) * 1000003)
+    df = df.astype({"Chr": "string", "BP": "Int64"})
+    df.loc[rng.random(rows) < 0.02, "BP"] = pd.NA
+    return df
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_sort_matches_the_old_sort(seed):
+    df = study_on_all_chromosomes(20000, seed)
+    expected = old_sort_by_chr_bp(df)
+    assert not di.is_sorted_by_chr_bp(df)
+    result = di.sort_by_chr_bp(df)
+    pd.testing.assert_frame_equal(result, expected)
+    assert di.is_sorted_by_chr_bp(result)
+    # sorted data is returned as it is
+    pd.testing.assert_frame_equal(di.sort_by_chr_bp(expected), expected)
+
+
+def test_is_sorted_finds_one_row_out_of_order():
+    df = old_sort_by_chr_bp(study_on_all_chromosomes(2000, 0).dropna(subset=["BP"]))
+    assert di.is_sorted_by_chr_bp(df)
+    for first, second in [(0, 1), (len(df) - 2, len(df) - 1), (100, 1500)]:
+        swapped = df.copy()
+        if tuple(swapped.loc[first, ["Chr", "BP"]]) == tuple(swapped.loc[second, ["Chr", "BP"]]):
+            continue
+        swapped.iloc[[first, second]] = swapped.iloc[[second, first]].to_numpy()
+        assert not di.is_sorted_by_chr_bp(swapped)
+    # "10" comes after "9", not after "1"
+    assert di.is_sorted_by_chr_bp(pd.DataFrame({"Chr": ["1", "9", "10", "X", "Y"], "BP": [5, 1, 1, 1, 1]}))
+    assert not di.is_sorted_by_chr_bp(pd.DataFrame({"Chr": ["1", "10", "9"], "BP": [5, 1, 1]}))
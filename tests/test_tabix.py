@@ -0,0 +1,83 @@
+import gzip
+import struct
+
+import pandas as pd
+import pytest
+
+from conftest import make_study
+from dataintegrator import DataIntegrator as di
+
+
+def index_header(path):
+    data = gzip.decompress(open(path, "rb").read())
+    magic, n_ref, file_format, seq_col, pos_col, end_col, meta, skip, name_length = struct.unpack_from("<4s8i", data, 0)
+    n_no_coor = struct.unpack_from("<Q", data, len(data) - 8)[0] if n_ref == 0 else None
+    return {"n_ref": n_ref, "seq_col": seq_col, "pos_col": pos_col, "end_col": end_col, "skip": skip,
+            "name_length": name_length, "n_no_coor": n_no_coor}
+
+
+def test_index_uses_the_position_column_as_end_column(tmp_path):
+    di.save_data(str(tmp_path), make_study(100, max_bp=1 << 20), "study", save_format="bgzip")
+    header = index_header(tmp_path / "study.tsv.gz.tbi")
+    assert (header["seq_col"], header["pos_col"], header["end_col"], header["skip"]) == (1, 2, 2, 1)
+
+
+def test_create_tbi_index_gives_the_index_written_with_the_data(tmp_path):
+    di.save_data(str(tmp_path), make_study(20000, max_bp=1 << 20), "study", save_format="bgzip")
+    path = str(tmp_path / "study.tsv.gz")
+    expected = gzip.decompress(open(path + ".tbi", "rb").read())
+    di.create_tbi_index(path)
+    assert gzip.decompress(open(path + ".tbi", "rb").read()) == expected
+
+
+@pytest.mark.parametrize("rows", [slice(0, 0), slice(None)])
+def test_data_without_records_is_saved_with_an_empty_index(tmp_path, rows):
+    df = make_study(5)
+    df["Chr"] = pd.array([None] * len(df), dtype="string")
+    df = df.iloc[rows]
+    di.save_data(str(tmp_path), df, "empty", save_format="bgzip")
+    path = tmp_path / "empty.tsv.gz"
+    assert open(path, "rb").read().endswith(di._BGZF_EOF)
+    header = index_header(str(path) + ".tbi")
+    assert (header["n_ref"], header["name_length"], header["n_no_coor"]) == (0, 0, len(df))
+    result = di.query_db(str(path), chrom="1")
+    assert result.empty
+    assert list(result.columns) == list(df.columns)
+    di.create_tbi_index(str(path))
+    assert index_header(str(path) + ".tbi")["n_ref"] == 0
+
+
+def test_index_of_a_file_without_lines(tmp_path):
+    path = str(tmp_path / "nothing.tsv.gz")
+    with open(path, "wb") as f:
+        di._write_bgzf(f, [])
+    di.create_tbi_index(path)
+    assert index_header(path + ".tbi")["n_ref"] == 0
+
+
+def test_query_db_reads_the_regions(tmp_path):
+    df = di.sort_by_chr_bp(make_study(20000, max_bp=1 << 20)).reset_index(drop=True)
+    di.save_data(str(tmp_path), df, "study", save_format="bgzip")
+    regions = pd.DataFrame({"chrom": ["chr1", "X", "2"], "start": [1000, 500000, 0], "end": [200000, 510000, 50]})
+    result = di.query_db(str(tmp_path / "study.tsv.gz"), regions=regions)
+    expected = df[((df["Chr"] == "1") & (df["BP"] > 1000) & (df["BP"] <= 200000))
+                  | ((df["Chr"] == "X") & (df["BP"] > 500000) & (df["BP"] <= 510000))
+                  | ((df["Chr"] == "2") & (df["BP"] <= 50))]
+    assert result["SNP"].tolist() == expected["SNP"].tolist()
+
+
+def test_index_is_read_by_tabix(tmp_path):
+    pysam = pytest.importorskip("pysam")
+    df = di.sort_by_chr_bp(make_study(20000, max_bp=1 << 20)).reset_index(drop=True)
+    di.save_data(str(tmp_path), df, "study", save_format="bgzip")
+    path = str(tmp_path / "study.tsv.gz")
+    with pysam.TabixFile(path) as tbx:
+        assert sorted(tbx.contigs) == ["1", "2", "X"]
+        for chrom, beg, end in [("1", 1000, 200000), ("X", 500000, 510000), ("2", 0, 1 << 20)]:
+            snps = [line.split("\t")[2] for line in tbx.fetch(chrom, beg, end)]
+            expected = df[(df["Chr"] == chrom) & (df["BP"] > beg) & (df["BP"] <= end)]
+            assert snps == expected["SNP"].tolist()
+    # tabix builds an index with the same columns
+    pysam.tabix_index(path, seq_col=0, start_col=1, end_col=1, line_skip=1, force=True, keep_original=True)
+    header = index_header(path + ".tbi")
+    assert (header["seq_col"], header["pos_col"], header["end_col"]) == (1, 2, 2)